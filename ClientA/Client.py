@@ -5,37 +5,57 @@ import importlib.util
 import subprocess
 import tempfile
 import time
-import hashlib
-import random
-import sympy
+import sys
 
-def generate_deterministic_prime(request_id):
+# Worker processes and chunk size for the PSI modular exponentiation
+PSI_WORKERS = os.cpu_count() or 1
+PSI_CHUNK_SIZE = 2048
+# Rows per chunk when streaming the dataset in PSI step 1 (0 loads the whole file)
+PSI_STREAM_CHUNK_ROWS = 0
+# Format of the exchanged match data and the final result ("parquet", "arrow", "csv" or "xlsx";
+# None picks parquet when pyarrow is installed, else csv), and whether to also export the result as xlsx
+PSI_RESULT_FORMAT = None
+PSI_EXPORT_XLSX = True
+# Memory budget in bytes of the step 3 intersection, larger sets are sorted on disk (0 keeps it in memory)
+PSI_INTERSECTION_MEMORY = 0
+# Number of buckets the step 2 k values are split into for a partitioned step 3 (0 sends a single file)
+PSI_BUCKETS = 0
+# Share fingerprints of the step 2 k values with this per-row false-positive rate (0 sends full values);
+# the cardinality output may count these false matches, the records output seals candidate records
+PSI_K_FP_RATE = 0
+# Directory of the dataset registry caching record hashes and data columns across requests, e.g.
+# os.path.join(os.path.dirname(os.path.abspath(__file__)), "psi_datasets") (None disables it). The cache
+# holds plain copies of the data columns; entries unused for PSI_DATASET_REGISTRY_MAX_AGE seconds are
+# dropped, then the least recently used ones while it exceeds PSI_DATASET_REGISTRY_MAX_BYTES
+PSI_DATASET_REGISTRY = None
+PSI_DATASET_REGISTRY_MAX_BYTES = 4 << 30
+PSI_DATASET_REGISTRY_MAX_AGE = 30 * 24 * 3600
+
+def open_local_db():
     """
-    Generate a deterministic prime number from a request ID.
-    
-    Args:
-        request_id (str): The request ID to use as a seed
-    
-    Returns:
-        int: A large prime number derived from the request ID
+    Open the local record database (CIDs and group parameters of merge requests)
     """
-    # Use the request_id as a seed for the random generator
-    # This ensures that the same request_id always produces the same prime
-    seed = int(hashlib.sha256(request_id.encode()).hexdigest(), 16)
-    random.seed(seed)
-    
-    # Generate a random number in the range 2^511 to 2^512 - 1
-    lower_bound = 2**511
-    upper_bound = 2**512 - 1
-    candidate = random.randint(lower_bound, upper_bound)
-    
-    # Find the next prime after the candidate
-    prime = sympy.nextprime(candidate)
-    
-    # Reset the random seed to ensure it doesn't affect other operations
-    random.seed()
-    
-    return prime
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    db_path = os.path.join(current_dir, "id_record.db")
+    db_module_path = os.path.join(current_dir, "id_database.py")
+    spec = importlib.util.spec_from_file_location("id_database", db_module_path)
+    db_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(db_module)
+    return db_module.LocalDBManager(db_path)
+
+def cached_group_prime(request_id, config):
+    """
+    Return the prime of a request from the local group parameter cache, filled when
+    step 1 starts, so a reloaded PSI context never recomputes it
+    Falls back to the prime saved in psi_config.json
+    """
+    if request_id:
+        local_db = open_local_db()
+        group_params = local_db.get_group_params(request_id)
+        local_db.close()
+        if group_params:
+            return group_params["prime"]
+    return config.get("prime")
 
 def main():
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -191,6 +211,8 @@ def main():
                         psi_module_path = os.path.join(current_dir, "psi_dh.py")
                         spec = importlib.util.spec_from_file_location("psi_dh", psi_module_path)
                         psi_module = importlib.util.module_from_spec(spec)
+                        # Register the module so process pool workers can unpickle its functions
+                        sys.modules[spec.name] = psi_module
                         spec.loader.exec_module(psi_module)
                         
                         # Create output directory for PSI files
@@ -201,8 +223,19 @@ def main():
                         excel_path = psi_params["excel_path"]
                         id_columns = psi_params["id_columns"]
                         private_key = psi_params["private_key"]
-                        prime = psi_params["prime"]
                         request_id = psi_params.get("request_id", "")
+                        psi_mode = psi_params.get("psi_mode", "modp")
+                        # The prime of an RFC 3526 group profile is not sent, it is known by name
+                        group_params = psi_params.get("group_params", {"psi_mode": psi_mode})
+                        prime = psi_params["prime"] or psi_module.GROUP_PROFILES[group_params["profile"]]["prime"]
+                        psi_output = psi_params.get("psi_output", "records")
+                        incremental = psi_params.get("incremental", False)
+                        
+                        # Cache the group parameters of the request for the later steps
+                        if request_id:
+                            local_db = open_local_db()
+                            local_db.record_group_params(request_id, dict(group_params, prime=prime))
+                            local_db.close()
                         
                         result = psi_module.run_psi_protocol(
                             excel_path=excel_path,
@@ -212,7 +245,16 @@ def main():
                             prime=prime,
                             output_dir=output_dir,
                             request_id=request_id,
-                            step=1
+                            step=1,
+                            workers=PSI_WORKERS,
+                            chunk_size=PSI_CHUNK_SIZE,
+                            psi_mode=psi_mode,
+                            stream_chunk_rows=PSI_STREAM_CHUNK_ROWS,
+                            psi_output=psi_output,
+                            incremental=incremental,
+                            dataset_registry=PSI_DATASET_REGISTRY,
+                            dataset_registry_max_bytes=PSI_DATASET_REGISTRY_MAX_BYTES,
+                            dataset_registry_max_age=PSI_DATASET_REGISTRY_MAX_AGE
                         )
                         
                         # Store context for later steps
@@ -221,6 +263,9 @@ def main():
                         psi_context["data_columns"] = psi_params.get("data_columns", [])
                         psi_context["private_key"] = private_key
                         psi_context["prime"] = prime
+                        psi_context["psi_mode"] = psi_mode
+                        psi_context["psi_output"] = psi_output
+                        psi_context["incremental"] = incremental
                         psi_context["output_dir"] = output_dir
                         psi_context["request_id"] = psi_params.get("request_id", "")
                         
@@ -243,6 +288,8 @@ def main():
                         psi_module_path = os.path.join(current_dir, "psi_dh.py")
                         spec = importlib.util.spec_from_file_location("psi_dh", psi_module_path)
                         psi_module = importlib.util.module_from_spec(spec)
+                        # Register the module so process pool workers can unpickle its functions
+                        sys.modules[spec.name] = psi_module
                         spec.loader.exec_module(psi_module)
                         
                         # Check if all required context exists
@@ -258,11 +305,11 @@ def main():
                                     psi_context["data_columns"] = config.get("data_columns")
                                     psi_context["private_key"] = config.get("private_key")
                                     psi_context["request_id"] = config.get("request_id")
-                                    # If we have the request_id, regenerate the prime deterministically
-                                    if "request_id" in psi_context and psi_context["request_id"]:
-                                        psi_context["prime"] = generate_deterministic_prime(psi_context["request_id"])
-                                    else:
-                                        psi_context["prime"] = config.get("prime")
+                                    psi_context["psi_mode"] = config.get("psi_mode", "modp")
+                                    psi_context["psi_output"] = config.get("psi_output", "records")
+                                    psi_context["incremental"] = config.get("incremental", False)
+                                    # The group parameters of the request are cached locally since step 1
+                                    psi_context["prime"] = cached_group_prime(psi_context["request_id"], config)
                                     psi_context["output_dir"] = output_dir
                         
                         # Execute PSI step 2
@@ -275,7 +322,14 @@ def main():
                             output_dir=psi_context.get("output_dir", output_dir),
                             request_id=psi_context.get("request_id", ""),
                             partner_cid_c=partner_cid,
-                            step=2
+                            step=2,
+                            workers=PSI_WORKERS,
+                            chunk_size=PSI_CHUNK_SIZE,
+                            psi_mode=psi_context.get("psi_mode", "modp"),
+                            psi_output=psi_context.get("psi_output", "records"),
+                            incremental=psi_context.get("incremental", False),
+                            buckets=PSI_BUCKETS,
+                            k_fp_rate=PSI_K_FP_RATE
                         )
                         
                         # Return CID to the server
@@ -297,6 +351,8 @@ def main():
                         psi_module_path = os.path.join(current_dir, "psi_dh.py")
                         spec = importlib.util.spec_from_file_location("psi_dh", psi_module_path)
                         psi_module = importlib.util.module_from_spec(spec)
+                        # Register the module so process pool workers can unpickle its functions
+                        sys.modules[spec.name] = psi_module
                         spec.loader.exec_module(psi_module)
                         
                         # Check if all required context exists
@@ -312,11 +368,11 @@ def main():
                                     psi_context["data_columns"] = config.get("data_columns")
                                     psi_context["private_key"] = config.get("private_key")
                                     psi_context["request_id"] = config.get("request_id")
-                                    # If we have the request_id, regenerate the prime deterministically
-                                    if "request_id" in psi_context and psi_context["request_id"]:
-                                        psi_context["prime"] = generate_deterministic_prime(psi_context["request_id"])
-                                    else:
-                                        psi_context["prime"] = config.get("prime")
+                                    psi_context["psi_mode"] = config.get("psi_mode", "modp")
+                                    psi_context["psi_output"] = config.get("psi_output", "records")
+                                    psi_context["incremental"] = config.get("incremental", False)
+                                    # The group parameters of the request are cached locally since step 1
+                                    psi_context["prime"] = cached_group_prime(psi_context["request_id"], config)
                                     psi_context["output_dir"] = output_dir
                         
                         # Execute PSI step 3
@@ -329,12 +385,28 @@ def main():
                             output_dir=psi_context.get("output_dir", output_dir),
                             request_id=psi_context.get("request_id", ""),
                             partner_cid_k=partner_cid,
-                            step=3
+                            step=3,
+                            workers=PSI_WORKERS,
+                            chunk_size=PSI_CHUNK_SIZE,
+                            psi_mode=psi_context.get("psi_mode", "modp"),
+                            psi_output=psi_context.get("psi_output", "records"),
+                            incremental=psi_context.get("incremental", False),
+                            result_format=PSI_RESULT_FORMAT,
+                            intersection_memory=PSI_INTERSECTION_MEMORY
                         )
                         
                         # Return CID to the server
-                        cid = result["step3"]["cid_match"]
-                        response = createMessage("info", f"PSI Step 3 completed. CID: {cid}", False)
+                        if "estimate" in result["step3"]:
+                            # Sketch mode only estimates the overlap, report it with its interval
+                            estimate = result["step3"]
+                            response = createMessage("info", f"PSI Step 3 completed. Intersection size: ~{estimate['estimate']} (95% interval {estimate['lower']}-{estimate['upper']})", False)
+                        elif "cardinality" in result["step3"]:
+                            # Cardinality mode shares nothing further, report the count to the server
+                            cardinality = result["step3"]["cardinality"]
+                            response = createMessage("info", f"PSI Step 3 completed. Intersection size: {cardinality}", False)
+                        else:
+                            cid = result["step3"]["cid_match"]
+                            response = createMessage("info", f"PSI Step 3 completed. CID: {cid}", False)
                         client.send(json.dumps(response).encode())
                         
                     except Exception as e:
@@ -351,6 +423,8 @@ def main():
                         psi_module_path = os.path.join(current_dir, "psi_dh.py")
                         spec = importlib.util.spec_from_file_location("psi_dh", psi_module_path)
                         psi_module = importlib.util.module_from_spec(spec)
+                        # Register the module so process pool workers can unpickle its functions
+                        sys.modules[spec.name] = psi_module
                         spec.loader.exec_module(psi_module)
                         
                         # Check if all required context exists
@@ -366,11 +440,11 @@ def main():
                                     psi_context["data_columns"] = config.get("data_columns")
                                     psi_context["private_key"] = config.get("private_key")
                                     psi_context["request_id"] = config.get("request_id")
-                                    # If we have the request_id, regenerate the prime deterministically
-                                    if "request_id" in psi_context and psi_context["request_id"]:
-                                        psi_context["prime"] = generate_deterministic_prime(psi_context["request_id"])
-                                    else:
-                                        psi_context["prime"] = config.get("prime")
+                                    psi_context["psi_mode"] = config.get("psi_mode", "modp")
+                                    psi_context["psi_output"] = config.get("psi_output", "records")
+                                    psi_context["incremental"] = config.get("incremental", False)
+                                    # The group parameters of the request are cached locally since step 1
+                                    psi_context["prime"] = cached_group_prime(psi_context["request_id"], config)
                                     psi_context["output_dir"] = output_dir
                         
                         # Execute PSI step 4
@@ -383,12 +457,22 @@ def main():
                             output_dir=psi_context.get("output_dir", output_dir),
                             request_id=psi_context.get("request_id", ""),
                             partner_cid_match=partner_cid,
-                            step=4
+                            step=4,
+                            workers=PSI_WORKERS,
+                            chunk_size=PSI_CHUNK_SIZE,
+                            psi_mode=psi_context.get("psi_mode", "modp"),
+                            psi_output=psi_context.get("psi_output", "records"),
+                            incremental=psi_context.get("incremental", False),
+                            result_format=PSI_RESULT_FORMAT,
+                            export_xlsx=PSI_EXPORT_XLSX
                         )
                         
                         # Final result file path
                         final_file_path = result["step4"]["final_file_path"]
-                        response = createMessage("info", f"PSI Protocol completed. Final result saved to: {final_file_path}", False)
+                        message = f"PSI Protocol completed. Final result saved to: {final_file_path}"
+                        if result["step4"].get("export_file_path"):
+                            message += f" (Excel export: {result['step4']['export_file_path']})"
+                        response = createMessage("info", message, False)
                         client.send(json.dumps(response).encode())
                         
                     except Exception as e:
@@ -1,5 +1,6 @@
 import sqlite3
 import os
+import json
 import threading
 
 class LocalDBManager:
@@ -32,6 +33,14 @@ class LocalDBManager:
                 )
                 """
             )
+            self.cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS GROUP_PARAMS (
+                    request_id TEXT PRIMARY KEY,
+                    params TEXT
+                )
+                """
+            )
             self.conn.commit()
         return
     
@@ -155,6 +164,51 @@ class LocalDBManager:
             print(f"Error retrieving all merge records: {e}")
             return []
     
+    def record_group_params(self, request_id, params):
+        """
+        Cache the group parameters (prime, PSI mode) the server sent for a request
+        
+        Args:
+            request_id (str): The merge request ID
+            params (dict): The group parameters
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            with LocalDBManager._lock:
+                self.cursor.execute(
+                    "INSERT OR REPLACE INTO GROUP_PARAMS (request_id, params) VALUES (?, ?)",
+                    (request_id, json.dumps(params))
+                )
+                self.conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error recording group parameters: {e}")
+            return False
+    
+    def get_group_params(self, request_id):
+        """
+        Get the cached group parameters of a request
+        
+        Args:
+            request_id (str): The merge request ID
+            
+        Returns:
+            dict: The group parameters, or None if not cached
+        """
+        try:
+            with LocalDBManager._lock:
+                self.cursor.execute(
+                    "SELECT params FROM GROUP_PARAMS WHERE request_id = ?",
+                    (request_id,)
+                )
+                record = self.cursor.fetchone()
+                return json.loads(record[0]) if record else None
+        except Exception as e:
+            print(f"Error retrieving group parameters: {e}")
+            return None
+    
     def close(self):
         """Close the database connection"""
         if self.conn:
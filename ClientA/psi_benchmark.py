@@ -0,0 +1,154 @@
+import argparse
+import random
+import time
+
+import sympy
+
+import psi_dh
+
+# Modulus sizes benchmarked by default, and bases per run at each size
+BENCHMARK_BITS = (512, 2048)
+BENCHMARK_BASES = {512: 2000, 2048: 200}
+# Records per group profile, and the default security bar of the profile recommendation
+PROFILE_RECORDS = 200
+PROFILE_MIN_SECURITY = 112
+
+def benchmark_prime(bits: int, seed: int = 0) -> int:
+    """
+    Return a reproducible random prime of the given bit length
+    """
+    rng = random.Random(seed * 65537 + bits)
+    return sympy.nextprime(rng.getrandbits(bits) | (1 << (bits - 1)))
+
+def time_backend(name: str, bases: list, exponent: int, modulus: int, rounds: int) -> tuple:
+    """
+    Return the best time of a backend over rounds runs and its results
+    """
+    backend = psi_dh.MODEXP_BACKENDS[name]
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        results = backend.powmod_batch(bases, exponent, modulus)
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+def benchmark_modexp(bits: int, count: int, rounds: int = 3, seed: int = 0) -> list:
+    """
+    Time every modexp backend on count bases with one fixed exponent against built-in pow()
+    Returns one row per backend: name, seconds, exponentiations per second, speedup over pow
+    and whether every result equals pow()
+    """
+    rng = random.Random(seed)
+    modulus = benchmark_prime(bits, seed)
+    exponent = rng.randint(2, modulus - 2)
+    bases = [rng.randrange(2, modulus) for _ in range(count)]
+
+    reference_time, reference = time_backend(psi_dh.PythonModExpBackend.name, bases, exponent, modulus, rounds)
+    rows = []
+    for name in psi_dh.MODEXP_BACKENDS:
+        elapsed, results = time_backend(name, bases, exponent, modulus, rounds)
+        rows.append({
+            "backend": name,
+            "seconds": elapsed,
+            "per_second": count / elapsed,
+            "speedup": reference_time / elapsed,
+            "identical": results == reference,
+        })
+    return rows
+
+def benchmark_profile(name: str, count: int, seed: int = 0) -> dict:
+    """
+    Run the step 1 and step 2 blinding of count record hashes in one group profile
+    Returns the records per second through both exponentiations, the bytes one record adds
+    to the exchanged c and k files, and the estimated security of the profile
+    """
+    profile = psi_dh.GROUP_PROFILES[name]
+    rng = random.Random(seed)
+    psi_mode = profile["psi_mode"]
+    if psi_mode == psi_dh.PSI_MODE_EC:
+        prime = psi_dh.ED25519_ORDER
+    else:
+        prime = profile["prime"] or benchmark_prime(profile["modulus_bits"], seed)
+
+    def private_key():
+        if psi_mode == psi_dh.PSI_MODE_EC:
+            return rng.randrange(1, psi_dh.ED25519_ORDER)
+        if profile["exponent_bits"]:
+            return rng.randrange(2, 2 ** profile["exponent_bits"])
+        return rng.randint(2, prime - 2)
+
+    key_a, key_b = private_key(), private_key()
+    hashes = [rng.getrandbits(8 * psi_dh.RECORD_HASH_BYTES) for _ in range(count)]
+
+    start = time.perf_counter()
+    c_values = psi_dh.blind_record_hashes(hashes, key_a, prime, psi_mode)
+    step1 = time.perf_counter() - start
+    start = time.perf_counter()
+    k_values = psi_dh.compute_second_blinded_values(c_values, key_b, prime, psi_mode=psi_mode)
+    step2 = time.perf_counter() - start
+
+    # Blinding in the other order must give the same k values
+    sample = hashes[:8]
+    other_order = psi_dh.compute_second_blinded_values(
+        psi_dh.blind_record_hashes(sample, key_b, prime, psi_mode), key_a, prime, psi_mode=psi_mode
+    )
+    width = psi_dh.value_width(prime, psi_mode)
+    return {
+        "profile": name,
+        "exponent_bits": profile["exponent_bits"] or prime.bit_length(),
+        "step1_per_second": count / step1,
+        "step2_per_second": count / step2,
+        "per_second": count / (step1 + step2),
+        "bytes_per_record": 2 * width,
+        "security_bits": psi_dh.profile_security_bits(profile),
+        "commutes": other_order == k_values[:len(sample)],
+    }
+
+def benchmark_profiles(count: int, min_security: int) -> None:
+    """
+    Print the throughput and artifact size of every group profile, and the fastest one
+    that meets the security bar
+    """
+    print(f"\nGroup profiles, {count} records, modexp backend {psi_dh.get_modexp_backend()}")
+    print(f"  {'profile':<11} {'exp bits':>8} {'step 1/s':>10} {'step 2/s':>10} {'records/s':>10} "
+          f"{'c+k bytes':>10} {'MB per 1M':>10} {'security':>9}  commutes")
+    rows = []
+    for name in psi_dh.GROUP_PROFILES:
+        row = benchmark_profile(name, count)
+        rows.append(row)
+        print(f"  {row['profile']:<11} {row['exponent_bits']:>8} {row['step1_per_second']:>10.0f} "
+              f"{row['step2_per_second']:>10.0f} {row['per_second']:>10.0f} {row['bytes_per_record']:>10} "
+              f"{row['bytes_per_record'] * 1e6 / 2**20:>10.0f} {row['security_bits']:>9}  {row['commutes']}")
+
+    eligible = [row for row in rows if row["security_bits"] >= min_security]
+    if eligible:
+        best = max(eligible, key=lambda row: row["per_second"])
+        print(f"  Fastest profile with at least {min_security}-bit security: {best['profile']}")
+    else:
+        print(f"  No profile reaches {min_security}-bit security")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PSI modular exponentiation backends against pow(), "
+                                                 "or the speed and artifact size of the group profiles")
+    parser.add_argument("--bits", type=int, nargs="+", default=list(BENCHMARK_BITS), help="modulus sizes in bits")
+    parser.add_argument("--count", type=int, default=0, help="bases per run (default depends on the size)")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per backend, the best one is reported")
+    parser.add_argument("--profiles", action="store_true", help="benchmark the group profiles instead of the backends")
+    parser.add_argument("--min-security", type=int, default=PROFILE_MIN_SECURITY,
+                        help="security bar in bits of the profile recommendation")
+    args = parser.parse_args()
+
+    if args.profiles:
+        benchmark_profiles(args.count or PROFILE_RECORDS, args.min_security)
+        return
+
+    for bits in args.bits:
+        count = args.count or BENCHMARK_BASES.get(bits, 500)
+        print(f"\n{bits}-bit modulus, {count} bases, full-width exponent")
+        print(f"  {'backend':<10} {'seconds':>10} {'exp/s':>12} {'vs pow':>8}  identical")
+        for row in benchmark_modexp(bits, count, args.rounds):
+            print(f"  {row['backend']:<10} {row['seconds']:>10.4f} {row['per_second']:>12.0f} "
+                  f"{row['speedup']:>7.2f}x  {row['identical']}")
+
+if __name__ == "__main__":
+    main()
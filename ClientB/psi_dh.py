@@ -1,25 +1,658 @@
 import pandas as pd
+import base64
+import csv
+import datetime
+import decimal
+import glob
 import hashlib
+import heapq
+import hmac
 import os
 import json
+import math
+import mmap
+import shutil
+import sqlite3
+import struct
 import importlib.util
+import io
 import subprocess
-from typing import List, Dict, Tuple, Set, Any
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from itertools import repeat
+from typing import List, Dict, Tuple, Set, Any, Iterator
 import numpy as np
 
-def load_excel_data(file_path: str) -> pd.DataFrame:
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+try:
+    from nacl import bindings as sodium
+except ImportError:
+    sodium = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+def _load_shared_module(name: str):
+    """
+    Load a module of the Shared directory next to the client directories
+    """
+    module_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Shared", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+group_profiles = _load_shared_module("group_profiles")
+
+# PSI modes: blinding by exponentiation modulo a shared prime, by scalar multiplication
+# on the prime-order subgroup of edwards25519, or by exponentiation in the prime-order
+# subgroup (the quadratic residues) of a safe-prime group, where hashes are squared first
+PSI_MODE_MODP = group_profiles.PSI_MODE_MODP
+PSI_MODE_EC = group_profiles.PSI_MODE_EC
+PSI_MODE_MODP_QR = group_profiles.PSI_MODE_MODP_QR
+PSI_MODES = (PSI_MODE_MODP, PSI_MODE_EC, PSI_MODE_MODP_QR)
+
+# PSI outputs: the matching records of both parties, only the size of the intersection
+# (shuffled k values, no step 3 match data and no step 4), or an estimate of that size
+# from HyperLogLog sketches of the k values
+PSI_OUTPUT_RECORDS = "records"
+PSI_OUTPUT_CARDINALITY = "cardinality"
+PSI_OUTPUT_ESTIMATE = "estimate"
+PSI_OUTPUTS = (PSI_OUTPUT_RECORDS, PSI_OUTPUT_CARDINALITY, PSI_OUTPUT_ESTIMATE)
+
+def _check_columns(header: List[Any], columns: List[str], file_path: str):
+    """
+    Raise if any requested column is missing from a file header
+    """
+    missing_columns = [col for col in columns if col not in header]
+    if missing_columns:
+        raise ValueError(
+            f"Columns {missing_columns} not found in {file_path}. Available columns: {list(header)}"
+        )
+
+def load_excel_data(file_path: str, columns: List[str] = None) -> pd.DataFrame:
     """
     Load Excel file into a pandas DataFrame
+    With columns given, the header is checked first and only those columns are parsed
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Excel file not found: {file_path}")
     
+    if columns is not None:
+        try:
+            header = pd.read_excel(file_path, nrows=0).columns.tolist()
+        except Exception as e:
+            raise ValueError(f"Failed to read Excel file: {str(e)}")
+        _check_columns(header, columns, file_path)
+        columns = list(dict.fromkeys(columns))
+    
     try:
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(file_path, usecols=columns)
         return df
     except Exception as e:
         raise ValueError(f"Failed to read Excel file: {str(e)}")
 
+# Default number of data rows per chunk when step 1 streams the dataset
+STREAM_CHUNK_ROWS = 100000
+
+def _convert_excel_cell(cell) -> Any:
+    """
+    Convert an openpyxl cell to the value pd.read_excel would see for it
+    """
+    if cell.value is None:
+        return ""
+    if cell.data_type == "e":
+        return np.nan
+    if cell.data_type == "n":
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+def _parse_excel_rows(header: List[Any], rows: List[List[Any]], width: int, dtypes: Dict[Any, Any] = None) -> pd.DataFrame:
+    """
+    Type a block of converted rows with the same parser pd.read_excel uses
+    """
+    from pandas.io.parsers import TextParser
+
+    padded = [row + [""] * (width - len(row)) for row in [header] + rows]
+    return TextParser(padded, header=0, skip_blank_lines=False, dtype=dtypes).read()
+
+def _iter_excel_blocks(file_path: str, chunk_rows: int, columns: List[str] = None):
+    """
+    Read the first sheet of an Excel file as blocks of at most chunk_rows converted rows
+    Yields the header, the rows and the width of the widest row so far
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Excel file not found: {file_path}")
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    except Exception as e:
+        raise ValueError(f"Failed to read Excel file: {str(e)}")
+    
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        header = None
+        keep = None
+        width = 0
+        rows = []
+        blank_rows = 0
+        for row in sheet.rows:
+            values = [_convert_excel_cell(cell) for cell in row]
+            while values and values[-1] == "":
+                values.pop()
+            if header is None:
+                header = values
+                if columns is not None:
+                    _check_columns(header, columns, file_path)
+                    keep = sorted({header.index(col) for col in columns})
+                    header = [header[i] for i in keep]
+                width = len(header)
+                continue
+            # Blank rows only count when data follows them (read_excel trims trailing ones)
+            if not values:
+                blank_rows += 1
+                continue
+            rows.extend([] for _ in range(blank_rows))
+            blank_rows = 0
+            if keep is not None:
+                values = [values[i] if i < len(values) else "" for i in keep]
+            rows.append(values)
+            width = max(width, len(values))
+            if len(rows) >= chunk_rows:
+                yield header, rows, width
+                rows = []
+        if rows:
+            yield header, rows, width
+    finally:
+        workbook.close()
+
+# Chunked reads type every chunk like a whole-file read: a first pass keeps a few "witness"
+# cells per kind of value seen in each column, and parsing only those gives the column's dtype
+
+# Strings the pandas parsers read as booleans
+BOOL_STRINGS = {"True": True, "TRUE": True, "true": True, "False": False, "FALSE": False, "false": False}
+
+def _is_bool_column(values: pd.Series) -> bool:
+    """
+    Return whether an object column holds booleans and missing values only
+    """
+    return values.dtype == object and values.dropna().map(type).eq(bool).all()
+
+def _bool_cells(values: pd.Series) -> pd.Series:
+    """
+    Convert the raw cells of a column of booleans with missing values like the parser does
+    """
+    cells = [BOOL_STRINGS.get(cell, cell) if isinstance(cell, str) else cell for cell in values]
+    return pd.Series(cells, index=values.index, dtype=object)
+
+def _add_extremes(witnesses: Dict[Any, Any], values: pd.Series, cells: List[Any]) -> None:
+    """
+    Keep the cells of the smallest and largest integer of a column, which decide its integer dtype
+    """
+    for kind, position in (("min", values.argmin()), ("max", values.argmax())):
+        value = values.iloc[position]
+        current = witnesses.get(kind)
+        if current is None or (value < current[0] if kind == "min" else value > current[0]):
+            witnesses[kind] = (value, cells[position])
+
+def _collect_witnesses(witnesses: Dict[Any, Any], cells: List[Any], parsed: pd.Series) -> None:
+    """
+    Keep the first raw cell of each kind of value in a parsed column chunk
+    A kind is the raw type with the parsed type and missingness. Integer extremes, fractions
+    and strings that do not parse as numbers are kinds of their own, as each can change the dtype
+    """
+    values = parsed.to_numpy(dtype=object)
+    missing = parsed.isna().to_numpy()
+    for cell, value, is_missing in zip(cells, values, missing):
+        witnesses.setdefault((type(cell), type(value), bool(is_missing)), cell)
+    if not len(parsed):
+        return
+    if parsed.dtype.kind in "iu":
+        _add_extremes(witnesses, parsed, cells)
+    elif parsed.dtype.kind == "f":
+        fractions = np.flatnonzero(~missing & (np.mod(parsed.fillna(0).to_numpy(), 1) != 0))
+        if len(fractions):
+            witnesses.setdefault("fraction", cells[fractions[0]])
+    elif parsed.dtype.kind == "O":
+        text = [cells[position] for position in np.flatnonzero(~missing) if isinstance(cells[position], str)]
+        numbers = pd.to_numeric(pd.Series(text, dtype=object), errors="coerce").isna().to_numpy()
+        for cell, not_number in zip(text, numbers):
+            if cell in BOOL_STRINGS:
+                witnesses.setdefault("bool text", cell)
+            else:
+                witnesses.setdefault("text" if not_number else "number text", cell)
+
+def _witness_cells(witnesses: Dict[Any, Any]) -> List[Any]:
+    """
+    Return the witness cells of a column
+    """
+    return [cell[1] if kind in ("min", "max") else cell for kind, cell in witnesses.items()]
+
+def _cast_chunk(chunk: pd.DataFrame, dtypes: Dict[Any, Any]) -> pd.DataFrame:
+    """
+    Convert the columns whose dtype in this chunk differs from the whole-file dtype
+    """
+    changed = {col: dtype for col, dtype in dtypes.items() if col in chunk.columns and chunk[col].dtype != dtype}
+    return chunk.astype(changed) if changed else chunk
+
+def _collect_text_witnesses(witnesses: Dict[Any, Any], parsed: pd.Series) -> None:
+    """
+    Keep text cells standing for the kinds of value in a parsed column chunk of a text file
+    The parser typed the chunk from its cells, so the chunk dtype tells which kinds it holds
+    """
+    missing = parsed.isna().to_numpy()
+    if missing.any():
+        witnesses.setdefault("missing", "")
+    values = parsed[~missing].reset_index(drop=True)
+    if not len(values):
+        return
+    if values.dtype.kind in "iu":
+        _add_extremes(witnesses, values, [str(value) for value in values])
+    elif values.dtype.kind == "f":
+        witnesses.setdefault("float", repr(float(values.iloc[0])))
+    elif values.dtype == bool or values.map(type).eq(bool).all():
+        witnesses.setdefault("bool", "True")
+    else:
+        witnesses.setdefault("text", "text")
+
+def _parse_text_witnesses(witnesses: Dict[Any, Any]) -> pd.Series:
+    """
+    Parse the witness cells of a column like pd.read_csv parses the whole column
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["row", "value"])
+    writer.writerows(enumerate(_witness_cells(witnesses)))
+    buffer.seek(0)
+    return pd.read_csv(buffer)["value"]
+
+def _excel_witness_columns(file_path: str, chunk_rows: int, columns: List[str] = None) -> Dict[Any, pd.Series]:
+    """
+    Read the first sheet in chunks and parse a few cells of each kind seen per column
+    TextParser types a column from the kinds of values in it, so the parsed cells
+    have the dtype pd.read_excel gives the whole column
+    """
+    from pandas.io.parsers import TextParser
+
+    witnesses = {}
+    for header, rows, width in _iter_excel_blocks(file_path, chunk_rows, columns):
+        parsed = _parse_excel_rows(header, rows, width)
+        for position, col in enumerate(parsed.columns):
+            cells = [row[position] if position < len(row) else "" for row in rows]
+            _collect_witnesses(witnesses.setdefault(col, {}), cells, parsed[col])
+    return {
+        col: TextParser([["value"]] + [[cell] for cell in _witness_cells(found)], header=0,
+                        skip_blank_lines=False).read()["value"]
+        for col, found in witnesses.items()
+    }
+
+def iter_excel_chunks(file_path: str, chunk_rows: int = STREAM_CHUNK_ROWS, columns: List[str] = None):
+    """
+    Read the first sheet of an Excel file as DataFrames of at most chunk_rows rows
+    Only one chunk of rows is held in memory at a time. Cells are converted and typed like
+    pd.read_excel does for the whole sheet: a first pass over the sheet finds each column's
+    dtype, so a numeric column with blanks in one chunk only is float in every chunk
+    With columns given, the header is checked first and only those columns are kept
+    """
+    witnesses = _excel_witness_columns(file_path, chunk_rows, columns)
+    dtypes = {col: values.dtype for col, values in witnesses.items()}
+    # Float and object columns are typed by the parser, which keeps the raw cells of object columns.
+    # Boolean columns are read raw too and converted here, a chunk can hold their strings alone
+    bool_columns = [col for col, values in witnesses.items() if values.dtype == bool or _is_bool_column(values)]
+    forced = {col: dtype for col, dtype in dtypes.items() if dtype.kind in "fO"}
+    forced.update(dict.fromkeys(bool_columns, object))
+    for header, rows, width in _iter_excel_blocks(file_path, chunk_rows, columns):
+        chunk = _parse_excel_rows(header, rows, width, forced)
+        for col in bool_columns:
+            chunk[col] = _bool_cells(chunk[col])
+        yield _cast_chunk(chunk, dtypes)
+
+class DatasetLoader:
+    """
+    Reader for one input format: the whole dataset at once, or in chunks of rows
+    Both check the requested columns against the header before reading any rows.
+    Chunks are typed like the whole dataset, so a row's ids hash the same in any chunk
+    """
+    name = ""
+    extensions = ()
+    magic = b""
+    # Optional package the format needs
+    requires = ""
+
+    def header(self, source: str) -> List[Any]:
+        raise NotImplementedError
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        raise NotImplementedError
+
+    def _projection(self, source: str, columns: List[str]) -> List[str]:
+        """
+        Return the requested columns in file order, or None to read every column
+        """
+        if columns is None:
+            return None
+        header = self.header(source)
+        _check_columns(header, columns, source)
+        wanted = set(columns)
+        return [col for col in header if col in wanted]
+
+class ExcelLoader(DatasetLoader):
+    """
+    Excel workbooks through openpyxl (first sheet)
+    """
+    name = "excel"
+    extensions = (".xlsx", ".xlsm")
+    magic = b"PK\x03\x04"
+
+    def header(self, source: str) -> List[Any]:
+        return pd.read_excel(source, nrows=0).columns.tolist()
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        return load_excel_data(source, columns)
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        return iter_excel_chunks(source, chunk_rows, columns)
+
+class XlsLoader(DatasetLoader):
+    """
+    Legacy Excel 97-2003 workbooks (OLE compound files) through xlrd (first sheet)
+    A sheet holds at most 65536 rows, so chunks are slices of the whole sheet
+    """
+    name = "xls"
+    extensions = (".xls",)
+    magic = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+    requires = "xlrd"
+
+    def header(self, source: str) -> List[Any]:
+        return pd.read_excel(source, nrows=0).columns.tolist()
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        return load_excel_data(source, columns)
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        df = self.load(source, columns)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].reset_index(drop=True)
+
+class CsvLoader(DatasetLoader):
+    """
+    Comma-separated text with a header row, read by the pandas C parser
+    """
+    name = "csv"
+    extensions = (".csv", ".txt")
+
+    def header(self, source: str) -> List[Any]:
+        return pd.read_csv(source, nrows=0).columns.tolist()
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        return pd.read_csv(source, usecols=self._projection(source, columns))
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        projection = self._projection(source, columns)
+        witnesses = {}
+        with pd.read_csv(source, usecols=projection, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                for col in chunk.columns:
+                    _collect_text_witnesses(witnesses.setdefault(col, {}), chunk[col])
+        parsed = {col: _parse_text_witnesses(found) for col, found in witnesses.items()}
+        dtypes = {col: values.dtype for col, values in parsed.items()}
+
+        # Columns the whole file reads as text are read as text in every chunk
+        text = {col: str for col, values in parsed.items() if values.dtype.kind == "O" and not _is_bool_column(values)}
+        with pd.read_csv(source, usecols=projection, chunksize=chunk_rows, dtype=text) as reader:
+            for chunk in reader:
+                yield _cast_chunk(chunk, dtypes)
+
+class ParquetLoader(DatasetLoader):
+    """
+    Parquet files through pyarrow, reading only the projected column chunks
+    """
+    name = "parquet"
+    extensions = (".parquet", ".pq")
+    requires = "pyarrow"
+    magic = b"PAR1"
+
+    def header(self, source: str) -> List[Any]:
+        return pyarrow.parquet.ParquetFile(source).schema_arrow.names
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        return pyarrow.parquet.read_table(source, columns=self._projection(source, columns)).to_pandas()
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        parquet_file = pyarrow.parquet.ParquetFile(source)
+        projection = self._projection(source, columns)
+        schema = parquet_file.schema_arrow
+        names = schema.names if projection is None else projection
+        # Column statistics give the null counts without reading the data, when the writer kept them
+        nulls = dict.fromkeys(names, 0)
+        for group in range(parquet_file.metadata.num_row_groups):
+            row_group = parquet_file.metadata.row_group(group)
+            for position in range(row_group.num_columns):
+                chunk = row_group.column(position)
+                name = chunk.path_in_schema
+                if name not in nulls:
+                    continue
+                statistics = chunk.statistics
+                if statistics is not None and statistics.has_null_count:
+                    nulls[name] += statistics.null_count
+                else:
+                    nulls[name] += parquet_file.read_row_group(group, columns=[name]).column(0).null_count
+        dtypes = _arrow_column_dtypes(schema, nulls)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=projection):
+            yield _cast_chunk(batch.to_pandas(), dtypes)
+
+def _arrow_column_dtypes(schema, null_counts: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Return the dtype to_pandas gives each whole column of an Arrow schema: the one its pandas
+    metadata names, else one that changes when the column holds nulls (int64 becomes float64,
+    bool becomes object). Categorical columns are left out, each chunk's dictionary gives their categories
+    """
+    dtypes = {}
+    for name, null_count in null_counts.items():
+        field = schema.field(name)
+        sample = pyarrow.nulls(1, field.type) if null_count else pyarrow.array([], field.type)
+        table = pyarrow.Table.from_arrays([sample], schema=pyarrow.schema([field], metadata=schema.metadata))
+        dtype = table.to_pandas().dtypes.iloc[0]
+        if not isinstance(dtype, pd.CategoricalDtype):
+            dtypes[name] = dtype
+    return dtypes
+
+class ArrowLoader(DatasetLoader):
+    """
+    Arrow IPC (Feather v2) files, memory-mapped through pyarrow
+    """
+    name = "arrow"
+    extensions = (".arrow", ".feather", ".ipc")
+    magic = b"ARROW1"
+    requires = "pyarrow"
+
+    def _table(self, source: str):
+        return pyarrow.ipc.open_file(pyarrow.memory_map(source, "r")).read_all()
+
+    def header(self, source: str) -> List[Any]:
+        return pyarrow.ipc.open_file(pyarrow.memory_map(source, "r")).schema.names
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        projection = self._projection(source, columns)
+        table = self._table(source)
+        if projection is not None:
+            table = table.select(projection)
+        return table.to_pandas()
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        projection = self._projection(source, columns)
+        table = self._table(source)
+        if projection is not None:
+            table = table.select(projection)
+        dtypes = _arrow_column_dtypes(table.schema, {
+            name: column.null_count for name, column in zip(table.column_names, table.columns)
+        })
+        # Slices of a memory-mapped table are zero-copy until converted to pandas
+        for start in range(0, table.num_rows, chunk_rows):
+            yield _cast_chunk(table.slice(start, chunk_rows).to_pandas(), dtypes)
+
+def _connect_sqlite(path: str) -> sqlite3.Connection:
+    """
+    Open an SQLite database read-only
+    """
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+def _split_sqlite_source(source: str) -> Tuple[str, str]:
+    """
+    Split "file.db#table" into the database path and table name
+    Without a table name the database must hold exactly one table
+    """
+    path, _, table = source.partition("#")
+    if table:
+        return path, table
+    with closing(_connect_sqlite(path)) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if len(tables) != 1:
+        raise ValueError(f"Specify the table as {path}#<table>. Tables in the database: {tables}")
+    return path, tables[0]
+
+def _quote_sqlite_name(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _iter_sqlite_rows(path: str, query: str, chunk_rows: int):
+    """
+    Run a query and yield the column names with blocks of at most chunk_rows rows
+    """
+    with closing(_connect_sqlite(path)) as conn:
+        cursor = conn.execute(query)
+        names = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield names, rows
+
+class SqliteLoader(DatasetLoader):
+    """
+    A table of an SQLite database, given as "file.db#table"
+    """
+    name = "sqlite"
+    extensions = (".db", ".sqlite", ".sqlite3")
+    magic = b"SQLite format 3\x00"
+
+    def header(self, source: str) -> List[Any]:
+        path, table = _split_sqlite_source(source)
+        with closing(_connect_sqlite(path)) as conn:
+            return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote_sqlite_name(table)})")]
+
+    def _query(self, source: str, columns: List[str]) -> Tuple[str, str]:
+        path, table = _split_sqlite_source(source)
+        projection = self._projection(source, columns)
+        selected = "*" if projection is None else ", ".join(_quote_sqlite_name(col) for col in projection)
+        return path, f"SELECT {selected} FROM {_quote_sqlite_name(table)}"
+
+    def load(self, source: str, columns: List[str] = None) -> pd.DataFrame:
+        path, query = self._query(source, columns)
+        with closing(_connect_sqlite(path)) as conn:
+            return pd.read_sql_query(query, conn)
+
+    def iter_chunks(self, source: str, chunk_rows: int, columns: List[str] = None):
+        path, query = self._query(source, columns)
+        witnesses = {}
+        for names, rows in _iter_sqlite_rows(path, query, chunk_rows):
+            chunk = pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+            for position, col in enumerate(names):
+                _collect_witnesses(witnesses.setdefault(col, {}), [row[position] for row in rows], chunk[col])
+        parsed = {
+            col: pd.DataFrame.from_records([(cell,) for cell in _witness_cells(found)], columns=["value"],
+                                           coerce_float=True)["value"]
+            for col, found in witnesses.items()
+        }
+        dtypes = {col: values.dtype for col, values in parsed.items()}
+
+        # The whole table keeps the raw values of object columns, a chunk may have converted them
+        raw = [col for col, values in parsed.items() if values.dtype == object]
+        for names, rows in _iter_sqlite_rows(path, query, chunk_rows):
+            chunk = pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+            for col in raw:
+                position = names.index(col)
+                chunk[col] = pd.Series([row[position] for row in rows], dtype=object)
+            yield _cast_chunk(chunk, dtypes)
+
+def _available_dataset_loaders() -> Dict[str, DatasetLoader]:
+    """
+    Return the loaders usable in this environment
+    """
+    loaders = {
+        ExcelLoader.name: ExcelLoader(),
+        CsvLoader.name: CsvLoader(),
+        SqliteLoader.name: SqliteLoader()
+    }
+    if xlrd is not None:
+        loaders[XlsLoader.name] = XlsLoader()
+    if pyarrow is not None:
+        loaders[ParquetLoader.name] = ParquetLoader()
+        loaders[ArrowLoader.name] = ArrowLoader()
+    return loaders
+
+DATASET_LOADERS = _available_dataset_loaders()
+
+def detect_dataset_format(source: str) -> str:
+    """
+    Return the loader name for a dataset path, from its leading bytes or else its extension
+    SQLite tables are given as "file.db#table"; any other file is refused
+    """
+    path = source.partition("#")[0] if "#" in source and not os.path.exists(source) else source
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Dataset not found: {path}")
+    
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    known = [ExcelLoader, XlsLoader, CsvLoader, ParquetLoader, ArrowLoader, SqliteLoader]
+    found = next((loader for loader in known if loader.magic and head.startswith(loader.magic)), None)
+    if found is None:
+        extension = os.path.splitext(path)[1].lower()
+        found = next((loader for loader in known if extension in loader.extensions), None)
+    if found is None:
+        supported = ", ".join(f"{loader.name} ({' '.join(loader.extensions)})" for loader in known)
+        raise ValueError(f"Unknown dataset format: {path}. Supported formats: {supported}")
+    
+    if found.name not in DATASET_LOADERS:
+        raise ValueError(f"Reading {found.name} datasets needs {found.requires}. "
+                         f"Available formats: {list(DATASET_LOADERS)}")
+    return found.name
+
+def load_dataset(source: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Load a dataset in any supported format into a pandas DataFrame
+    """
+    return DATASET_LOADERS[detect_dataset_format(source)].load(source, columns)
+
+def iter_dataset_chunks(source: str, chunk_rows: int = STREAM_CHUNK_ROWS, columns: List[str] = None):
+    """
+    Read a dataset in any supported format as DataFrames of at most chunk_rows rows
+    """
+    return DATASET_LOADERS[detect_dataset_format(source)].iter_chunks(source, chunk_rows, columns)
+
 def compute_record_hash(record: pd.Series, id_columns: List[str]) -> int:
     """
     Compute a hash of the record's identifier columns
@@ -42,385 +675,2414 @@ def compute_record_hash(record: pd.Series, id_columns: List[str]) -> int:
     # Print the ID string for debugging (only for first few records)
     # print(f"ID string: {id_string}")
     
-    # Compute SHA-256 hash
-    hash_obj = hashlib.sha256(id_string.encode())
-    hash_hex = hash_obj.hexdigest()
+    # Compute SHA-256 hash
+    hash_obj = hashlib.sha256(id_string.encode())
+    hash_hex = hash_obj.hexdigest()
+    
+    # Convert to integer
+    hash_int = int(hash_hex, 16)
+    return hash_int
+
+# Size in bytes of a record hash (SHA-256)
+RECORD_HASH_BYTES = 32
+# Number of rows normalized and hashed together by compute_record_hashes
+HASH_BATCH_SIZE = 65536
+
+def _row_dtype(df: pd.DataFrame) -> np.dtype:
+    """
+    Return the dtype df.iterrows() gives each row Series
+    (iterrows upcasts every row to the common dtype of all the frame's columns)
+    """
+    if df.shape[1] == 1 and isinstance(df.dtypes.iloc[0], pd.api.extensions.ExtensionDtype):
+        # A lone extension column converts by itself, and its missing values pick the dtype
+        # (nullable Int64 with NA becomes float64, without NA int64)
+        return df.iloc[:, 0].to_numpy().dtype
+    return df.iloc[:0].values.dtype
+
+def _row_inferred_cell(value) -> bool:
+    """
+    Return whether pandas may change how an object cell prints when iterrows builds its row Series
+    (a row of strings turns missing values into NaN, a row of datetimes turns them into NaT)
+    """
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value) \
+        or type(value) in (datetime.timedelta, np.datetime64, np.timedelta64)
+
+def _normalize_id_column(values: pd.Series, row_dtype: np.dtype) -> Tuple[List[str], np.ndarray]:
+    """
+    Normalize one identifier column exactly like compute_record_hash does per cell
+    Also returns which cells of an object row need the per-row path, as iterrows may convert them
+    """
+    if row_dtype.kind in "iufc":
+        # Numeric strings have no whitespace or upper case, so only the conversion is needed
+        return values.to_numpy(dtype=row_dtype).astype(str).tolist(), None
+    if row_dtype.kind == "b":
+        return [str(value).lower() for value in values.to_numpy(dtype=row_dtype)], None
+    cells = values.to_numpy(dtype=object)
+    inferred = None
+    if row_dtype == object:
+        inferred = np.fromiter((_row_inferred_cell(value) for value in cells), dtype=bool, count=len(cells))
+    return [str(value).strip().lower() for value in cells], inferred
+
+def compute_record_hashes(df: pd.DataFrame, id_columns: List[str]) -> List[int]:
+    """
+    Compute the record hash of every row of the dataframe column by column
+    Returns the same integers as compute_record_hash over df.iterrows(), in row order
+    """
+    present_columns = [col for col in id_columns if col in df.columns]
+    if len(present_columns) < len(id_columns):
+        missing_columns = [col for col in id_columns if col not in df.columns]
+        print(f"WARNING: Columns {missing_columns} not found in records. Available columns: {df.columns.tolist()}")
+
+    # Duplicate column labels make record[col] a Series, keep the per-row behaviour for them
+    if df.columns.has_duplicates:
+        return [compute_record_hash(record, id_columns) for _, record in df.iterrows()]
+
+    row_dtype = _row_dtype(df)
+    hashes = []
+    for start in range(0, len(df), HASH_BATCH_SIZE):
+        batch = df.iloc[start:start + HASH_BATCH_SIZE]
+
+        # Normalize whole columns, then join them with the same separator as compute_record_hash
+        normalized = [_normalize_id_column(batch[col], row_dtype) for col in present_columns]
+        columns = [values for values, _ in normalized]
+        if not columns:
+            id_strings = [""] * len(batch)
+        elif len(columns) == 1:
+            id_strings = columns[0]
+        else:
+            id_strings = ["||".join(values) for values in zip(*columns)]
+
+        # Rows with missing or raw datetime-like ids are rebuilt like iterrows does,
+        # the row's other values decide what pandas turns those cells into
+        row_masks = [inferred for _, inferred in normalized if inferred is not None]
+        if row_masks:
+            rows = np.flatnonzero(np.logical_or.reduce(row_masks))
+            if len(rows):
+                row_values = batch.iloc[rows].to_numpy(dtype=object)
+                for row, values in zip(rows, row_values):
+                    record = pd.Series(values, index=batch.columns)
+                    id_strings[row] = "||".join(str(record[col]).strip().lower() for col in present_columns)
+
+        # int.from_bytes on the digest equals int(hexdigest, 16)
+        hashes.extend(
+            int.from_bytes(hashlib.sha256(id_string.encode()).digest(), "big")
+            for id_string in id_strings
+        )
+
+    return hashes
+
+def hash_id_columns(df: pd.DataFrame, id_columns: List[str]) -> List[int]:
+    """
+    Compute record hashes over the id columns alone
+    Other columns of the frame then cannot change how the ids are formatted
+    (iterrows upcasts a row to the common dtype of all its columns)
+    """
+    return compute_record_hashes(df.loc[:, list(dict.fromkeys(id_columns))], id_columns)
+
+def compute_blinded_hash(hash_int: int, private_key: int, prime: int) -> int:
+    """
+    Compute h^(private_key) mod prime
+    """
+    return pow(hash_int, private_key, prime)
+
+class ModExpBackend:
+    """
+    Batched modular exponentiation of many bases with a shared exponent and modulus
+    """
+    name = ""
+
+    def powmod_batch(self, bases: List[int], exponent: int, modulus: int) -> List[int]:
+        raise NotImplementedError
+
+class PythonModExpBackend(ModExpBackend):
+    """
+    Built-in pow() on Python ints
+    """
+    name = "python"
+
+    def powmod_batch(self, bases: List[int], exponent: int, modulus: int) -> List[int]:
+        return [pow(base, exponent, modulus) for base in bases]
+
+class GmpModExpBackend(ModExpBackend):
+    """
+    GMP through the gmpy2 binding
+    """
+    name = "gmpy2"
+
+    def powmod_batch(self, bases: List[int], exponent: int, modulus: int) -> List[int]:
+        exponent = gmpy2.mpz(exponent)
+        modulus = gmpy2.mpz(modulus)
+        if hasattr(gmpy2, "powmod_base_list"):
+            results = gmpy2.powmod_base_list(bases, exponent, modulus)
+        else:
+            results = [gmpy2.powmod(base, exponent, modulus) for base in bases]
+        return [int(value) for value in results]
+
+def _available_modexp_backends() -> Dict[str, ModExpBackend]:
+    """
+    Return the backends usable in this environment, in order of preference
+    """
+    backends = {}
+    if gmpy2 is not None:
+        backends[GmpModExpBackend.name] = GmpModExpBackend()
+    backends[PythonModExpBackend.name] = PythonModExpBackend()
+    return backends
+
+MODEXP_BACKENDS = _available_modexp_backends()
+
+def _select_modexp_backend() -> ModExpBackend:
+    """
+    Pick the backend at import time: PSI_MODEXP_BACKEND if set, else the fastest available one
+    """
+    requested = os.environ.get("PSI_MODEXP_BACKEND", "").strip().lower()
+    if requested:
+        if requested not in MODEXP_BACKENDS:
+            raise ValueError(f"Modexp backend '{requested}' is not available. Available backends: {list(MODEXP_BACKENDS)}")
+        return MODEXP_BACKENDS[requested]
+    return next(iter(MODEXP_BACKENDS.values()))
+
+_modexp_backend = _select_modexp_backend()
+
+def get_modexp_backend() -> str:
+    """
+    Return the name of the active modular exponentiation backend
+    """
+    return _modexp_backend.name
+
+def set_modexp_backend(name: str):
+    """
+    Switch the active modular exponentiation backend
+    """
+    global _modexp_backend
+    if name not in MODEXP_BACKENDS:
+        raise ValueError(f"Modexp backend '{name}' is not available. Available backends: {list(MODEXP_BACKENDS)}")
+    _modexp_backend = MODEXP_BACKENDS[name]
+
+# Default number of values sent to a worker process at a time
+MODEXP_CHUNK_SIZE = 2048
+
+def _map_chunks(function, values: List[int], args: Tuple, workers: int, chunk_size: int) -> List[int]:
+    """
+    Apply function(chunk, *args) to consecutive chunks of values and concatenate the results in order
+    With workers > 1 the chunks run on a process pool (workers = 0 uses one process per CPU core)
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    chunk_size = max(1, chunk_size)
+    
+    # A pool only pays off when there is more than one chunk to hand out
+    if workers == 1 or len(values) <= chunk_size:
+        return function(values if isinstance(values, list) else list(values), *args)
+    
+    chunks = [values[start:start + chunk_size] for start in range(0, len(values), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        # executor.map yields the chunks back in submission order
+        for chunk_result in executor.map(function, chunks, *[repeat(arg) for arg in args]):
+            results.extend(chunk_result)
+    return results
+
+def _modexp_chunk(bases: List[int], exponent: int, modulus: int, backend_name: str) -> List[int]:
+    """
+    Compute base^exponent mod modulus for one chunk of bases (runs inside a worker process)
+    """
+    return MODEXP_BACKENDS[backend_name].powmod_batch(bases, exponent, modulus)
+
+def _check_subgroup_chunk(values: List[int], prime: int) -> List[int]:
+    """
+    Raise unless every value of one chunk lies in the prime-order subgroup of a safe prime,
+    the quadratic residues other than 1 (runs inside a worker process)
+    """
+    for value in values:
+        if 1 < value < prime - 1:
+            # Euler's criterion, gmpy2 computes the same symbol without an exponentiation
+            if gmpy2 is not None:
+                residue = gmpy2.legendre(value, prime) == 1
+            else:
+                residue = pow(value, (prime - 1) // 2, prime) == 1
+            if residue:
+                continue
+        raise ValueError(f"Partner value {value} is outside the prime-order subgroup of the group")
+    return []
+
+def batch_modexp(
+    bases: List[int],
+    exponent: int,
+    modulus: int,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE
+) -> List[int]:
+    """
+    Compute base^exponent mod modulus for every base with the active backend, keeping the input order
+    With workers > 1 the bases are split into chunks of chunk_size and exponentiated
+    on a process pool (workers = 0 uses one process per CPU core)
+    """
+    return _map_chunks(_modexp_chunk, bases, (exponent, modulus, _modexp_backend.name), workers, chunk_size)
+
+# Group profiles a merge request can be created with (the server picks one per request),
+# defined once for the server and both clients
+RFC3526_MODP_1536 = group_profiles.RFC3526_MODP_1536
+RFC3526_MODP_2048 = group_profiles.RFC3526_MODP_2048
+RFC3526_MODP_3072 = group_profiles.RFC3526_MODP_3072
+GROUP_PROFILES = group_profiles.GROUP_PROFILES
+DEFAULT_GROUP_PROFILE = group_profiles.DEFAULT_GROUP_PROFILE
+
+def profile_security_bits(profile: Dict[str, Any], exponent_bits: int = 0) -> int:
+    """
+    Return the estimated strength of a profile: a short exponent of n bits gives about n/2 bits
+    """
+    exponent_bits = exponent_bits or profile["exponent_bits"]
+    if not exponent_bits:
+        return profile["security_bits"]
+    return min(profile["security_bits"], exponent_bits // 2)
+
+# Field and curve constants of edwards25519 (RFC 8032)
+ED25519_P = 2**255 - 19
+ED25519_ORDER = 2**252 + 27742317777372353535851937790883648493
+ED25519_D = (-121665 * pow(121666, -1, ED25519_P)) % ED25519_P
+ED25519_SQRT_M1 = pow(2, (ED25519_P - 1) // 4, ED25519_P)
+CURVE25519_A = 486662
+ED25519_IDENTITY = (0, 1, 1, 0)
+EC_POINT_BYTES = 32
+
+def _ed_add(p1: Tuple[int, int, int, int], p2: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """
+    Add two edwards25519 points in extended coordinates
+    """
+    x1, y1, z1, t1 = p1
+    x2, y2, z2, t2 = p2
+    p = ED25519_P
+    a = (y1 - x1) * (y2 - x2) % p
+    b = (y1 + x1) * (y2 + x2) % p
+    c = 2 * ED25519_D * t1 * t2 % p
+    d = 2 * z1 * z2 % p
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return (e * f % p, g * h % p, f * g % p, e * h % p)
+
+def _ed_double(point: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """
+    Double an edwards25519 point in extended coordinates
+    """
+    x1, y1, z1, _ = point
+    p = ED25519_P
+    a = x1 * x1 % p
+    b = y1 * y1 % p
+    c = 2 * z1 * z1 % p
+    h = a + b
+    e = h - (x1 + y1) * (x1 + y1) % p
+    g = a - b
+    f = c + g
+    return (e * f % p, g * h % p, f * g % p, e * h % p)
+
+def _ed_scalarmult(scalar: int, point: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """
+    Multiply an edwards25519 point by a scalar with a 4-bit fixed window
+    """
+    table = [ED25519_IDENTITY, point]
+    for _ in range(14):
+        table.append(_ed_add(table[-1], point))
+    
+    result = ED25519_IDENTITY
+    for shift in range((scalar.bit_length() + 3) // 4 * 4 - 4, -4, -4):
+        for _ in range(4):
+            result = _ed_double(result)
+        digit = (scalar >> shift) & 0xF
+        if digit:
+            result = _ed_add(result, table[digit])
+    return result
+
+def _ed_is_identity(point: Tuple[int, int, int, int]) -> bool:
+    x, y, z, _ = point
+    return x % ED25519_P == 0 and (y - z) % ED25519_P == 0
+
+def _ed_encode(point: Tuple[int, int, int, int]) -> bytes:
+    """
+    Encode a point as 32 bytes: little-endian y with the sign of x in the top bit
+    """
+    x, y, z, _ = point
+    z_inv = pow(z, ED25519_P - 2, ED25519_P)
+    x = x * z_inv % ED25519_P
+    y = y * z_inv % ED25519_P
+    return (y | ((x & 1) << 255)).to_bytes(EC_POINT_BYTES, "little")
+
+def _ed_sqrt_ratio(u: int, v: int) -> Any:
+    """
+    Return sqrt(u/v) mod p, or None when u/v is not a square
+    """
+    p = ED25519_P
+    x = u * pow(v, 3, p) * pow(u * pow(v, 7, p), (p - 5) // 8, p) % p
+    vx2 = v * x * x % p
+    if vx2 == u % p:
+        return x
+    if vx2 == (-u) % p:
+        return x * ED25519_SQRT_M1 % p
+    return None
+
+def _ed_recover(y: int, sign: int) -> Any:
+    """
+    Return the point with the given y coordinate and x sign bit, or None if there is none
+    """
+    p = ED25519_P
+    y2 = y * y % p
+    x = _ed_sqrt_ratio(y2 - 1, ED25519_D * y2 + 1)
+    if x is None or (x == 0 and sign):
+        return None
+    if (x & 1) != sign:
+        x = p - x
+    return (x, y, 1, x * y % p)
+
+def _ed_decode(encoded: bytes) -> Tuple[int, int, int, int]:
+    """
+    Decode a canonical point encoding that lies in the prime-order subgroup
+    Rejects the same inputs as libsodium's crypto_scalarmult_ed25519_noclamp
+    """
+    value = int.from_bytes(encoded, "little")
+    y = value & ((1 << 255) - 1)
+    point = _ed_recover(y, value >> 255) if y < ED25519_P else None
+    if point is None:
+        raise ValueError("Invalid edwards25519 point encoding")
+    if _ed_is_identity(_ed_scalarmult(8, point)) or not _ed_is_identity(_ed_scalarmult(ED25519_ORDER, point)):
+        raise ValueError("Point is not in the prime-order subgroup")
+    return point
+
+def _ed_from_uniform(uniform: bytes) -> Tuple[int, int, int, int]:
+    """
+    Map 32 uniform bytes to a point of the prime-order subgroup (Elligator 2 and
+    cofactor clearing, identical to libsodium's crypto_core_ed25519_from_uniform)
+    """
+    p = ED25519_P
+    sign = uniform[31] >> 7
+    r = (int.from_bytes(uniform, "little") & ((1 << 255) - 1)) % p
+    x = -CURVE25519_A * pow(2 * r * r + 1, p - 2, p) % p
+    if pow((x * x * x + CURVE25519_A * x * x + x) % p, (p - 1) // 2, p) == p - 1:
+        x = (-x - CURVE25519_A) % p
+    y = (x - 1) * pow(x + 1, p - 2, p) % p
+    point = _ed_recover(y, sign)
+    for _ in range(3):
+        point = _ed_double(point)
+    return point
+
+def _ec_scalar(private_key: int) -> int:
+    """
+    Reduce a private key to a non-zero scalar modulo the group order
+    """
+    scalar = private_key % ED25519_ORDER
+    if scalar == 0:
+        raise ValueError("EC private key must not be a multiple of the group order")
+    return scalar
+
+def ec_hash_to_point(hash_int: int) -> bytes:
+    """
+    Map a record hash to the encoding of a point in the prime-order subgroup
+    Uses libsodium through PyNaCl when installed, the pure Python implementation otherwise
+    """
+    uniform = hash_int.to_bytes(32, "big")
+    if sodium is not None:
+        return sodium.crypto_core_ed25519_from_uniform(uniform)
+    return _ed_encode(_ed_from_uniform(uniform))
+
+def ec_scalarmult(private_key: int, point: bytes) -> bytes:
+    """
+    Multiply an encoded point by the private key and return the encoded result
+    """
+    scalar = _ec_scalar(private_key)
+    if sodium is not None:
+        try:
+            return sodium.crypto_scalarmult_ed25519_noclamp(scalar.to_bytes(32, "little"), point)
+        except Exception as e:
+            raise ValueError(f"Invalid edwards25519 point: {str(e)}")
+    return _ed_encode(_ed_scalarmult(scalar, _ed_decode(point)))
+
+def _ec_blind_hash_chunk(hashes: List[int], private_key: int) -> List[int]:
+    """
+    Hash one chunk of record hashes to points and multiply them by the private key
+    Points travel as the big-endian integer value of their 32-byte encoding
+    """
+    if sodium is None:
+        # The mapped points are already in the subgroup, skip re-validating them
+        scalar = _ec_scalar(private_key)
+        return [
+            int.from_bytes(_ed_encode(_ed_scalarmult(scalar, _ed_from_uniform(h.to_bytes(32, "big")))), "big")
+            for h in hashes
+        ]
+    return [int.from_bytes(ec_scalarmult(private_key, ec_hash_to_point(h)), "big") for h in hashes]
+
+def _ec_blind_point_chunk(values: List[int], private_key: int) -> List[int]:
+    """
+    Multiply one chunk of encoded points (as integers) by the private key
+    """
+    return [
+        int.from_bytes(ec_scalarmult(private_key, value.to_bytes(EC_POINT_BYTES, "big")), "big")
+        for value in values
+    ]
+
+def blind_record_hashes(
+    hashes: List[int],
+    private_key: int,
+    prime: int,
+    psi_mode: str = PSI_MODE_MODP,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE
+) -> List[int]:
+    """
+    Compute the first blinded value c of every record hash h, keeping the input order
+    - modp: c = h^(private_key) mod prime
+    - modp-qr: c = (h^2)^(private_key) mod prime, a quadratic residue; the squaring is
+      folded into the exponent so it costs nothing extra
+    - ec: c = private_key * P(h), where P maps h onto the curve
+    """
+    if psi_mode == PSI_MODE_EC:
+        return _map_chunks(_ec_blind_hash_chunk, hashes, (private_key,), workers, chunk_size)
+    if psi_mode == PSI_MODE_MODP_QR:
+        return batch_modexp(hashes, 2 * private_key, prime, workers, chunk_size)
+    return batch_modexp(hashes, private_key, prime, workers, chunk_size)
+
+def value_keys(values, width: int = None) -> np.ndarray:
+    """
+    Return values as an array of fixed-width big-endian byte strings, which NumPy sorts
+    and compares in the same order as the integers
+    A PackedValues is wrapped without copying; other sequences are encoded with width
+    bytes (by default the width of their largest value)
+    """
+    if isinstance(values, PackedValues) and width in (None, values.width):
+        return np.frombuffer(values.raw(), dtype=f"S{values.width}")
+    if isinstance(values, np.ndarray) and values.dtype.kind == "S" and width in (None, values.dtype.itemsize):
+        return values
+    values = list(values)
+    if width is None:
+        width = max(((value.bit_length() + 7) // 8 for value in values), default=1)
+    return np.array([value.to_bytes(width, "big") for value in values], dtype=f"S{width}")
+
+def hash_keys(hashes) -> np.ndarray:
+    """
+    Return record hashes as an array of fixed-width big-endian byte strings
+    """
+    return value_keys(hashes, RECORD_HASH_BYTES)
+
+def keys_to_ints(keys: np.ndarray) -> List[int]:
+    # NumPy drops trailing zero bytes of byte strings, pad them back to the full width
+    width = keys.dtype.itemsize
+    return [int.from_bytes(key.ljust(width, b"\0"), "big") for key in keys.tolist()]
+
+def build_row_index(row_keys: np.ndarray, key_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group row positions by the key they carry (compressed sparse rows)
+    Returns the rows sorted by key, then by row, and key_count + 1 offsets: the rows of
+    key i are rows[offsets[i]:offsets[i + 1]]
+    """
+    row_keys = np.asarray(row_keys, dtype=np.int64)
+    offsets = np.zeros(key_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_keys, minlength=key_count), out=offsets[1:])
+    return np.argsort(row_keys, kind="stable").astype(np.int64), offsets
+
+def expand_row_index(positions: np.ndarray, rows: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return every row of the keys at positions, and the key position of each returned row
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = offsets[positions]
+    counts = offsets[positions + 1] - starts
+    # Index of every output row into rows: its key's start plus its rank inside the key
+    ends = np.cumsum(counts)
+    within = np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) - np.repeat(ends - counts, counts)
+    return rows[np.repeat(starts, counts) + within], np.repeat(positions, counts)
+
+def factorize_hashes(hashes: List[int]) -> Tuple[List[int], np.ndarray]:
+    """
+    Return the distinct hashes in first-occurrence order and, for every row, the position of its hash
+    """
+    codes, uniques = pd.factorize(np.asarray(hashes, dtype=object))
+    return list(uniques), codes.astype(np.int64)
+
+class _SeenHashes:
+    """
+    Set of the hashes blinded so far, each with its position in the state's hash order
+    Blocks of rows are checked against it, so a hash repeated across blocks is blinded once
+    The hashes are kept in a few sorted runs, merged when a run grows as large as the one
+    before it, so adding a block does not copy every hash seen so far
+    """
+
+    def __init__(self, keys: np.ndarray = None):
+        self._runs = []
+        self.count = 0
+        if keys is not None and len(keys):
+            self._add_run(keys, np.arange(len(keys), dtype=np.int64))
+            self.count = len(keys)
+
+    def _add_run(self, keys: np.ndarray, positions: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        self._runs.append((keys[order], positions[order]))
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2 * len(self._runs[-1][0]):
+            (keys, positions), (last_keys, last_positions) = self._runs[-2], self._runs.pop()
+            keys = np.concatenate([keys, last_keys])
+            positions = np.concatenate([positions, last_positions])
+            order = np.argsort(keys, kind="stable")
+            self._runs[-1] = (keys[order], positions[order])
+
+    def assign(self, hashes: List[int]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Add the hashes of a block of rows
+        Returns the hash position of every row and the hashes seen for the first time,
+        in first-occurrence order (their positions follow those of earlier hashes)
+        """
+        uniques, codes = factorize_hashes(hashes)
+        keys = hash_keys(uniques)
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        for run_keys, run_positions in self._runs:
+            slots = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            found = run_keys[slots] == keys
+            positions[found] = run_positions[slots[found]]
+        
+        new = np.flatnonzero(positions < 0)
+        positions[new] = np.arange(self.count, self.count + len(new))
+        self.count += len(new)
+        if len(new):
+            self._add_run(keys[new], positions[new])
+        return positions[codes], [uniques[i] for i in new]
+
+def save_values_to_excel(values: List[int], output_file: str, column_name: str = "Value"):
+    """
+    Save a list of values to Excel file
+    """
+    df = pd.DataFrame({column_name: values})
+    df.to_excel(output_file, index=False)
+
+def save_values_to_json(values: List[int], output_file: str):
+    """
+    Save a list of values to JSON file (more efficient for large numbers)
+    """
+    with open(output_file, 'w') as f:
+        json.dump(values, f)
+
+def load_values_from_excel(input_file: str, column_name: str = "Value") -> List[int]:
+    """
+    Load a list of values from Excel file
+    """
+    df = pd.read_excel(input_file)
+    return df[column_name].tolist()
+
+def load_values_from_json(input_file: str) -> List[int]:
+    """
+    Load a list of values from JSON file
+    """
+    with open(input_file, 'r') as f:
+        return json.load(f)
+
+# Binary value container: magic, format version, flags byte, value width in bytes
+# and value count (big-endian), followed by the fixed-width big-endian values
+# Version 2: record hashes cover the id columns alone, so values of version 1 never match them
+VALUES_MAGIC = b"PSIV"
+VALUES_FORMAT_VERSION = 2
+VALUES_HEADER = struct.Struct(">4sBBHQ")
+# Flag: every value is followed by its 8-byte big-endian position in the sender's value order
+VALUES_FLAG_POSITIONS = 1
+# Number of values encoded per write when saving a container
+VALUES_WRITE_BATCH_SIZE = 65536
+
+def value_width(prime: int, psi_mode: str = PSI_MODE_MODP) -> int:
+    """
+    Return the number of bytes needed to store one blinded value
+    """
+    if psi_mode == PSI_MODE_EC:
+        return EC_POINT_BYTES
+    return (prime.bit_length() + 7) // 8
+
+class PackedValues:
+    """
+    Read-only sequence of fixed-width big-endian integers stored in a buffer
+    Values are decoded lazily on access, so a memory-mapped file is never parsed as a whole
+    """
+
+    def __init__(self, buffer, width: int, count: int, offset: int = 0):
+        self._buffer = buffer
+        self._view = memoryview(buffer)[offset:offset + width * count]
+        self.width = width
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("PackedValues index out of range")
+        start = index * self.width
+        return int.from_bytes(self._view[start:start + self.width], "big")
+
+    def __iter__(self):
+        width = self.width
+        view = self._view
+        for start in range(0, self.count * width, width):
+            yield int.from_bytes(view[start:start + width], "big")
+
+    def raw(self) -> memoryview:
+        """
+        Return the concatenated value bytes without decoding them
+        """
+        return self._view
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+class ValuesWriter:
+    """
+    Append values to a binary value container without knowing their count up front
+    The header count is written when the writer is closed
+    With append, values are added after those of an existing container of the same width
+    """
+
+    def __init__(self, output_file: str, width: int, flags: int = 0, append: bool = False):
+        self.output_file = output_file
+        self.width = width
+        self.flags = flags
+        self.count = 0
+        if append and os.path.exists(output_file):
+            buffer, file_width, self.count = _open_values_file(output_file, flags)
+            buffer.close()
+            if file_width != width:
+                raise ValueError(f"Cannot append {width}-byte values to {file_width}-byte values: {output_file}")
+            record_size = width + 8 if flags & VALUES_FLAG_POSITIONS else width
+            self._file = open(output_file, 'r+b')
+            # Drop anything past the counted values, e.g. left by an interrupted writer
+            self._file.seek(VALUES_HEADER.size + record_size * self.count)
+            self._file.truncate()
+        else:
+            self._file = open(output_file, 'wb')
+            self._file.write(VALUES_HEADER.pack(VALUES_MAGIC, VALUES_FORMAT_VERSION, flags, width, 0))
+
+    def write(self, values: List[int]):
+        width = self.width
+        # Write in batches to keep the temporary byte strings small
+        for start in range(0, len(values), VALUES_WRITE_BATCH_SIZE):
+            batch = values[start:start + VALUES_WRITE_BATCH_SIZE]
+            self._file.write(b"".join(value.to_bytes(width, "big") for value in batch))
+        self.count += len(values)
+
+    def write_records(self, records: np.ndarray):
+        """
+        Append already encoded records (see positioned_dtype for VALUES_FLAG_POSITIONS files)
+        """
+        self._file.write(records.tobytes())
+        self.count += len(records)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._file.write(VALUES_HEADER.pack(VALUES_MAGIC, VALUES_FORMAT_VERSION, self.flags, self.width, self.count))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def save_values_to_binary(values: List[int], output_file: str, width: int):
+    """
+    Save a list of values to the binary container as fixed-width big-endian integers
+    """
+    with ValuesWriter(output_file, width) as writer:
+        writer.write(values)
+
+def _open_values_file(input_file: str, flags: int) -> Tuple[mmap.mmap, int, int]:
+    """
+    Memory-map a binary value container and check its header
+    Returns the buffer, value width and value count
+    """
+    with open(input_file, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    if len(buffer) < VALUES_HEADER.size:
+        buffer.close()
+        raise ValueError(f"Value file is truncated: {input_file}")
+    magic, version, file_flags, width, count = VALUES_HEADER.unpack_from(buffer, 0)
+    if magic != VALUES_MAGIC:
+        buffer.close()
+        raise ValueError(f"Not a binary value file: {input_file}")
+    if version != VALUES_FORMAT_VERSION:
+        buffer.close()
+        raise ValueError(f"Value file version {version} does not match version {VALUES_FORMAT_VERSION} of this "
+                         f"client: {input_file}. Both parties must run the same client version, and a state "
+                         f"left by another version needs a full PSI run")
+    if file_flags != flags:
+        buffer.close()
+        raise ValueError(f"Unexpected value file flags {file_flags}: {input_file}")
+    record_size = width + 8 if flags & VALUES_FLAG_POSITIONS else width
+    if len(buffer) < VALUES_HEADER.size + record_size * count:
+        buffer.close()
+        raise ValueError(f"Value file is truncated: {input_file}")
+    
+    return buffer, width, count
+
+def load_values_from_binary(input_file: str) -> PackedValues:
+    """
+    Memory-map a binary value container and return its values as a lazy sequence
+    """
+    buffer, width, count = _open_values_file(input_file, 0)
+    return PackedValues(buffer, width, count, VALUES_HEADER.size)
+
+def positioned_dtype(width: int) -> np.dtype:
+    """
+    Record layout of a VALUES_FLAG_POSITIONS container: value bytes, then position
+    """
+    return np.dtype([("key", f"S{width}"), ("pos", ">u8")])
+
+def load_positioned_values(input_file: str) -> np.ndarray:
+    """
+    Memory-map a container of values with positions as a structured array (key, pos)
+    """
+    buffer, width, count = _open_values_file(input_file, VALUES_FLAG_POSITIONS)
+    return np.frombuffer(buffer, dtype=positioned_dtype(width), count=count, offset=VALUES_HEADER.size)
+
+def load_values(input_file: str):
+    """
+    Load blinded values from the binary container
+    Legacy JSON lists come from clients that hash records differently, so they are refused
+    """
+    with open(input_file, 'rb') as f:
+        magic = f.read(len(VALUES_MAGIC))
+    if magic != VALUES_MAGIC and magic.lstrip()[:1] == b"[":
+        raise ValueError(f"{input_file} is a JSON list of values written by an older client, "
+                         f"the partner must upgrade to value file version {VALUES_FORMAT_VERSION}")
+    return load_values_from_binary(input_file)
+
+def compute_second_blinded_values(
+    blinded_values: List[int],
+    private_key: int,
+    prime: int,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    psi_mode: str = PSI_MODE_MODP
+) -> List[int]:
+    """
+    Compute c^(private_key) mod prime for each c in blinded_values
+    (private_key * c on the curve in ec mode)
+    In modp-qr mode a partner value outside the prime-order subgroup raises a ValueError,
+    as its power would leak the private key modulo a small factor of the group order
+    """
+    if psi_mode == PSI_MODE_EC:
+        return _map_chunks(_ec_blind_point_chunk, blinded_values, (private_key,), workers, chunk_size)
+    if psi_mode == PSI_MODE_MODP_QR:
+        _map_chunks(_check_subgroup_chunk, blinded_values, (prime,), workers, chunk_size)
+    return batch_modexp(blinded_values, private_key, prime, workers, chunk_size)
+
+def find_intersection(values_a: List[int], values_b: List[int]) -> Set[int]:
+    """
+    Find intersection between two lists of values
+    """
+    set_a = set(values_a)
+    set_b = set(values_b)
+    intersection = set_a.intersection(set_b)
+    # print(f"Found {len(intersection)} matching values in intersection")
+    return intersection
+
+# Table formats for the match data and final result; xlsx is meant for export only
+RESULT_FORMAT_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv", "xlsx": ".xlsx"}
+# Most data rows an xlsx sheet holds below its header
+XLSX_MAX_ROWS = 1048575
+
+def default_result_format() -> str:
+    """
+    Return the format used for exchanged tables when none is configured
+    """
+    return "parquet" if pyarrow is not None else "csv"
+
+def result_file_path(output_dir: str, name: str, result_format: str) -> str:
+    if result_format not in RESULT_FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown result format '{result_format}'. Supported formats: {list(RESULT_FORMAT_EXTENSIONS)}")
+    if result_format in ("parquet", "arrow") and pyarrow is None:
+        raise ValueError(f"The {result_format} result format needs pyarrow")
+    return os.path.join(output_dir, name + RESULT_FORMAT_EXTENSIONS[result_format])
+
+def _arrow_table(df: pd.DataFrame):
+    """
+    Convert a DataFrame to an Arrow table, storing mixed-type object columns as text
+    """
+    try:
+        return pyarrow.Table.from_pandas(df, preserve_index=False)
+    except (pyarrow.ArrowTypeError, pyarrow.ArrowInvalid):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pyarrow.Table.from_pandas(df, preserve_index=False)
+
+def save_table(df: pd.DataFrame, output_file: str, result_format: str):
+    """
+    Save a result table in one of RESULT_FORMAT_EXTENSIONS
+    """
+    if result_format == "parquet":
+        pyarrow.parquet.write_table(_arrow_table(df), output_file)
+    elif result_format == "arrow":
+        table = _arrow_table(df)
+        with pyarrow.ipc.new_file(output_file, table.schema) as writer:
+            writer.write_table(table)
+    elif result_format == "csv":
+        df.to_csv(output_file, index=False)
+    elif result_format == "xlsx":
+        if len(df) > XLSX_MAX_ROWS:
+            raise ValueError(f"{len(df)} rows do not fit in an xlsx sheet (at most {XLSX_MAX_ROWS})")
+        df.to_excel(output_file, index=False)
+    else:
+        raise ValueError(f"Unknown result format '{result_format}'. Supported formats: {list(RESULT_FORMAT_EXTENSIONS)}")
+
+def load_table(input_file: str) -> pd.DataFrame:
+    """
+    Load a result table, detecting its format from the leading bytes
+    hash_id is always read back as text
+    """
+    with open(input_file, 'rb') as f:
+        head = f.read(8)
+    
+    if head.startswith(ParquetLoader.magic) or head.startswith(ArrowLoader.magic):
+        if pyarrow is None:
+            raise ValueError(f"Reading {input_file} needs pyarrow")
+        if head.startswith(ParquetLoader.magic):
+            df = pyarrow.parquet.read_table(input_file).to_pandas()
+        else:
+            df = pyarrow.ipc.open_file(pyarrow.memory_map(input_file, "r")).read_all().to_pandas()
+    elif head.startswith(ExcelLoader.magic):
+        df = pd.read_excel(input_file, dtype={'hash_id': str})
+    else:
+        df = pd.read_csv(input_file, dtype={'hash_id': str})
+    
+    if 'hash_id' in df.columns:
+        df['hash_id'] = df['hash_id'].astype(str)
+    return df
+
+def _find_result_file(output_dir: str, name: str, result_format: str) -> str:
+    """
+    Return the path of a result table, preferring result_format but accepting any format
+    """
+    preferred = os.path.join(output_dir, name + RESULT_FORMAT_EXTENSIONS[result_format])
+    if os.path.exists(preferred):
+        return preferred
+    for extension in RESULT_FORMAT_EXTENSIONS.values():
+        candidate = os.path.join(output_dir, name + extension)
+        if os.path.exists(candidate):
+            return candidate
+    return preferred
+
+# Type tags of the cells of a ColumnStore column stored as text
+CELL_NONE, CELL_NAN, CELL_NA, CELL_NAT, CELL_STR, CELL_INT, CELL_FLOAT, CELL_BOOL, CELL_TIMESTAMP, \
+    CELL_TIMEDELTA, CELL_DATETIME, CELL_DATE, CELL_TIME, CELL_DURATION, CELL_DECIMAL, CELL_BYTES = range(16)
+
+def _encode_cell(value: Any) -> Tuple[int, str]:
+    """
+    Return the type tag and text of one cell of an object column
+    Types without a tag of their own are kept as their string form
+    """
+    if value is None:
+        return CELL_NONE, ""
+    if value is pd.NA:
+        return CELL_NA, ""
+    if value is pd.NaT or (isinstance(value, (np.datetime64, np.timedelta64)) and np.isnat(value)):
+        return CELL_NAT, ""
+    if isinstance(value, (bool, np.bool_)):
+        return CELL_BOOL, "1" if value else "0"
+    if isinstance(value, (int, np.integer)):
+        return CELL_INT, str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return (CELL_NAN, "") if value != value else (CELL_FLOAT, repr(float(value)))
+    if isinstance(value, str):
+        return CELL_STR, value
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if isinstance(value, pd.Timestamp):
+        return CELL_TIMESTAMP, value.isoformat()
+    if isinstance(value, np.timedelta64):
+        value = pd.Timedelta(value)
+    if isinstance(value, pd.Timedelta):
+        return CELL_TIMEDELTA, str(value.value)
+    if isinstance(value, datetime.datetime):
+        return CELL_DATETIME, value.isoformat()
+    if isinstance(value, datetime.date):
+        return CELL_DATE, value.isoformat()
+    if isinstance(value, datetime.time):
+        return CELL_TIME, value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return CELL_DURATION, f"{value.days},{value.seconds},{value.microseconds}"
+    if isinstance(value, decimal.Decimal):
+        return CELL_DECIMAL, str(value)
+    if isinstance(value, bytes):
+        return CELL_BYTES, value.hex()
+    return CELL_STR, str(value)
+
+_CELL_DECODERS = {
+    CELL_NONE: lambda text: None,
+    CELL_NAN: lambda text: np.nan,
+    CELL_NA: lambda text: pd.NA,
+    CELL_NAT: lambda text: pd.NaT,
+    CELL_STR: str,
+    CELL_INT: int,
+    CELL_FLOAT: float,
+    CELL_BOOL: lambda text: text == "1",
+    CELL_TIMESTAMP: pd.Timestamp,
+    CELL_TIMEDELTA: lambda text: pd.Timedelta(int(text)),
+    CELL_DATETIME: datetime.datetime.fromisoformat,
+    CELL_DATE: datetime.date.fromisoformat,
+    CELL_TIME: datetime.time.fromisoformat,
+    CELL_DURATION: lambda text: datetime.timedelta(*map(int, text.split(","))),
+    CELL_DECIMAL: decimal.Decimal,
+    CELL_BYTES: bytes.fromhex,
+}
+
+def _open_at(file_path: str, size: int):
+    """
+    Open a file for appending at size bytes, dropping anything an interrupted write left after it
+    """
+    f = open(file_path, 'r+b' if os.path.exists(file_path) else 'w+b')
+    f.truncate(size)
+    f.seek(size)
+    return f
+
+def _map_array(file_path: str, dtype: Any, count: int) -> np.ndarray:
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode="r", shape=(count,))
+
+class ColumnStore:
+    """
+    A table kept column by column under one directory, appended one block of rows at a time
+    and read back at any rows through memory maps, without loading the others:
+    - columns.json: the row count and each column's name and pandas dtype, written after every block
+    - <n>.values: a column of a NumPy dtype, as raw fixed-width values
+    - <n>.tags, <n>.ends, <n>.text: any other column, as a type tag and the end offset of
+      each cell in the UTF-8 text of all cells, so object columns keep the types of their cells
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta_file_path = os.path.join(path, "columns.json")
+        self._meta = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_file_path)
+
+    def create(self):
+        """
+        Start an empty table, dropping the previous one
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        self._meta = {"rows": 0, "text_bytes": [], "columns": None}
+        self._save_meta()
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        if self._meta is None:
+            with open(self.meta_file_path, 'r') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def _save_meta(self):
+        temp_file_path = self.meta_file_path + ".tmp"
+        with open(temp_file_path, 'w') as f:
+            json.dump(self._meta, f)
+        os.replace(temp_file_path, self.meta_file_path)
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    @property
+    def columns(self) -> List[Any]:
+        return [_CELL_DECODERS[tag](text) for tag, text in (self.meta["columns"] or [])]
+
+    def _file_path(self, position: int, suffix: str) -> str:
+        return os.path.join(self.path, f"{position}.{suffix}")
+
+    def append(self, df: pd.DataFrame):
+        """
+        Append a block of rows, which must have the columns of the first block
+        A column whose dtype changes is kept as text cells from then on
+        """
+        meta = self.meta
+        if meta["columns"] is None:
+            meta["columns"] = [list(_encode_cell(col)) for col in df.columns]
+            meta["dtypes"] = [str(dtype) for dtype in df.dtypes]
+            meta["numpy"] = [dtype.str if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM" else None
+                             for dtype in df.dtypes]
+            meta["text_bytes"] = [0] * df.shape[1]
+        elif list(df.columns) != self.columns:
+            raise ValueError(f"Block columns {list(df.columns)} differ from the stored {self.columns}")
+
+        rows = meta["rows"]
+        for position, (dtype, values) in enumerate(zip(df.dtypes, (df.iloc[:, i] for i in range(df.shape[1])))):
+            if meta["dtypes"][position] != str(dtype):
+                if meta["numpy"][position] is not None:
+                    self._to_text(position)
+                meta["dtypes"][position] = "object"
+            numpy_dtype = meta["numpy"][position]
+            if numpy_dtype is not None:
+                data = np.ascontiguousarray(values.to_numpy(), dtype=np.dtype(numpy_dtype))
+                with _open_at(self._file_path(position, "values"), rows * data.itemsize) as f:
+                    f.write(data.tobytes())
+            else:
+                self._append_cells(position, values.to_numpy(dtype=object), rows)
+        meta["rows"] = rows + len(df)
+        self._save_meta()
+
+    def _append_cells(self, position: int, values: np.ndarray, rows: int):
+        encoded = [_encode_cell(value) for value in values]
+        texts = [text.encode("utf-8") for _, text in encoded]
+        text_bytes = self.meta["text_bytes"][position]
+        ends = text_bytes + np.cumsum([len(text) for text in texts], dtype=np.int64)
+        with _open_at(self._file_path(position, "tags"), rows) as f:
+            f.write(np.fromiter((tag for tag, _ in encoded), dtype=np.int8, count=len(encoded)).tobytes())
+        with _open_at(self._file_path(position, "ends"), rows * 8) as f:
+            f.write(ends.astype("<i8").tobytes())
+        with _open_at(self._file_path(position, "text"), text_bytes) as f:
+            f.write(b"".join(texts))
+        self.meta["text_bytes"][position] = int(ends[-1]) if len(ends) else text_bytes
+
+    def _to_text(self, position: int):
+        """
+        Rewrite a column of raw values as text cells
+        """
+        values = self._read_column(position, np.arange(len(self), dtype=np.int64)).astype(object)
+        os.remove(self._file_path(position, "values"))
+        self.meta["numpy"][position] = None
+        self._append_cells(position, values.to_numpy(), 0)
+
+    def _read_column(self, position: int, rows: np.ndarray) -> pd.Series:
+        meta = self.meta
+        dtype = meta["dtypes"][position]
+        numpy_dtype = meta["numpy"][position]
+        if numpy_dtype is not None:
+            values = _map_array(self._file_path(position, "values"), np.dtype(numpy_dtype), meta["rows"])
+            return pd.Series(np.array(values[rows]), dtype=dtype)
+
+        tags = _map_array(self._file_path(position, "tags"), np.int8, meta["rows"])[rows]
+        ends = _map_array(self._file_path(position, "ends"), "<i8", meta["rows"])
+        starts = np.where(rows > 0, ends[np.maximum(rows - 1, 0)], 0) if len(rows) else rows
+        text = _map_array(self._file_path(position, "text"), np.uint8, meta["text_bytes"][position])
+        cells = [
+            _CELL_DECODERS[tag](bytes(text[start:end]).decode("utf-8"))
+            for tag, start, end in zip(tags.tolist(), starts.tolist(), ends[rows].tolist())
+        ]
+        if dtype != "object":
+            try:
+                return pd.Series(cells, dtype=dtype)
+            except (TypeError, ValueError):
+                pass
+        return pd.Series(cells, dtype=object)
+
+    def take(self, rows=None, columns: List[Any] = None) -> pd.DataFrame:
+        """
+        Read the given rows (all of them by default) of the given columns, in that order
+        """
+        stored = self.columns
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        wanted = stored if columns is None else [col for col in dict.fromkeys(columns) if col in stored]
+        return pd.DataFrame({col: self._read_column(stored.index(col), rows) for col in wanted},
+                            index=pd.RangeIndex(len(rows)), columns=wanted)
+
+# Step state of every run lives under <output_dir>/state/<request_id>
+STATE_DIR_NAME = "state"
+
+class PSIStateStore:
+    """
+    On-disk state of one PSI run, written by step 1 and opened by steps 2-4:
+    - h_values.bin: our record hashes in the order their c values were sent
+    - c_values.bin: the blinded values, in the same order
+    - rows.npy, row_offsets.npy: the row positions of the records of each hash in the data
+      columns, grouped by hash (the rows of hash i are rows[offsets[i]:offsets[i + 1]])
+    - records/: the data columns of the dataset, a ColumnStore read back only at the matched rows
+    - state.json: run metadata, written last so it marks a complete state
+    Later steps add what an incremental run extends instead of recomputing:
+    - k_values.bin: our k values of the partner's records (step 2)
+    - k_buckets/: those k values split into buckets, when step 2 shared them in buckets
+    - partner_k_values.bin: the partner's k values of our records, in our hash order (step 3)
+    - match_table/: our full match table, with the row_id of every record (step 3)
+    - partner_match_table/: the partner's full match table (step 4)
+    - delta/: the c and k values of the hashes added by the last incremental run
+    An incremental run rebuilds the records and row index from the whole dataset, so they
+    always describe its current rows; the hash list only grows
+    """
+
+    def __init__(self, output_dir: str, request_id: str = ""):
+        self.path = os.path.join(output_dir, STATE_DIR_NAME, request_id or "default")
+        self.h_file_path = os.path.join(self.path, "h_values.bin")
+        self.c_file_path = os.path.join(self.path, "c_values.bin")
+        self.rows_file_path = os.path.join(self.path, "rows.npy")
+        self.row_offsets_file_path = os.path.join(self.path, "row_offsets.npy")
+        self.records_path = os.path.join(self.path, "records")
+        self.record_store = ColumnStore(self.records_path)
+        self.meta_file_path = os.path.join(self.path, "state.json")
+        self.k_file_path = os.path.join(self.path, "k_values.bin")
+        self.bucket_path = os.path.join(self.path, "k_buckets")
+        self.sketch_file_path = os.path.join(self.path, "k_sketch.json")
+        self.partner_k_file_path = os.path.join(self.path, "partner_k_values.bin")
+        self.match_table_path = os.path.join(self.path, "match_table")
+        self.partner_match_table_path = os.path.join(self.path, "partner_match_table")
+        self.delta_path = os.path.join(self.path, "delta")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_file_path)
+
+    def create(self):
+        """
+        Start a new state, dropping whatever a previous run left behind
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self.record_store.create()
+        for dir_path in (self.match_table_path, self.partner_match_table_path, self.bucket_path):
+            if os.path.exists(dir_path):
+                shutil.rmtree(dir_path)
+        stale_files = [self.meta_file_path, self.k_file_path, self.partner_k_file_path, self.sketch_file_path]
+        stale_files += glob.glob(os.path.join(self.path, "psi_result.*"))
+        stale_files += glob.glob(os.path.join(self.delta_path, "*"))
+        for file_path in stale_files:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def append_records(self, records: pd.DataFrame):
+        self.record_store.append(records)
+
+    def save_row_index(self, row_keys: np.ndarray, key_count: int):
+        """
+        Save the rows of every hash, given the hash position of every stored row
+        """
+        rows, offsets = build_row_index(row_keys, key_count)
+        np.save(self.rows_file_path, rows)
+        np.save(self.row_offsets_file_path, offsets)
+
+    def save_meta(self, meta: Dict[str, Any]):
+        with open(self.meta_file_path, 'w') as f:
+            json.dump(meta, f)
+
+    def load_meta(self) -> Dict[str, Any]:
+        with open(self.meta_file_path, 'r') as f:
+            return json.load(f)
+
+    def hashes(self) -> PackedValues:
+        return load_values_from_binary(self.h_file_path)
+
+    def row_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.load(self.rows_file_path, mmap_mode="r"), np.load(self.row_offsets_file_path)
+
+    def key_rows(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return every row of the hashes at positions, and the hash position of each row
+        """
+        rows, offsets = self.row_index()
+        return expand_row_index(positions, rows, offsets)
+
+    def save_match_table(self, table_path: str, df: pd.DataFrame):
+        """
+        Replace a match table (match_table_path or partner_match_table_path)
+        """
+        store = ColumnStore(table_path)
+        store.create()
+        store.append(df.reset_index(drop=True))
+
+    def match_table(self, table_path: str) -> pd.DataFrame:
+        """
+        Return a match table, or None when no step has saved it
+        """
+        store = ColumnStore(table_path)
+        return store.take() if store.exists() else None
+
+    def records(self, rows=None, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Read the data columns of the given rows (all of them by default)
+        """
+        if not self.record_store.exists():
+            return pd.DataFrame(columns=columns or [])
+        return self.record_store.take(rows, columns)
+
+def _data_column_frame(df: pd.DataFrame, data_columns: List[str]) -> pd.DataFrame:
+    """
+    Keep only the data columns of a dataset (duplicate names are kept once)
+    """
+    columns = list(dict.fromkeys(col for col in data_columns if col in df.columns))
+    return df.loc[:, columns]
+
+# Dataset registry: record hashes and data columns of a dataset, cached once per content and
+# id columns so later runs on the same file (with any partner or request) skip parsing and hashing
+DATASET_REF_PREFIX = "dataset:"
+DATASET_DIGEST_BLOCK = 1 << 20
+# Version of the entry layout, part of every fingerprint so entries of another layout are never read
+DATASET_REGISTRY_VERSION = 2
+# Default limits of a registry: entries unused for longer are dropped, then the least recently
+# used ones until the registry fits in the size
+DATASET_REGISTRY_MAX_BYTES = 4 << 30
+DATASET_REGISTRY_MAX_AGE = 30 * 24 * 3600
+
+class DatasetRegistry:
+    """
+    Cache of hashed datasets under one directory:
+    - index.json: content digest of every registered file, reused while its size and mtime hold
+    - <fingerprint>/h_values.bin: the record hash of every row, in file order
+    - <fingerprint>/records/: the data columns, a ColumnStore that keeps their types
+    - <fingerprint>/entry.json: source, columns and block sizes, written last so it marks a complete
+      entry; its modification time is the last use of the entry
+    The fingerprint covers the file content and the id columns. Entries are dropped when unused
+    for max_age seconds, and the least recently used ones while the registry exceeds max_bytes
+    """
+
+    def __init__(self, path: str, max_bytes: int = DATASET_REGISTRY_MAX_BYTES, max_age: float = DATASET_REGISTRY_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_file_path = os.path.join(path, "index.json")
+
+    def _load_index(self) -> Dict[str, Any]:
+        if not os.path.exists(self.index_file_path):
+            return {}
+        with open(self.index_file_path, 'r') as f:
+            return json.load(f)
+
+    def content_digest(self, source: str) -> str:
+        """
+        Return the SHA-256 of a dataset file (plus the table of an SQLite source)
+        The digest is only recomputed when the file size or modification time changed
+        """
+        # An SQLite source names its table after the file path
+        file_path, _, table = (source, "", "") if os.path.exists(source) else source.partition("#")
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        index = self._load_index()
+        cached = index.get(file_path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            digest = cached["digest"]
+        else:
+            sha = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(DATASET_DIGEST_BLOCK), b""):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            index[file_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.index_file_path, 'w') as f:
+                json.dump(index, f)
+        return f"{digest}#{table}" if table else digest
+
+    def fingerprint(self, source: str, id_columns: List[str]) -> str:
+        key = json.dumps({
+            "version": DATASET_REGISTRY_VERSION,
+            "content": self.content_digest(source),
+            "id_columns": id_columns
+        })
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def entry(self, fingerprint: str) -> Dict[str, Any]:
+        """
+        Return the metadata of a registered dataset, or None when it is not registered
+        """
+        entry_file_path = os.path.join(self.path, fingerprint, "entry.json")
+        if not os.path.exists(entry_file_path):
+            return None
+        with open(entry_file_path, 'r') as f:
+            return json.load(f)
+
+    def register(
+        self,
+        source: str,
+        id_columns: List[str],
+        data_columns: List[str],
+        chunk_rows: int = 0
+    ) -> str:
+        """
+        Parse and hash a dataset once and cache its hashes and data columns
+        chunk_rows reads it in blocks of rows (0 = the whole file at once), as step 1 would
+        Returns the fingerprint that refers to the dataset
+        """
+        fingerprint = self.fingerprint(source, id_columns)
+        entry_path = os.path.join(self.path, fingerprint)
+        if os.path.exists(entry_path):
+            shutil.rmtree(entry_path)
+        os.makedirs(entry_path)
+        
+        if chunk_rows > 0:
+            chunks = iter_dataset_chunks(source, chunk_rows, id_columns + data_columns)
+        else:
+            chunks = [load_dataset(source, id_columns + data_columns)]
+        
+        records = ColumnStore(os.path.join(entry_path, "records"))
+        records.create()
+        blocks = []
+        with ValuesWriter(os.path.join(entry_path, "h_values.bin"), RECORD_HASH_BYTES) as h_writer:
+            for chunk in chunks:
+                h_writer.write(hash_id_columns(chunk, id_columns))
+                records.append(_data_column_frame(chunk, data_columns))
+                blocks.append(len(chunk))
+        
+        with open(os.path.join(entry_path, "entry.json"), 'w') as f:
+            json.dump({
+                "version": DATASET_REGISTRY_VERSION,
+                "source": source,
+                "id_columns": id_columns,
+                "data_columns": data_columns,
+                "blocks": blocks
+            }, f)
+        return fingerprint
+
+    def resolve(
+        self,
+        source: str,
+        id_columns: List[str],
+        data_columns: List[str],
+        chunk_rows: int = 0
+    ) -> str:
+        """
+        Return the fingerprint of a dataset holding the requested columns, registering it on a miss
+        source is a dataset path, or dataset:<fingerprint> for an already registered dataset
+        """
+        if source.startswith(DATASET_REF_PREFIX):
+            fingerprint = source[len(DATASET_REF_PREFIX):]
+            entry = self.entry(fingerprint)
+            if entry is None:
+                raise ValueError(f"Dataset {fingerprint} is not registered in {self.path} (or was evicted)")
+            if entry["id_columns"] != id_columns:
+                raise ValueError(f"Dataset {fingerprint} was registered with id columns {entry['id_columns']}")
+            source = entry["source"]
+        else:
+            fingerprint = self.fingerprint(source, id_columns)
+            entry = self.entry(fingerprint)
+        
+        if entry is not None and set(data_columns) <= set(entry["data_columns"]):
+            os.utime(os.path.join(self.path, fingerprint, "entry.json"))
+        else:
+            # Register again with the union of the cached and requested data columns
+            if entry is not None:
+                data_columns = list(dict.fromkeys(entry["data_columns"] + data_columns))
+            fingerprint = self.register(source, id_columns, data_columns, chunk_rows)
+        self.evict(keep=fingerprint)
+        return fingerprint
+
+    def evict(self, keep: str = None):
+        """
+        Drop the entries unused for max_age seconds, then the least recently used ones until the
+        registry fits in max_bytes; keep is never dropped
+        Directories without entry.json (interrupted registrations) count as used when last modified
+        """
+        entries = []
+        for name in os.listdir(self.path) if os.path.isdir(self.path) else []:
+            entry_path = os.path.join(self.path, name)
+            if not os.path.isdir(entry_path):
+                continue
+            entry_file_path = os.path.join(entry_path, "entry.json")
+            last_used = os.path.getmtime(entry_file_path if os.path.exists(entry_file_path) else entry_path)
+            size = sum(os.path.getsize(os.path.join(root, file_name))
+                       for root, _, file_names in os.walk(entry_path) for file_name in file_names)
+            entries.append((last_used, size, name))
+        
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for last_used, size, name in entries:
+            if name == keep or (now - last_used <= self.max_age and total <= self.max_bytes):
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            total -= size
+
+    def iter_blocks(self, fingerprint: str, data_columns: List[str]) -> Iterator[Tuple[List[int], pd.DataFrame]]:
+        """
+        Yield the record hashes and data columns of a registered dataset, one block at a time
+        """
+        entry = self.entry(fingerprint)
+        entry_path = os.path.join(self.path, fingerprint)
+        hash_values = value_keys(load_values_from_binary(os.path.join(entry_path, "h_values.bin")))
+        records = ColumnStore(os.path.join(entry_path, "records"))
+        start = 0
+        for rows in entry["blocks"]:
+            block = np.arange(start, start + rows, dtype=np.int64)
+            yield keys_to_ints(hash_values[start:start + rows]), records.take(block, data_columns)
+            start += rows
+
+def iter_hashed_blocks(
+    excel_path: str,
+    id_columns: List[str],
+    data_columns: List[str],
+    chunk_rows: int = 0,
+    registry: DatasetRegistry = None
+) -> Iterator[Tuple[List[int], pd.DataFrame]]:
+    """
+    Yield the record hashes and data columns of a dataset in blocks of chunk_rows rows
+    (0 = one block), from the registry cache when a registry is given
+    """
+    if registry is not None:
+        fingerprint = registry.resolve(excel_path, id_columns, data_columns, chunk_rows)
+        yield from registry.iter_blocks(fingerprint, data_columns)
+        return
+    
+    # Load only the id and data columns (missing columns fail before any row is read)
+    if chunk_rows > 0:
+        chunks = iter_dataset_chunks(excel_path, chunk_rows, id_columns + data_columns)
+    else:
+        chunks = [load_dataset(excel_path, id_columns + data_columns)]
+    for chunk in chunks:
+        yield hash_id_columns(chunk, id_columns), _data_column_frame(chunk, data_columns)
+
+def _blind_new_hashes(
+    blocks: Iterator[Tuple[List[int], pd.DataFrame]],
+    state: PSIStateStore,
+    seen: _SeenHashes,
+    private_key: int,
+    prime: int,
+    psi_mode: str,
+    workers: int,
+    chunk_size: int,
+    append: bool = False,
+    delta_file_path: str = None
+) -> Tuple[int, int]:
+    """
+    Blind the hashes of every block that seen does not hold yet, exactly once each:
+    - Append the new hashes and their blinded values to the state (and the delta c file)
+    - Append the data columns of every row
+    - Save the row index of all stored rows
+    Rows of a hash seen before reuse its stored c value, so an incremental run keeps the
+    records added to hashes the partner already holds
+    Returns the number of new hashes and of stored rows
+    """
+    base_count = seen.count
+    row_keys = []
+    width = value_width(prime, psi_mode)
+    
+    delta_writer = ValuesWriter(delta_file_path, width) if delta_file_path else None
+    with ValuesWriter(state.h_file_path, RECORD_HASH_BYTES, append=append) as h_writer, \
+            ValuesWriter(state.c_file_path, width, append=append) as c_writer:
+        for hashes, records in blocks:
+            positions, new_hashes = seen.assign(hashes)
+            if new_hashes:
+                c_values = blind_record_hashes(new_hashes, private_key, prime, psi_mode, workers, chunk_size)
+                h_writer.write(new_hashes)
+                c_writer.write(c_values)
+                if delta_writer is not None:
+                    delta_writer.write(c_values)
+            
+            if len(positions):
+                state.append_records(records)
+                row_keys.append(positions)
+    if delta_writer is not None:
+        delta_writer.close()
+    
+    row_keys = np.concatenate(row_keys) if row_keys else np.empty(0, dtype=np.int64)
+    state.save_row_index(row_keys, seen.count)
+    return seen.count - base_count, len(row_keys)
+
+def run_psi_step1(
+    excel_path: str,
+    id_columns: List[str],
+    data_columns: List[str],
+    private_key: int,
+    prime: int,
+    state: PSIStateStore,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    psi_mode: str = PSI_MODE_MODP,
+    registry: DatasetRegistry = None
+) -> str:
+    """
+    Run step 1 of the PSI protocol:
+    - Load data, or its cached hashes and data columns when a dataset registry is given
+    - Compute hashes, and blind every distinct hash once
+    - Save hashes, blinded values, row index and data columns to the state store
+    - Return the blinded value file path
+    """
+    state.create()
+    
+    blocks = iter_hashed_blocks(excel_path, id_columns, data_columns, 0, registry)
+    hash_count, record_count = _blind_new_hashes(
+        blocks, state, _SeenHashes(), private_key, prime, psi_mode, workers, chunk_size
+    )
+    if hash_count < record_count:
+        print(f"Found {record_count - hash_count} duplicate hashes, each distinct hash is blinded once")
+    
+    state.save_meta({
+        "id_columns": id_columns,
+        "data_columns": data_columns,
+        "psi_mode": psi_mode,
+        "private_key": private_key,
+        "prime": prime,
+        "record_count": record_count
+    })
+    
+    return state.c_file_path
+
+def run_psi_step1_streaming(
+    excel_path: str,
+    id_columns: List[str],
+    data_columns: List[str],
+    private_key: int,
+    prime: int,
+    state: PSIStateStore,
+    chunk_rows: int = STREAM_CHUNK_ROWS,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    psi_mode: str = PSI_MODE_MODP,
+    registry: DatasetRegistry = None
+) -> Tuple[str, int]:
+    """
+    Run step 1 of the PSI protocol one chunk of rows at a time:
+    - Read chunk_rows rows from the dataset
+    - Hash them, and blind the hashes no earlier chunk carried
+    - Append the new hashes, blinded values and data columns to the state store
+    Peak memory follows chunk_rows plus the sorted set of distinct hashes, instead of the
+    dataset size. Duplicate records share their hash's entry and are all kept in the row index
+    With a dataset registry, the cached hashes and data columns are read instead
+    Returns the blinded value file path and the number of records
+    """
+    state.create()
+    
+    blocks = iter_hashed_blocks(excel_path, id_columns, data_columns, chunk_rows, registry)
+    _, record_count = _blind_new_hashes(
+        blocks, state, _SeenHashes(), private_key, prime, psi_mode, workers, chunk_size
+    )
+    
+    state.save_meta({
+        "id_columns": id_columns,
+        "data_columns": data_columns,
+        "psi_mode": psi_mode,
+        "private_key": private_key,
+        "prime": prime,
+        "record_count": record_count
+    })
+    
+    return state.c_file_path, record_count
+
+def run_psi_step1_incremental(
+    excel_path: str,
+    id_columns: List[str],
+    data_columns: List[str],
+    state: PSIStateStore,
+    chunk_rows: int = 0,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    registry: DatasetRegistry = None
+) -> Tuple[str, int]:
+    """
+    Run step 1 again on a dataset that changed since the last run of the request:
+    - Hash the dataset (chunk_rows rows at a time, 0 = the whole file at once), or read
+      its cached hashes when a dataset registry is given
+    - Blind only the hashes the state does not hold yet, with the key of the previous run
+    - Append them to the state store and write them to the delta c file shared with the partner
+    - Store the records and row index of the whole dataset again, so new rows of a hash
+      the state already holds reach the match table of step 3
+    Returns the delta c file path and the number of new hashes
+    """
+    meta = state.load_meta()
+    if "private_key" not in meta:
+        raise ValueError(f"PSI state in {state.path} predates incremental runs, run a full PSI first")
+    if meta["id_columns"] != id_columns or meta["data_columns"] != data_columns:
+        raise ValueError("Incremental runs must use the id and data columns of the previous run")
+    private_key, prime, psi_mode = meta["private_key"], meta["prime"], meta["psi_mode"]
+    
+    seen = _SeenHashes(hash_keys(state.hashes()))
+    # The state is incomplete until the records are stored again
+    os.remove(state.meta_file_path)
+    state.record_store.create()
+    
+    os.makedirs(state.delta_path, exist_ok=True)
+    delta_c_file_path = os.path.join(state.delta_path, "c_values.bin")
+    blocks = iter_hashed_blocks(excel_path, id_columns, data_columns, chunk_rows, registry)
+    new_count, record_count = _blind_new_hashes(
+        blocks, state, seen, private_key, prime, psi_mode, workers, chunk_size,
+        append=True, delta_file_path=delta_c_file_path
+    )
+    
+    meta["record_count"] = record_count
+    state.save_meta(meta)
+    
+    return delta_c_file_path, new_count
+
+def run_psi_step2(
+    partner_c_file_path: str,
+    private_key: int,
+    prime: int,
+    output_dir: str,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    psi_mode: str = PSI_MODE_MODP
+) -> str:
+    """
+    Run step 2 of the PSI protocol:
+    - Load partner's blinded values
+    - Compute second blinded values
+    - Save second blinded values to file
+    - Return file path
+    The k file keeps the order of the partner's c values and is both what we share
+    with the partner and our side of the intersection in step 3
+    """
+    # Load partner's blinded values
+    partner_c_values = load_values(partner_c_file_path)
+    # print(f"Loaded {len(partner_c_values)} partner blinded values")
+    
+    # Compute second blinded values k = c^private_key mod prime, exactly once per partner value
+    k_values = compute_second_blinded_values(
+        partner_c_values, private_key, prime, workers, chunk_size, psi_mode
+    )
+    # print(f"Computed {len(k_values)} second blinded values")
+    
+    # Save k values to file - these are what we'll share with partner
+    k_file_path = os.path.join(output_dir, "k_values.bin")
+    save_values_to_binary(k_values, k_file_path, value_width(prime, psi_mode))
     
-    # Convert to integer
-    hash_int = int(hash_hex, 16)
-    return hash_int
+    return k_file_path
 
-def compute_blinded_hash(hash_int: int, private_key: int, prime: int) -> int:
+def intersect_positions(our_k_values, partner_k_values) -> np.ndarray:
     """
-    Compute h^(private_key) mod prime
+    Return the positions in partner_k_values (our row order) whose k value is also one of ours
+    Both sides are compared as fixed-width byte arrays with a sort-based join
     """
-    return pow(hash_int, private_key, prime)
+    partner_keys = value_keys(partner_k_values)
+    our_keys = value_keys(our_k_values, partner_keys.dtype.itemsize)
+    return np.flatnonzero(np.isin(partner_keys, our_keys))
 
-def process_dataset(df: pd.DataFrame, id_columns: List[str], private_key: int, prime: int) -> Tuple[Dict[int, int], Dict[int, pd.Series]]:
+# Memory budget in bytes of the external-sort intersection
+EXTERNAL_SORT_MEMORY = 256 * 1024 * 1024
+
+def _spill_sorted_runs(keys: np.ndarray, with_positions: bool, run_records: int, run_dir: str) -> Tuple[List[str], np.dtype]:
     """
-    Process dataset to compute hashes and blinded values
-    Returns:
-    - h_to_c_map: mapping from original hash to blinded hash
-    - h_to_record_map: mapping from original hash to original record
+    Sort keys in runs of run_records records and write every run to its own file
+    keys is normally a view of a memory-mapped file, so one run is in memory at a time
+    With with_positions, each record also carries the key's position in keys
     """
-    h_to_c_map = {}
-    h_to_record_map = {}
+    os.makedirs(run_dir, exist_ok=True)
+    width = keys.dtype.itemsize
+    if with_positions:
+        dtype = np.dtype([("key", f"S{width}"), ("pos", "<i8")])
+    else:
+        dtype = np.dtype(f"S{width}")
     
-    # Check if id_columns exist in the dataframe
-    missing_columns = [col for col in id_columns if col not in df.columns]
-    if missing_columns:
-        print(f"WARNING: The following ID columns are missing from the dataframe: {missing_columns}")
-        print(f"Available columns: {df.columns.tolist()}")
+    runs = []
+    for start in range(0, len(keys), run_records):
+        block = np.array(keys[start:start + run_records])
+        order = np.argsort(block, kind="stable")
+        if with_positions:
+            run = np.empty(len(block), dtype=dtype)
+            run["key"] = block[order]
+            run["pos"] = order + start
+        else:
+            run = block[order]
+        run_path = os.path.join(run_dir, f"run-{len(runs):05d}.bin")
+        run.tofile(run_path)
+        runs.append(run_path)
+    return runs, dtype
+
+def _iter_run(run_path: str, dtype: np.dtype, block_records: int):
+    """
+    Yield the records of one sorted run, reading block_records at a time
+    """
+    count = os.path.getsize(run_path) // dtype.itemsize
+    with open(run_path, 'rb') as f:
+        for _ in range(0, count, block_records):
+            yield from np.fromfile(f, dtype=dtype, count=block_records).tolist()
+
+def external_intersect_positions(
+    our_k_values,
+    partner_k_values,
+    memory_budget: int = EXTERNAL_SORT_MEMORY,
+    temp_dir: str = None
+) -> np.ndarray:
+    """
+    Disk-backed version of intersect_positions for sets larger than memory
+    Both sides are cut into sorted runs that fit memory_budget and spilled to temp files,
+    the runs are k-way merged, and one streaming merge-join emits the matching positions
+    """
+    partner_keys = value_keys(partner_k_values)
+    our_keys = value_keys(our_k_values, partner_keys.dtype.itemsize)
+    width = partner_keys.dtype.itemsize
     
-    # Only show first 3 records for debugging to avoid excessive output
-    debug_limit = 3
-    record_count = 0
+    # Small enough to sort in memory
+    if (len(partner_keys) + len(our_keys)) * (width + 8) <= memory_budget:
+        return intersect_positions(our_keys, partner_keys)
     
-    for _, record in df.iterrows():
-        record_count += 1
-        debug_mode = record_count <= debug_limit
-        
-        # if debug_mode:
-        #     print(f"\nProcessing record {record_count}:")
-        
-        h = compute_record_hash(record, id_columns)
-        c = compute_blinded_hash(h, private_key, prime)
-        
-        # if debug_mode:
-        #     print(f"Hash: {h}, Blinded hash: {c}")
+    # A run is sorted in memory next to its argsort and copy
+    run_records = max(1, memory_budget // (2 * (width + 8)))
+    positions = array('q')
+    with tempfile.TemporaryDirectory(prefix="psi-sort-", dir=temp_dir) as run_dir:
+        our_runs, our_dtype = _spill_sorted_runs(our_keys, False, run_records, os.path.join(run_dir, "ours"))
+        partner_runs, partner_dtype = _spill_sorted_runs(partner_keys, True, run_records, os.path.join(run_dir, "partner"))
         
-        h_to_c_map[h] = c
-        h_to_record_map[h] = record
+        # Every run gets an equal share of the budget as its read buffer
+        block_records = max(1, memory_budget // ((len(our_runs) + len(partner_runs)) * (width + 8)))
+        ours = heapq.merge(*[_iter_run(path, our_dtype, block_records) for path in our_runs])
+        partner = heapq.merge(*[_iter_run(path, partner_dtype, block_records) for path in partner_runs])
+        try:
+            our_key = next(ours, None)
+            for key, position in partner:
+                while our_key is not None and our_key < key:
+                    our_key = next(ours, None)
+                if our_key is None:
+                    break
+                if our_key == key:
+                    positions.append(position)
+        finally:
+            ours.close()
+            partner.close()
+    
+    return np.sort(np.frombuffer(positions, dtype=np.int64))
+
+# Compressed k exchange: only the trailing bytes of every k value are sent, a fingerprint long
+# enough that a non-matching row is taken for a match with at most the configured probability
+MIN_FINGERPRINT_BYTES = 4
+
+def fingerprint_width(set_size: int, fp_rate: float, width: int) -> int:
+    """
+    Return the bytes per fingerprint so that a value outside a set of set_size values
+    collides with one of them with probability at most fp_rate
+    """
+    bits = math.log2(max(set_size, 1) / fp_rate)
+    return min(width, max(MIN_FINGERPRINT_BYTES, math.ceil(bits / 8)))
+
+def truncate_keys(keys: np.ndarray, width: int) -> np.ndarray:
+    """
+    Keep the trailing width bytes of every fixed-width value (no-op for narrower values)
+    """
+    if keys.dtype.itemsize <= width:
+        return keys
+    raw = np.ascontiguousarray(keys).view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+    return np.ascontiguousarray(raw[:, -width:]).view(f"S{width}").ravel()
+
+def save_keys(keys: np.ndarray, output_file: str) -> str:
+    """
+    Save fixed-width keys (k values or their fingerprints) to a binary value container, keeping their order
+    """
+    with ValuesWriter(output_file, keys.dtype.itemsize) as writer:
+        writer.write_records(keys)
+    return output_file
+
+def append_values(input_file: str, output_file: str) -> int:
+    """
+    Append the values of one binary value container to another (created when missing)
+    Returns the number of values the output holds afterwards
+    """
+    keys = value_keys(load_values_from_binary(input_file))
+    with ValuesWriter(output_file, keys.dtype.itemsize, append=True) as writer:
+        writer.write_records(keys)
+        return writer.count
+
+# Partitioned mode: k values are split into buckets by their trailing bytes. Equal k values
+# land in the same bucket on both sides, and k values are shared anyway, so the split reveals nothing new
+BUCKET_MANIFEST_TYPE = "psi_k_buckets"
+# Uploads and downloads of bucket files run at the same time
+IPFS_CONCURRENCY = 8
+
+def bucket_ids(keys: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    Return the bucket of every fixed-width value: its last 4 bytes, big-endian, modulo buckets
+    """
+    width = keys.dtype.itemsize
+    tail = np.ascontiguousarray(keys).view(np.uint8).reshape(len(keys), width)[:, -min(4, width):]
+    ids = np.zeros(len(keys), dtype=np.uint64)
+    for column in range(tail.shape[1]):
+        ids = (ids << np.uint64(8)) | tail[:, column].astype(np.uint64)
+    return (ids % np.uint64(buckets)).astype(np.int64)
+
+def bucket_file_path(bucket_dir: str, bucket: int) -> str:
+    return os.path.join(bucket_dir, f"k-{bucket:05d}.bin")
+
+def write_k_buckets(k_values, buckets: int, bucket_dir: str) -> List[str]:
+    """
+    Split k values into bucket files, each value stored with its position in k_values
+    (which is the partner's row order, the order of their c values)
+    """
+    os.makedirs(bucket_dir, exist_ok=True)
+    for stale_file in glob.glob(os.path.join(bucket_dir, "k-*.bin")):
+        os.remove(stale_file)
     
-    # print(f"Processed {record_count} records")
-    # print(f"Generated {len(h_to_c_map)} unique hashes")
+    keys = value_keys(k_values)
+    dtype = positioned_dtype(keys.dtype.itemsize)
+    paths = [bucket_file_path(bucket_dir, bucket) for bucket in range(buckets)]
+    writers = [ValuesWriter(path, keys.dtype.itemsize, VALUES_FLAG_POSITIONS) for path in paths]
+    try:
+        for start in range(0, len(keys), VALUES_WRITE_BATCH_SIZE):
+            block = keys[start:start + VALUES_WRITE_BATCH_SIZE]
+            records = np.empty(len(block), dtype=dtype)
+            records["key"] = block
+            records["pos"] = np.arange(start, start + len(block))
+            
+            # Group the block by bucket, keeping value order inside each bucket
+            ids = bucket_ids(block, buckets)
+            order = np.argsort(ids, kind="stable")
+            bounds = np.searchsorted(ids[order], np.arange(buckets + 1))
+            for bucket in range(buckets):
+                if bounds[bucket] < bounds[bucket + 1]:
+                    writers[bucket].write_records(records[order[bounds[bucket]:bounds[bucket + 1]]])
+    finally:
+        for writer in writers:
+            writer.close()
+    return paths
+
+def save_bucket_manifest(cids: List[str], output_file: str):
+    with open(output_file, 'w') as f:
+        json.dump({"type": BUCKET_MANIFEST_TYPE, "buckets": len(cids), "cids": cids}, f)
+
+def load_bucket_manifest(input_file: str) -> Dict[str, Any]:
+    """
+    Return the bucket manifest stored in a file, or None when it holds something else
+    """
+    with open(input_file, 'rb') as f:
+        if f.read(1) != b"{":
+            return None
+    with open(input_file, 'r') as f:
+        try:
+            manifest = json.load(f)
+        except ValueError:
+            return None
+    if not isinstance(manifest, dict) or manifest.get("type") != BUCKET_MANIFEST_TYPE:
+        return None
+    return manifest
+
+def upload_files_to_ipfs(file_paths: List[str]) -> List[str]:
+    """
+    Upload several files to IPFS at once, returning their CIDs in order
+    """
+    with ThreadPoolExecutor(max_workers=IPFS_CONCURRENCY) as executor:
+        return list(executor.map(upload_to_ipfs, file_paths))
+
+def download_files_from_ipfs(cids: List[str], output_paths: List[str]) -> List[str]:
+    """
+    Download several files from IPFS at once
+    """
+    with ThreadPoolExecutor(max_workers=IPFS_CONCURRENCY) as executor:
+        return list(executor.map(download_from_ipfs, cids, output_paths))
+
+def _intersect_bucket(our_bucket_path: str, partner_bucket_path: str) -> np.ndarray:
+    """
+    Return the positions of the partner bucket's values that are also in our bucket
+    (runs inside a worker process)
+    """
+    ours = load_positioned_values(our_bucket_path)
+    partner = load_positioned_values(partner_bucket_path)
+    # Fingerprint buckets are compared on their common trailing bytes
+    width = min(ours.dtype["key"].itemsize, partner.dtype["key"].itemsize)
+    mask = np.isin(truncate_keys(partner["key"], width), truncate_keys(ours["key"], width))
+    return partner["pos"][mask].astype(np.int64)
+
+def _count_bucket(our_bucket_path: str, partner_bucket_path: str) -> int:
+    """
+    Return the number of distinct k values two buckets have in common
+    (runs inside a worker process)
+    """
+    ours = load_positioned_values(our_bucket_path)
+    partner = load_positioned_values(partner_bucket_path)
+    width = min(ours.dtype["key"].itemsize, partner.dtype["key"].itemsize)
+    return len(np.intersect1d(truncate_keys(partner["key"], width), truncate_keys(ours["key"], width)))
+
+def _map_bucket_pairs(func, our_bucket_paths: List[str], partner_bucket_paths: List[str], workers: int = 1) -> List[Any]:
+    """
+    Apply func to every pair of our and the partner's bucket files, on a process pool when workers > 1
+    """
+    if len(our_bucket_paths) != len(partner_bucket_paths):
+        raise ValueError(f"Bucket counts differ: {len(our_bucket_paths)} local, {len(partner_bucket_paths)} from partner")
+    if workers <= 0:
+        workers = os.cpu_count() or 1
     
-    # If the number of unique hashes is less than the number of records, there might be duplicates
-    if len(h_to_c_map) < record_count:
-        print(f"WARNING: Found {record_count - len(h_to_c_map)} duplicate hashes")
+    if workers == 1 or len(partner_bucket_paths) <= 1:
+        return list(map(func, our_bucket_paths, partner_bucket_paths))
+    with ProcessPoolExecutor(max_workers=min(workers, len(partner_bucket_paths))) as executor:
+        return list(executor.map(func, our_bucket_paths, partner_bucket_paths))
+
+def intersect_bucket_positions(
+    our_bucket_paths: List[str],
+    partner_bucket_paths: List[str],
+    workers: int = 1
+) -> np.ndarray:
+    """
+    Intersect bucket by bucket and return the matching positions in our row order
+    With workers > 1 the buckets run on a process pool (workers = 0 uses one process per CPU core)
+    """
+    results = _map_bucket_pairs(_intersect_bucket, our_bucket_paths, partner_bucket_paths, workers)
+    if not results:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(results))
+
+# Sketch mode: each party sends a HyperLogLog sketch of its k values instead of the values,
+# and both estimate the overlap from the merged sketch (a few KB whatever the set sizes)
+SKETCH_TYPE = "psi_k_sketch"
+# 2^12 one-byte registers, a relative standard error of about 1.6% on the union
+HLL_PRECISION = 12
+# Normal quantile of the reported confidence interval (95%)
+SKETCH_CONFIDENCE_Z = 1.96
+
+def _mix_keys(keys: np.ndarray) -> np.ndarray:
+    """
+    Hash every fixed-width value to a uniformly distributed 64-bit integer
+    (the value's 8-byte words are folded in with the splitmix64 finalizer)
+    """
+    width = keys.dtype.itemsize
+    words = -(-width // 8)
+    raw = np.zeros((len(keys), words * 8), dtype=np.uint8)
+    raw[:, words * 8 - width:] = np.ascontiguousarray(keys).view(np.uint8).reshape(len(keys), width)
+    raw = raw.view(">u8").astype(np.uint64)
     
-    return h_to_c_map, h_to_record_map
+    mixed = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for word in range(words):
+            mixed = mixed ^ raw[:, word]
+            mixed = mixed + np.uint64(0x9E3779B97F4A7C15)
+            mixed = (mixed ^ (mixed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            mixed = (mixed ^ (mixed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            mixed = mixed ^ (mixed >> np.uint64(31))
+    return mixed
 
-def save_values_to_excel(values: List[int], output_file: str, column_name: str = "Value"):
+def _bit_length(values: np.ndarray) -> np.ndarray:
     """
-    Save a list of values to Excel file
+    Return the bit length of every 64-bit value (exact, each 32-bit half goes through a float)
     """
-    df = pd.DataFrame({column_name: values})
-    df.to_excel(output_file, index=False)
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
 
-def save_values_to_json(values: List[int], output_file: str):
+def hll_registers(k_values, precision: int = HLL_PRECISION) -> np.ndarray:
     """
-    Save a list of values to JSON file (more efficient for large numbers)
+    Build the HyperLogLog registers of a set of k values
     """
-    with open(output_file, 'w') as f:
-        json.dump(values, f)
+    keys = value_keys(k_values)
+    registers = np.zeros(1 << precision, dtype=np.uint8)
+    for start in range(0, len(keys), VALUES_WRITE_BATCH_SIZE):
+        mixed = _mix_keys(keys[start:start + VALUES_WRITE_BATCH_SIZE])
+        # The top bits pick the register, the rank is the position of the first 1 in the rest
+        index = (mixed >> np.uint64(64 - precision)).astype(np.int64)
+        rest = mixed & np.uint64((1 << (64 - precision)) - 1)
+        rank = (64 - precision + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(registers, index, rank)
+    return registers
 
-def load_values_from_excel(input_file: str, column_name: str = "Value") -> List[int]:
+def hll_estimate(registers: np.ndarray) -> float:
     """
-    Load a list of values from Excel file
+    Estimate the number of distinct values behind HyperLogLog registers
     """
-    df = pd.read_excel(input_file)
-    return df[column_name].tolist()
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    # Small sets: linear counting over the empty registers is more accurate
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return float(estimate)
 
-def load_values_from_json(input_file: str) -> List[int]:
+def save_k_sketch(k_values, output_file: str, precision: int = HLL_PRECISION) -> str:
     """
-    Load a list of values from JSON file
+    Save the sketch of our k values together with their exact distinct count
+    """
+    keys = value_keys(k_values)
+    sketch = {
+        "type": SKETCH_TYPE,
+        "precision": precision,
+        "count": int(len(np.unique(keys))),
+        "registers": base64.b64encode(hll_registers(keys, precision).tobytes()).decode("ascii")
+    }
+    with open(output_file, 'w') as f:
+        json.dump(sketch, f)
+    return output_file
+
+def load_k_sketch(input_file: str) -> Dict[str, Any]:
+    """
+    Load a k sketch, returning its count and registers
     """
     with open(input_file, 'r') as f:
-        return json.load(f)
+        try:
+            sketch = json.load(f)
+        except ValueError:
+            raise ValueError(f"Not a k sketch file: {input_file}")
+    if not isinstance(sketch, dict) or sketch.get("type") != SKETCH_TYPE:
+        raise ValueError(f"Not a k sketch file: {input_file}")
+    registers = np.frombuffer(base64.b64decode(sketch["registers"]), dtype=np.uint8)
+    if len(registers) != 1 << sketch["precision"]:
+        raise ValueError(f"k sketch holds {len(registers)} registers for precision {sketch['precision']}")
+    return {"count": sketch["count"], "registers": registers}
 
-def compute_second_blinded_values(blinded_values: List[int], private_key: int, prime: int) -> List[int]:
+def estimate_intersection(our_sketch: Dict[str, Any], partner_sketch: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Compute c^(private_key) mod prime for each c in blinded_values
+    Estimate the overlap of two sketched sets as |A| + |B| - |A ∪ B|
+    Our sketch covers the partner's records and theirs covers ours (k values are computed
+    on the other party's c values). The set sizes are exact, so the error is the one of the union
     """
-    return [pow(c, private_key, prime) for c in blinded_values]
+    if len(our_sketch["registers"]) != len(partner_sketch["registers"]):
+        raise ValueError("k sketches were built with different precisions")
+    union = hll_estimate(np.maximum(our_sketch["registers"], partner_sketch["registers"]))
+    our_count, partner_count = partner_sketch["count"], our_sketch["count"]
+    # The union holds at least the larger set and at most both
+    union = min(max(union, our_count, partner_count), our_count + partner_count)
+    estimate = our_count + partner_count - union
+    margin = SKETCH_CONFIDENCE_Z * 1.04 / math.sqrt(len(our_sketch["registers"])) * union
+    return {
+        "estimate": int(round(estimate)),
+        "lower": int(max(0, math.floor(estimate - margin))),
+        "upper": int(min(our_count, partner_count, math.ceil(estimate + margin))),
+        "our_count": our_count,
+        "partner_count": partner_count
+    }
 
-def find_intersection(values_a: List[int], values_b: List[int]) -> Set[int]:
+# Columns the match tables add next to the data columns; row_removed marks the records an
+# incremental run removes from the partner's copy of the table
+MATCH_TABLE_COLUMNS = ("hash_id", "row_id", "row_removed")
+
+# Keys of the two pandas row hashes that make the digest of a row id
+ROW_ID_HASH_KEYS = ("psi-row-id-key-1", "psi-row-id-key-2")
+
+def match_row_ids(match_df: pd.DataFrame) -> List[str]:
     """
-    Find intersection between two lists of values
+    Return an id for every row of a match table: a digest of its hash_id and typed data values,
+    plus its occurrence among identical rows, so a row keeps its id across incremental runs
+    Columns are hashed whole; object columns add the type of every cell, which their hash ignores
     """
-    set_a = set(values_a)
-    set_b = set(values_b)
-    intersection = set_a.intersection(set_b)
-    # print(f"Found {len(intersection)} matching values in intersection")
-    return intersection
+    columns = {}
+    for position in range(match_df.shape[1]):
+        values = match_df.iloc[:, position].reset_index(drop=True)
+        if values.dtype == object:
+            columns[f"{position}_type"] = values.map(lambda value: type(value).__name__, na_action=None)
+        columns[str(position)] = values
+    content = pd.DataFrame(columns, index=pd.RangeIndex(len(match_df)))
+    digests = pd.DataFrame({key: pd.util.hash_pandas_object(content, index=False, hash_key=key)
+                            for key in ROW_ID_HASH_KEYS})
+    # 相同內容的記錄依出現順序編號
+    occurrences = digests.groupby(list(ROW_ID_HASH_KEYS), sort=False).cumcount().tolist()
+    text = digests.to_numpy(dtype=">u8").tobytes().hex()
+    return [f"{text[32 * row:32 * row + 32]}-{occurrence}" for row, occurrence in enumerate(occurrences)]
+
+# Match data of a run with k fingerprints: a fingerprint match is only a candidate, so every
+# candidate record is sealed with our full k value its fingerprint matched. The partner opens it with
+# its own full k value at the record's position, which is the same value only for a true match
+SEAL_NONCE_BYTES = 16
+SEAL_TAG_BYTES = 16
+
+def _seal_keys(k_key: bytes) -> Tuple[bytes, bytes]:
+    """
+    Derive the encryption and authentication keys of a sealed record from a full k value
+    """
+    digest = hashlib.blake2b(k_key, digest_size=64, person=b"psi-match-seal").digest()
+    return digest[:32], digest[32:]
 
-def extract_matching_records(
-    intersection_keys: Set[int],
-    h_to_k_map: Dict[int, int],
-    h_to_record_map: Dict[int, pd.Series],
-    data_columns: List[str]
+def _seal_stream(key: bytes, nonce: bytes, size: int) -> bytes:
+    """
+    Return size bytes of keystream (BLAKE2b of the nonce and a block counter under key)
+    """
+    blocks = [hashlib.blake2b(nonce + struct.pack(">Q", block), key=key, digest_size=64).digest()
+              for block in range((size + 63) // 64)]
+    return b"".join(blocks)[:size]
+
+def _xor_bytes(data: bytes, stream: bytes) -> bytes:
+    return (int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")).to_bytes(len(data), "big")
+
+def seal_cells(k_key: bytes, cells: List[Any]) -> str:
+    """
+    Encrypt and authenticate a JSON-serializable list under a full k value, as hex
+    """
+    enc_key, mac_key = _seal_keys(k_key)
+    nonce = os.urandom(SEAL_NONCE_BYTES)
+    plain = json.dumps(cells).encode("utf-8")
+    cipher = _xor_bytes(plain, _seal_stream(enc_key, nonce, len(plain)))
+    tag = hashlib.blake2b(nonce + cipher, key=mac_key, digest_size=SEAL_TAG_BYTES).digest()
+    return (nonce + cipher + tag).hex()
+
+def open_sealed_cells(k_key: bytes, sealed: str) -> List[Any]:
+    """
+    Return the list sealed with seal_cells, or None when it was sealed under another k value
+    """
+    raw = bytes.fromhex(sealed)
+    if len(raw) < SEAL_NONCE_BYTES + SEAL_TAG_BYTES:
+        return None
+    nonce, cipher, tag = raw[:SEAL_NONCE_BYTES], raw[SEAL_NONCE_BYTES:-SEAL_TAG_BYTES], raw[-SEAL_TAG_BYTES:]
+    enc_key, mac_key = _seal_keys(k_key)
+    if not hmac.compare_digest(tag, hashlib.blake2b(nonce + cipher, key=mac_key, digest_size=SEAL_TAG_BYTES).digest()):
+        return None
+    return json.loads(_xor_bytes(cipher, _seal_stream(enc_key, nonce, len(cipher))).decode("utf-8"))
+
+def _key_bytes(keys: np.ndarray) -> np.ndarray:
+    """
+    View fixed-width keys as rows of bytes (NumPy drops the trailing zero bytes of a single key)
+    """
+    return np.ascontiguousarray(keys).view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+
+def seal_match_table(
+    match_df: pd.DataFrame,
+    positions: np.ndarray,
+    partner_fingerprints: np.ndarray,
+    our_keys: np.ndarray
 ) -> pd.DataFrame:
     """
-    Extract matching records based on intersection keys
-    """
-    # Invert h_to_k_map to get k_to_h_map
-    k_to_h_map = {k: h for h, k in h_to_k_map.items()}
-    
-    # Extract matching records
-    records = []
-    # print(f"Processing {len(intersection_keys)} intersection keys")
-    # print(f"Have {len(k_to_h_map)} keys in k_to_h_map")
-    # print(f"Have {len(h_to_record_map)} keys in h_to_record_map")
-    
-    for k in intersection_keys:
-        if k in k_to_h_map:
-            h = k_to_h_map[k]
-            if h in h_to_record_map:
-                record = h_to_record_map[h]
-                # Extract only the needed columns plus the hash as identifier
-                record_data = {'hash_id': h}
-                for col in data_columns:
-                    if col in record:
-                        record_data[col] = record[col]
-                records.append(record_data)
-            else:
-                print(f"Warning: Hash {h} not found in original record map")
-        else:
-            print(f"Warning: Key {k} not found in k_to_h_map")
-    
-    # Create DataFrame
-    if records:
-        # print(f"Created DataFrame with {len(records)} records")
-        return pd.DataFrame(records)
+    Seal every row of a match table (the record of our hash position positions[i]) under each of
+    our full k values whose fingerprint equals the partner's fingerprint at that position
+    Returns a table of the positions and sealed rows
+    """
+    our_fingerprints = truncate_keys(our_keys, partner_fingerprints.dtype.itemsize)
+    order = np.argsort(our_fingerprints, kind="stable")
+    wanted = partner_fingerprints[positions]
+    starts = np.searchsorted(our_fingerprints[order], wanted, side="left")
+    ends = np.searchsorted(our_fingerprints[order], wanted, side="right")
+    key_bytes = _key_bytes(our_keys)
+
+    columns = list(match_df.columns)
+    sealed_positions, sealed_rows = [], []
+    for row, position, start, end in zip(match_df.itertuples(index=False, name=None), positions.tolist(),
+                                         starts.tolist(), ends.tolist()):
+        cells = [[col, *_encode_cell(value)] for col, value in zip(columns, row)]
+        # 同一指紋可能對應我們多個 k 值，每個都加密一份，對方只解得開真正相同的那份
+        for k_key in dict.fromkeys(key_bytes[index].tobytes() for index in order[start:end]):
+            sealed_positions.append(position)
+            sealed_rows.append(seal_cells(k_key, cells))
+    return pd.DataFrame({"position": np.array(sealed_positions, dtype=np.int64), "sealed": sealed_rows})
+
+def open_match_table(sealed_df: pd.DataFrame, our_keys: np.ndarray) -> pd.DataFrame:
+    """
+    Open the partner's sealed match table with our full k values of its records (in its hash
+    order), dropping the rows of false fingerprint matches
+    """
+    key_bytes = _key_bytes(our_keys)
+    opened = []
+    for position, sealed in zip(sealed_df["position"].astype(np.int64).tolist(), sealed_df["sealed"].astype(str)):
+        if not 0 <= position < len(key_bytes):
+            raise ValueError(f"Sealed match data refers to position {position} of {len(key_bytes)} records")
+        cells = open_sealed_cells(key_bytes[position].tobytes(), sealed)
+        if cells is not None:
+            opened.append(cells)
+    if not opened:
+        return pd.DataFrame(columns=["hash_id"])
+    columns = [col for col, _, _ in opened[0]]
+    rows = [[_CELL_DECODERS[tag](text) for _, tag, text in cells] for cells in opened]
+    return pd.DataFrame(rows, columns=columns).infer_objects()
+
+def save_match_data(
+    state: PSIStateStore,
+    match_positions: np.ndarray,
+    data_columns: List[str],
+    output_dir: str,
+    result_format: str = None,
+    incremental: bool = False,
+    partner_fingerprints: np.ndarray = None
+) -> str:
+    """
+    Write the data columns of every record of the matched positions (our hash order) as the
+    match data table, with the row_id of every record
+    The full table is kept in the state; with incremental, only the changes since the table of
+    the previous run are written: its new records, and the records it no longer holds with
+    row_removed set (rows removed from the dataset, or whose values changed)
+    With the partner's k fingerprints of our records (our hash order) the positions are only
+    candidates, and the table written is sealed (see seal_match_table)
+    """
+    h_keys = hash_keys(state.hashes())
+    previous_df = state.match_table(state.match_table_path) if incremental else None
+    if incremental and previous_df is None:
+        raise ValueError(f"No match table kept in {state.path} to extend, run a full PSI first")
+
+    # 以列索引一次取出每個匹配 h 的所有記錄（重複的 h 每列各輸出一次）
+    if len(match_positions):
+        rows, owners = state.key_rows(match_positions)
+        match_df = state.records(rows, data_columns)
+        match_df.insert(0, 'hash_id', [str(h) for h in keys_to_ints(h_keys[owners])])
+        # print(f"創建了包含 {len(match_df)} 條記錄的 DataFrame")
     else:
-        # Return empty DataFrame with correct columns
-        print("Warning: No matching records found")
-        columns = ['hash_id'] + data_columns
-        return pd.DataFrame(columns=columns)
+        print("No matching records found")
+        owners = np.empty(0, dtype=np.int64)
+        match_df = pd.DataFrame(columns=['hash_id'] + data_columns)
+    match_df.insert(1, 'row_id', match_row_ids(match_df))
+    state.save_match_table(state.match_table_path, match_df)
 
-def run_psi_step1(
-    excel_path: str,
-    id_columns: List[str],
-    private_key: int,
-    prime: int,
-    output_dir: str
-) -> Tuple[Dict[int, int], Dict[int, pd.Series], str]:
+    # 增量模式只輸出與上次執行相比新增（含既有 h 的新記錄）與移除的記錄
+    if incremental:
+        added_df = match_df[~match_df['row_id'].isin(previous_df['row_id'])]
+        removed_df = previous_df[~previous_df['row_id'].isin(match_df['row_id'])]
+        match_df = pd.concat([added_df.assign(row_removed=False), removed_df.assign(row_removed=True)],
+                             ignore_index=True)
+
+    # 對方只傳送指紋時，候選記錄加密後才交換，誤判的記錄對方解不開
+    if partner_fingerprints is not None:
+        match_df = seal_match_table(match_df.drop(columns=['row_id']), owners, partner_fingerprints,
+                                    value_keys(load_values(state.k_file_path)))
+
+    # 以交換格式保存到檔案（hash_id 以字串儲存，超過 64 位元整數範圍）
+    result_format = result_format or default_result_format()
+    match_file_path = result_file_path(output_dir, "match_data", result_format)
+    save_table(match_df, match_file_path, result_format)
+    # print(f"匹配資料已保存至 {match_file_path}")
+
+    return match_file_path
+
+def _local_k_buckets(state: PSIStateStore, partner_bucket_paths: List[str]) -> List[str]:
     """
-    Run step 1 of the PSI protocol:
-    - Load data
-    - Compute hashes and blinded values
-    - Save blinded values to file
-    - Return mappings and file path
+    Return our k values split into as many buckets as the partner sent: the buckets step 2
+    of this run wrote to the state when they match, else rebuilt from our k values
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Load data
-    df = load_excel_data(excel_path)
-    
-    # Process dataset
-    h_to_c_map, h_to_record_map = process_dataset(df, id_columns, private_key, prime)
-    
-    # Extract blinded values
-    c_values = list(h_to_c_map.values())
-    
-    # Save to file
-    c_file_path = os.path.join(output_dir, "c_values.json")
-    save_values_to_json(c_values, c_file_path)
+    # Partner buckets hold their k values of our records, with positions in our hash order
+    partner_count = sum(len(load_positioned_values(path)) for path in partner_bucket_paths)
+    if partner_count != len(state.hashes()):
+        raise ValueError(f"Partner buckets hold {partner_count} values for {len(state.hashes())} local hashes")
     
-    return h_to_c_map, h_to_record_map, c_file_path
+    our_bucket_paths = [bucket_file_path(state.bucket_path, bucket) for bucket in range(len(partner_bucket_paths))]
+    k_values = load_values(state.k_file_path)
+    if all(os.path.exists(path) for path in our_bucket_paths) and \
+            not os.path.exists(bucket_file_path(state.bucket_path, len(partner_bucket_paths))) and \
+            sum(len(load_positioned_values(path)) for path in our_bucket_paths) == len(k_values):
+        return our_bucket_paths
+    return write_k_buckets(k_values, len(partner_bucket_paths), state.bucket_path)
 
-def run_psi_step2(
-    h_to_c_map: Dict[int, int],
-    partner_c_file_path: str,
-    private_key: int,
-    prime: int,
-    output_dir: str
-) -> Tuple[Dict[int, int], str]:
+def run_psi_step3_bucketed(
+    state: PSIStateStore,
+    partner_bucket_paths: List[str],
+    data_columns: List[str],
+    output_dir: str,
+    result_format: str = None,
+    workers: int = 1
+) -> str:
     """
-    Run step 2 of the PSI protocol:
-    - Load partner's blinded values
-    - Compute second blinded values
-    - Save second blinded values to file
-    - Return mapping and file path
+    Run step 3 of the PSI protocol in partitioned mode:
+    - Split our k values into as many buckets as the partner sent
+    - Intersect every bucket pair independently
+    - Save the matching records
     """
-    # Load partner's blinded values
-    partner_c_values = load_values_from_json(partner_c_file_path)
-    # print(f"Loaded {len(partner_c_values)} partner blinded values")
-    
-    # Show a sample of partner's values for debugging
-    # if partner_c_values:
-    #     print(f"Sample of partner blinded values: {partner_c_values[:3]}")
-    
-    # Compute second blinded values k = c^private_key mod prime
-    # These are the values we'll upload to IPFS for the partner to download
-    k_values = compute_second_blinded_values(partner_c_values, private_key, prime)
-    # print(f"Computed {len(k_values)} second blinded values")
-    
-    # Show a sample of computed values for debugging
-    # if k_values:
-    #     print(f"Sample of computed double-blinded values: {k_values[:3]}")
-    
-    # Create h_to_k_map for matching in step 3
-    # This maps our original hashes to the expected matching values (h^(ab) mod p)
-    h_to_k_map = {}
-    
-    # For each of our original hashes, we need to calculate the expected double-blind value
-    # that will match with what our partner will compute
-    for h, our_c in h_to_c_map.items():
-        # Important: We don't apply our private key again to our c value!
-        # The correct value will be generated by the partner when they compute c^b
-        # We're calculating what we expect to find in the intersection in step 3
-        
-        # For correct matching in step 3, we need to set h_to_k_map[h] to what we expect
-        # the partner to compute for this hash, which is partner's c^(our_private_key) = h^(ab)
-        
-        # But we don't know which of partner's c values corresponds to this hash h
-        # So we'll have to wait until step 3 to find matches based on the k values we compute
-        # and the k values our partner computes
-        
-        # For now, set a placeholder that will be filled during intersection finding
-        h_to_k_map[h] = None  # Will be populated during intersection in step 3
-    
-    # Compute all possible double-blind values from partner's c values
-    # These are what we'll compare against in step 3
-    partner_c_to_k = {}
-    for partner_c in partner_c_values:
-        # Apply our private key to partner's c value
-        k = pow(partner_c, private_key, prime)
-        partner_c_to_k[partner_c] = k
-    
-    # Save k values to file - these are what we'll share with partner
-    k_file_path = os.path.join(output_dir, "k_values.json")
-    save_values_to_json(k_values, k_file_path)
-    
-    # Save partner_c_to_k for use in step 3
-    partner_c_to_k_file = os.path.join(output_dir, "partner_c_to_k.json")
-    # Convert keys to strings for JSON
-    partner_c_to_k_str = {str(c): k for c, k in partner_c_to_k.items()}
-    with open(partner_c_to_k_file, 'w') as f:
-        json.dump(partner_c_to_k_str, f)
-    
-    # print(f"Calculated and saved {len(partner_c_to_k)} double-blind values for step 3")
-    
-    return h_to_k_map, k_file_path
+    our_bucket_paths = _local_k_buckets(state, partner_bucket_paths)
+    match_positions = intersect_bucket_positions(our_bucket_paths, partner_bucket_paths, workers)
+
+    # 指紋桶：依位置組回對方每筆記錄的指紋，供加密候選記錄
+    partner_fingerprints = None
+    width = value_keys(load_values(state.k_file_path)).dtype.itemsize
+    for path in partner_bucket_paths:
+        bucket = load_positioned_values(path)
+        if bucket.dtype["key"].itemsize < width:
+            if partner_fingerprints is None:
+                partner_fingerprints = np.zeros(len(state.hashes()), dtype=bucket.dtype["key"])
+            partner_fingerprints[bucket["pos"]] = bucket["key"]
+    return save_match_data(state, match_positions, data_columns, output_dir, result_format,
+                           partner_fingerprints=partner_fingerprints)
 
 def run_psi_step3(
-    h_to_c_map: Dict[int, int],
-    h_to_k_map: Dict[int, int],
-    h_to_record_map: Dict[int, pd.Series],
+    state: PSIStateStore,
+    k_file_path: str,
     partner_k_file_path: str,
     data_columns: List[str],
-    output_dir: str
+    output_dir: str,
+    result_format: str = None,
+    memory_budget: int = 0,
+    incremental: bool = False
 ) -> str:
-    # 載入我們的 partner_c 到 k 的映射
-    partner_c_to_k_file = os.path.join(output_dir, "partner_c_to_k.json")
-    if os.path.exists(partner_c_to_k_file):
-        with open(partner_c_to_k_file, 'r') as f:
-            partner_c_to_k_str = json.load(f)
-            partner_c_to_k = {int(c): k for c, k in partner_c_to_k_str.items()}
-        # print(f"載入了 {len(partner_c_to_k)} 個 partner c->k 映射")
+    our_keys, partner_keys = _load_step3_keys(state, k_file_path, partner_k_file_path)
+
+    # 計算交集：以定長位元組陣列做排序合併，得到與我們列順序對齊的匹配位置
+    # （設定 memory_budget 時改用外部排序，超出預算的部分寫到暫存檔）
+    if memory_budget > 0:
+        match_positions = external_intersect_positions(our_keys, partner_keys, memory_budget, output_dir)
     else:
-        partner_c_to_k = {}
+        match_positions = intersect_positions(our_keys, partner_keys)
+    # print(f"找到了 {len(match_positions)} 個交集值")
+
+    # 對方的值比我們的 k 短時是指紋，匹配的位置只是候選
+    partner_fingerprints = None
+    if partner_keys.dtype.itemsize < value_keys(load_values(k_file_path)).dtype.itemsize:
+        partner_fingerprints = partner_keys
+    return save_match_data(state, match_positions, data_columns, output_dir, result_format, incremental,
+                           partner_fingerprints)
 
+def _load_step3_keys(
+    state: PSIStateStore,
+    k_file_path: str,
+    partner_k_file_path: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load our k values and the partner's as fixed-width keys of the same width
+    """
     # 載入對方的 k 值
-    partner_k_values = load_values_from_json(partner_k_file_path)
+    partner_k_values = load_values(partner_k_file_path)
     # print(f"載入了 {len(partner_k_values)} 個對方雙盲值")
 
-    # 我們的 k 值
-    our_k_values = list(partner_c_to_k.values())
+    # 我們在步驟 2 算出的 k 值
+    our_k_values = load_values(k_file_path)
     # print(f"我們有 {len(our_k_values)} 個雙盲值")
 
-    # 計算交集
-    intersection_keys = set(our_k_values).intersection(set(partner_k_values))
-    # print(f"找到了 {len(intersection_keys)} 個交集值")
-
-    # 獲取 h 的有序列表，假設其順序與 c_values 一致
-    h_list = list(h_to_c_map.keys())  # 按插入順序
+    # 對方若只傳送指紋（k 的尾端位元組），我們的 k 也截成相同寬度再比對
+    our_keys = value_keys(our_k_values)
+    partner_width = None if isinstance(partner_k_values, PackedValues) else our_keys.dtype.itemsize
+    partner_keys = value_keys(partner_k_values, partner_width)
+    our_keys = truncate_keys(our_keys, partner_keys.dtype.itemsize)
 
     # 檢查 partner_k_values 的長度是否與 h_list 匹配
-    if len(partner_k_values) != len(h_list):
-        raise ValueError(f"partner_k_values 長度 ({len(partner_k_values)}) 與 h_list 長度 ({len(h_list)}) 不匹配")
-
-    # 根據 partner_k_values 的順序映射回 h
-    match_records = []
-    for i, k in enumerate(partner_k_values):
-        if k in intersection_keys:
-            h = h_list[i]
-            record = h_to_record_map[h]
-            # 提取所需欄位
-            record_data = {'hash_id': h}
-            for col in data_columns:
-                if col in record:
-                    record_data[col] = record[col]
-            match_records.append(record_data)
-
-    # 創建 DataFrame
-    if match_records:
-        match_df = pd.DataFrame(match_records)
-        # print(f"創建了包含 {len(match_df)} 條記錄的 DataFrame")
-    else:
-        print("No matching records found")
-        match_df = pd.DataFrame(columns=['hash_id'] + data_columns)
-
-    # 保存到檔案
-    match_file_path = os.path.join(output_dir, "match_data.xlsx")
-    match_df.to_excel(match_file_path, index=False)
-    # print(f"匹配資料已保存至 {match_file_path}")
+    h_count = len(state.hashes())
+    if len(partner_k_values) != h_count:
+        raise ValueError(f"partner_k_values 長度 ({len(partner_k_values)}) 與 h_list 長度 ({h_count}) 不匹配")
 
-    return match_file_path
+    return our_keys, partner_keys
 
-def extract_matching_records_fixed(
-    intersection_keys: Set[int],
-    k_to_h_map: Dict[int, int],
-    h_to_record_map: Dict[int, pd.Series],
-    data_columns: List[str]
-) -> pd.DataFrame:
+def run_psi_step3_cardinality(
+    state: PSIStateStore,
+    k_file_path: str,
+    partner_k_file_path: str,
+    output_dir: str,
+    partner_bucket_paths: List[str] = None,
+    memory_budget: int = 0,
+    workers: int = 1
+) -> int:
     """
-    Extract matching records based on intersection keys using k_to_h_map
-    """
-    records = []
-    print(f"Processing {len(intersection_keys)} intersection keys")
-    print(f"Have {len(k_to_h_map)} keys in k_to_h_map")
-    print(f"Have {len(h_to_record_map)} keys in h_to_record_map")
-    
-    for k in intersection_keys:
-        if k in k_to_h_map:
-            h = k_to_h_map[k]
-            if h in h_to_record_map:
-                record = h_to_record_map[h]
-                # Extract only the needed columns plus the hash as identifier
-                record_data = {'hash_id': h}
-                for col in data_columns:
-                    if col in record:
-                        record_data[col] = record[col]
-                records.append(record_data)
-            else:
-                print(f"Warning: Hash {h} not found in original record map")
-        else:
-            print(f"Warning: Key {k} not found in k_to_h_map")
-    
-    # Create DataFrame
-    if records:
-        # print(f"Created DataFrame with {len(records)} records")
-        return pd.DataFrame(records)
+    Run step 3 of the PSI protocol in cardinality mode:
+    - Compare our k values with the partner's shuffled k values
+    - Return the number of distinct values both sides hold, without writing match data
+    """
+    # 分桶模式：逐桶計算共同值的個數再加總（相同的 k 必落在同一桶）
+    if partner_bucket_paths:
+        our_bucket_paths = _local_k_buckets(state, partner_bucket_paths)
+        return sum(_map_bucket_pairs(_count_bucket, our_bucket_paths, partner_bucket_paths, workers))
+
+    our_keys, partner_keys = _load_step3_keys(state, k_file_path, partner_k_file_path)
+    if memory_budget > 0:
+        match_positions = external_intersect_positions(our_keys, partner_keys, memory_budget, output_dir)
     else:
-        # Return empty DataFrame with correct columns
-        print("Warning: No matching records found")
-        columns = ['hash_id'] + data_columns
-        return pd.DataFrame(columns=columns)
+        match_positions = intersect_positions(our_keys, partner_keys)
+    # 串流模式下重複的記錄只計算一次
+    return len(np.unique(partner_keys[match_positions]))
+
+def apply_match_changes(match_df: pd.DataFrame, changes_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the changes of an incremental match data table to a full match table:
+    drop the records marked row_removed and add the others
+    """
+    removed = changes_df['row_removed'].fillna(False).astype(bool) if 'row_removed' in changes_df.columns \
+        else pd.Series(False, index=changes_df.index)
+    kept_df = match_df[~match_df['row_id'].isin(changes_df.loc[removed, 'row_id'])]
+    added_df = changes_df.loc[~removed].drop(columns=['row_removed'], errors='ignore')
+    return pd.concat([kept_df, added_df], ignore_index=True)
 
 def run_psi_step4(
     our_match_file_path: str,
     partner_match_file_path: str,
-    output_dir: str
-) -> str:
+    output_dir: str,
+    result_format: str = None,
+    export_xlsx: bool = False,
+    state: PSIStateStore = None,
+    incremental: bool = False
+) -> Tuple[str, str]:
     """
     Run step 4 of the PSI protocol:
-    - Load our matching records
-    - Load partner's matching records
+    - Load our matching records (our full match table, when the state is given)
+    - Load partner's matching records (any result format); in an incremental run they are the
+      changes since the previous run, applied to the partner's table kept in the state, and
+      sealed records (k fingerprints) are opened with our k values
+    - Keep the partner's full table in the state for the next incremental run
     - Merge records based on hash_id
-    - Save final result
-    - Return file path
+    - Save final result, plus an xlsx copy when export_xlsx is set
+    - Return the result file path and the xlsx export path (None without export)
     """
     # Load our matching records
-    our_match_df = pd.read_excel(our_match_file_path)
+    our_match_df = state.match_table(state.match_table_path) if state is not None else None
+    if our_match_df is None:
+        our_match_df = load_table(our_match_file_path)
     # print(f"Loaded our match data with {len(our_match_df)} records")
     
     # Load partner's matching records
-    partner_match_df = pd.read_excel(partner_match_file_path)
+    partner_match_df = load_table(partner_match_file_path)
     # print(f"Loaded partner match data with {len(partner_match_df)} records")
+    if 'sealed' in partner_match_df.columns and 'hash_id' not in partner_match_df.columns:
+        # The partner matched k fingerprints: keep the candidates our full k values open
+        if state is None:
+            raise ValueError("Sealed match data needs the PSI state with our k values to open it")
+        partner_match_df = open_match_table(partner_match_df, value_keys(load_values(state.k_file_path)))
+    if incremental:
+        previous_df = state.match_table(state.partner_match_table_path) if state is not None else None
+        if previous_df is None:
+            raise ValueError("No partner match table kept in the state to extend, run a full PSI first")
+        partner_match_df = apply_match_changes(previous_df, partner_match_df)
+    if state is not None:
+        state.save_match_table(state.partner_match_table_path, partner_match_df)
     
     # Merge records
     if 'hash_id' in our_match_df.columns and 'hash_id' in partner_match_df.columns and len(our_match_df) > 0 and len(partner_match_df) > 0:
@@ -437,8 +3099,9 @@ def run_psi_step4(
         if partner_columns:
             partner_match_df = partner_match_df.rename(columns=partner_columns)
         
-        # Perform inner join
+        # Perform inner join (row ids only identify records between runs)
         final_df = pd.merge(our_match_df, partner_match_df, on='hash_id', how='inner')
+        final_df = final_df.drop(columns=['row_id', 'partner_row_id'], errors='ignore')
         # print(f"Merged data contains {len(final_df)} records")
     else:
         # If hash_id is missing or dataframes are empty, create an empty DataFrame
@@ -446,11 +3109,21 @@ def run_psi_step4(
         final_df = pd.DataFrame()
     
     # Save final result
-    final_file_path = os.path.join(output_dir, "psi_result.xlsx")
-    final_df.to_excel(final_file_path, index=False)
+    result_format = result_format or default_result_format()
+    final_file_path = result_file_path(output_dir, "psi_result", result_format)
+    save_table(final_df, final_file_path, result_format)
     print(f"Saved final result to {final_file_path}")
     
-    return final_file_path
+    export_file_path = None
+    if export_xlsx and result_format != "xlsx":
+        if len(final_df) > XLSX_MAX_ROWS:
+            print(f"Warning: Skipped the xlsx export, {len(final_df)} rows do not fit in a sheet")
+        else:
+            export_file_path = result_file_path(output_dir, "psi_result", "xlsx")
+            save_table(final_df, export_file_path, "xlsx")
+            print(f"Exported final result to {export_file_path}")
+    
+    return final_file_path, export_file_path
 
 def upload_to_ipfs(file_path: str) -> str:
     """
@@ -519,54 +3192,130 @@ def run_psi_protocol(
     partner_cid_c: str = None,
     partner_cid_k: str = None,
     partner_cid_match: str = None,
-    step: int = 1
+    step: int = 1,
+    workers: int = 1,
+    chunk_size: int = MODEXP_CHUNK_SIZE,
+    psi_mode: str = PSI_MODE_MODP,
+    stream_chunk_rows: int = 0,
+    result_format: str = None,
+    export_xlsx: bool = False,
+    intersection_memory: int = 0,
+    buckets: int = 0,
+    k_fp_rate: float = 0,
+    psi_output: str = PSI_OUTPUT_RECORDS,
+    incremental: bool = False,
+    dataset_registry: str = None,
+    dataset_registry_max_bytes: int = DATASET_REGISTRY_MAX_BYTES,
+    dataset_registry_max_age: float = DATASET_REGISTRY_MAX_AGE
 ) -> Dict[str, Any]:
     """
     Run the PSI protocol for a specific step
     
     Args:
-        excel_path: Path to the Excel file containing the data
+        excel_path: Path to the dataset: Excel, CSV, Parquet, Arrow IPC, or an SQLite
+                    table given as file.db#table
         id_columns: List of column names that form the identifier
         data_columns: List of column names to include in the final result
         private_key: Private key for the Diffie-Hellman PSI protocol
-        prime: Shared prime number for the protocol
+        prime: Shared prime number for the protocol (unused in ec mode)
         output_dir: Directory to store output files
         request_id: The unique identifier for the merge request
         partner_cid_c: Partner's CID for c values (for step 2)
         partner_cid_k: Partner's CID for k values (for step 3)
         partner_cid_match: Partner's CID for match data (for step 4)
         step: Which step of the protocol to run (1-4)
+        workers: Number of processes for the modular exponentiation in steps 1 and 2
+                 (1 = run in this process, 0 = one per CPU core)
+        chunk_size: Number of values handed to a worker process at a time
+        psi_mode: Group used for blinding, "modp" (exponentiation modulo prime) or
+                  "ec" (scalar multiplication on edwards25519)
+        stream_chunk_rows: Rows read per chunk when streaming the Excel file in step 1
+                           (0 = load the whole file at once)
+        result_format: Format of the match data and final result, "parquet", "arrow",
+                       "csv" or "xlsx" (None = parquet when pyarrow is installed, else csv)
+        export_xlsx: Also write the final result as psi_result.xlsx
+        intersection_memory: Memory budget in bytes of the step 3 intersection; above it the
+                             k values are sorted externally through temp files in output_dir
+                             (0 = intersect in memory)
+        buckets: Split the step 2 k values into this many buckets, shared through a manifest
+                 CID, so step 3 can intersect them independently (0 = one k file)
+        k_fp_rate: Share only fingerprints of the step 2 k values, sized so a non-matching partner
+                   row matches with at most this probability (0 = full k values). The cardinality
+                   output may count these false matches; the records output seals the candidate
+                   records so only true matches reach the partner
+        psi_output: "records" to exchange the matching records in steps 3 and 4,
+                    "cardinality" to share shuffled k values and stop at step 3 with the
+                    intersection size, or "estimate" to share a HyperLogLog sketch of the
+                    k values and stop at step 3 with an estimate of that size
+        incremental: Extend the previous run of request_id: step 1 blinds only records whose
+                     hash is new, with the stored key, steps 2 and 3 exchange only the c and k
+                     values of those records and the match records added and removed since,
+                     and step 4 merges the full match tables kept in the state, as a full run would.
+                     Needs a previous records run without buckets or fingerprints
+        dataset_registry: Directory of a DatasetRegistry; step 1 then reads the record hashes
+                          and data columns cached for the dataset instead of parsing it, and
+                          registers the dataset on the first run (None = always parse).
+                          excel_path may also be dataset:<fingerprint> of a registered dataset
+        dataset_registry_max_bytes: Size the registry is trimmed to, least recently used entries first
+        dataset_registry_max_age: Seconds after which an unused registry entry is dropped
         
     Returns:
         Dictionary with results from the executed step
     """
+    if psi_mode not in PSI_MODES:
+        raise ValueError(f"Unknown PSI mode '{psi_mode}'. Supported modes: {list(PSI_MODES)}")
+    
+    result_format = result_format or default_result_format()
+    if result_format not in RESULT_FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown result format '{result_format}'. Supported formats: {list(RESULT_FORMAT_EXTENSIONS)}")
+    
+    if psi_output not in PSI_OUTPUTS:
+        raise ValueError(f"Unknown PSI output '{psi_output}'. Supported outputs: {list(PSI_OUTPUTS)}")
+    
+    if incremental and (psi_output != PSI_OUTPUT_RECORDS or buckets > 0 or k_fp_rate > 0):
+        raise ValueError("Incremental runs exchange full k values of the records output, without buckets or fingerprints")
+    
+    reserved_columns = [col for col in data_columns or [] if col in MATCH_TABLE_COLUMNS]
+    if reserved_columns:
+        raise ValueError(f"Data columns cannot be named {reserved_columns}, the match tables use these names")
+    
     result = {"request_id": request_id}
     
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    # Declare h_to_c_map at the function level so it's available across steps
-    h_to_c_map = {}
-    h_to_record_map = {}
-    
     if step <= 1:
         # Step 1: Compute and share blinded hashes
         print("Running PSI Step 1: Computing blinded hashes...")
-        h_to_c_map, h_to_record_map, c_file_path = run_psi_step1(
-            excel_path, id_columns, private_key, prime, output_dir
-        )
+        state = PSIStateStore(output_dir, request_id)
+        registry = None
+        if dataset_registry:
+            registry = DatasetRegistry(dataset_registry, dataset_registry_max_bytes, dataset_registry_max_age)
+        if incremental:
+            if not state.exists():
+                raise ValueError(f"No previous PSI state in {state.path} to extend, run a full PSI first")
+            # The partner already holds our values blinded with the previous key
+            private_key = state.load_meta().get("private_key", private_key)
+            c_file_path, record_count = run_psi_step1_incremental(
+                excel_path, id_columns, data_columns, state, stream_chunk_rows, workers, chunk_size, registry
+            )
+            print(f"Blinded {record_count} new records")
+        elif stream_chunk_rows > 0:
+            c_file_path, record_count = run_psi_step1_streaming(
+                excel_path, id_columns, data_columns, private_key, prime, state,
+                stream_chunk_rows, workers, chunk_size, psi_mode, registry
+            )
+            print(f"Streamed {record_count} records")
+        else:
+            c_file_path = run_psi_step1(
+                excel_path, id_columns, data_columns, private_key, prime, state, workers, chunk_size, psi_mode,
+                registry
+            )
         
         # Upload to IPFS
         cid_c = upload_to_ipfs(c_file_path)
         
-        # Save h_to_c_map for later steps
-        h_to_c_map_file = os.path.join(output_dir, "h_to_c_map.json")
-        with open(h_to_c_map_file, 'w') as f:
-            # Convert int keys to strings for JSON
-            h_to_c_map_str = {str(k): v for k, v in h_to_c_map.items()}
-            json.dump(h_to_c_map_str, f)
-        
-        # We can't easily serialize record_map directly, but we'll save the info needed to recreate it
+        # Records live in the state store, the config keeps the parameters of the run
         psi_config_file = os.path.join(output_dir, "psi_config.json")
         with open(psi_config_file, 'w') as f:
             config = {
@@ -575,13 +3324,15 @@ def run_psi_protocol(
                 "data_columns": data_columns,
                 "private_key": private_key,
                 "prime": prime,
+                "psi_mode": psi_mode,
+                "psi_output": psi_output,
+                "incremental": incremental,
                 "request_id": result.get("request_id", "")
             }
             json.dump(config, f)
         
         result["step1"] = {
-            "h_to_c_map": h_to_c_map,
-            "h_to_record_map": h_to_record_map,
+            "state_dir": state.path,
             "c_file_path": c_file_path,
             "cid_c": cid_c
         }
@@ -593,17 +3344,8 @@ def run_psi_protocol(
     else:
         # Load data from previous steps
         try:
-            h_to_c_map_file = os.path.join(output_dir, "h_to_c_map.json")
             psi_config_file = os.path.join(output_dir, "psi_config.json")
             
-            # Load h_to_c_map
-            with open(h_to_c_map_file, 'r') as f:
-                h_to_c_map_data = json.load(f)
-                # Convert string keys back to integers
-                h_to_c_map = {int(k): v for k, v in h_to_c_map_data.items()}
-            
-            # print(f"Loaded h_to_c_map with {len(h_to_c_map)} entries")
-            
             # Load configuration if excel_path is not provided
             if not excel_path and os.path.exists(psi_config_file):
                 with open(psi_config_file, 'r') as f:
@@ -613,45 +3355,82 @@ def run_psi_protocol(
                     data_columns = config.get("data_columns", data_columns)
                     private_key = config.get("private_key", private_key)
                     prime = config.get("prime", prime)
-            
-            # Load record map (regenerate from the original Excel file)
-            print(f"Loading original data from Excel file: {excel_path}")
-            df = load_excel_data(excel_path)
-            h_to_record_map = {}
-            for idx, record in df.iterrows():
-                h = compute_record_hash(record, id_columns)
-                h_to_record_map[h] = record
-            
-            print(f"Loaded {len(h_to_record_map)} records from Excel file")
-                
+                    psi_mode = config.get("psi_mode", psi_mode)
+                    psi_output = config.get("psi_output", psi_output)
+                    incremental = config.get("incremental", incremental)
+                    request_id = request_id or config.get("request_id", "")
         except Exception as e:
             raise ValueError(f"Failed to load data from previous steps: {str(e)}")
+        
+        # Steps 2-4 never reopen the spreadsheet, step 3 reads the state store of step 1
+        state = PSIStateStore(output_dir, request_id)
+        if incremental and state.exists():
+            private_key = state.load_meta().get("private_key", private_key)
     
     if step <= 2 and partner_cid_c:
         # Step 2: Download partner's blinded hashes and compute double-blinded values
         print("Running PSI Step 2: Computing double-blinded values...")
         
         # Download partner's c values
-        partner_c_file_path = os.path.join(output_dir, "partner_c_values.json")
+        partner_c_file_path = os.path.join(output_dir, "partner_c_values.bin")
         download_from_ipfs(partner_cid_c, partner_c_file_path)
         
-        # Compute second blinded values
-        h_to_k_map, k_file_path = run_psi_step2(
-            h_to_c_map, partner_c_file_path, private_key, prime, output_dir
-        )
+        # Compute second blinded values (only of the partner's new records in an incremental run)
+        if incremental:
+            os.makedirs(state.delta_path, exist_ok=True)
+            shared_k_file_path = run_psi_step2(
+                partner_c_file_path, private_key, prime, state.delta_path, workers, chunk_size, psi_mode
+            )
+            append_values(shared_k_file_path, state.k_file_path)
+            k_file_path = state.k_file_path
+        else:
+            k_file_path = run_psi_step2(
+                partner_c_file_path, private_key, prime, state.path, workers, chunk_size, psi_mode
+            )
+            shared_k_file_path = k_file_path
         
-        # Save h_to_k_map for later use
-        h_to_k_map_file = os.path.join(output_dir, "h_to_k_map.json")
-        with open(h_to_k_map_file, 'w') as f:
-            # Convert int keys to strings for JSON
-            h_to_k_map_str = {str(k): v for k, v in h_to_k_map.items()}
-            json.dump(h_to_k_map_str, f)
+        # The shared k values, or their fingerprints; the full k_values.bin stays local for step 3
+        shared_k_values = load_values(shared_k_file_path)
+        # A sketch kept in the state was written by this step of the current run
+        if os.path.exists(state.sketch_file_path):
+            os.remove(state.sketch_file_path)
+        if psi_output == PSI_OUTPUT_ESTIMATE:
+            # Sketch mode shares only the HyperLogLog sketch of the k values
+            buckets = k_fp_rate = 0
+            shared_k_file_path = save_k_sketch(shared_k_values, state.sketch_file_path)
+        elif psi_output == PSI_OUTPUT_CARDINALITY:
+            # Shuffled k values no longer line up with the partner's rows, so only the count is learned
+            if k_fp_rate > 0:
+                print(f"Warning: Sharing k fingerprints, the intersection size may count about "
+                      f"{k_fp_rate:g} false matches per record of the partner")
+            shared_k_values = value_keys(shared_k_values)
+            shared_k_values = shared_k_values[np.random.default_rng().permutation(len(shared_k_values))]
+            shared_k_file_path = save_keys(shared_k_values, os.path.join(output_dir, "k_shuffled.bin"))
+        if k_fp_rate > 0:
+            shared_k_values = value_keys(shared_k_values)
+            # The partner tests the fingerprints against the k values of our records
+            width = fingerprint_width(len(state.hashes()), k_fp_rate, shared_k_values.dtype.itemsize)
+            shared_k_values = truncate_keys(shared_k_values, width)
+            shared_k_file_path = save_keys(shared_k_values, os.path.join(output_dir, "k_fingerprints.bin"))
         
-        # Upload to IPFS
-        cid_k = upload_to_ipfs(k_file_path)
+        # Buckets kept in the state were written by this step of the current run
+        if os.path.exists(state.bucket_path):
+            shutil.rmtree(state.bucket_path)
+        if buckets > 0:
+            # Partitioned mode: upload the bucket files together, then a manifest listing them
+            # Buckets of our full k values in partner order are also our side of a bucketed step 3,
+            # shuffled values and fingerprints get their own directory
+            shares_full_k = psi_output == PSI_OUTPUT_RECORDS and k_fp_rate == 0
+            bucket_dir = state.bucket_path if shares_full_k else os.path.join(output_dir, "k_shared_buckets")
+            bucket_paths = write_k_buckets(shared_k_values, buckets, bucket_dir)
+            manifest_file_path = os.path.join(output_dir, "k_buckets.json")
+            save_bucket_manifest(upload_files_to_ipfs(bucket_paths), manifest_file_path)
+            cid_k = upload_to_ipfs(manifest_file_path)
+        else:
+            # Upload to IPFS
+            cid_k = upload_to_ipfs(shared_k_file_path)
         
         result["step2"] = {
-            "h_to_k_map": h_to_k_map,
             "k_file_path": k_file_path,
             "cid_k": cid_k
         }
@@ -660,45 +3439,91 @@ def run_psi_protocol(
         
         if step == 2:
             return result
-    else:
-        # Load data from previous steps if continuing
-        if step > 2:
-            try:
-                h_to_k_map_file = os.path.join(output_dir, "h_to_k_map.json")
-                with open(h_to_k_map_file, 'r') as f:
-                    h_to_k_map_data = json.load(f)
-                    # Convert string keys back to integers
-                    h_to_k_map = {int(k): v for k, v in h_to_k_map_data.items()}
-                # print(f"Loaded h_to_k_map with {len(h_to_k_map)} entries")
-            except Exception as e:
-                raise ValueError(f"Failed to load k map from previous steps: {str(e)}")
     
     if step <= 3 and partner_cid_k:
         # Step 3: Find intersection and prepare matching data
         print("Running PSI Step 3: Finding intersection and preparing matching data...")
         
-        # Make sure h_to_c_map is loaded
-        if not h_to_c_map:
-            h_to_c_map_file = os.path.join(output_dir, "h_to_c_map.json")
-            if os.path.exists(h_to_c_map_file):
-                with open(h_to_c_map_file, 'r') as f:
-                    h_to_c_map_data = json.load(f)
-                    # Convert string keys back to integers
-                    h_to_c_map = {int(k): v for k, v in h_to_c_map_data.items()}
-                # print(f"Loaded h_to_c_map with {len(h_to_c_map)} entries for step 3")
-            else:
-                print("ERROR: h_to_c_map file not found. Cannot proceed with step 3.")
-                return result
-        
-        # Download partner's k values
-        partner_k_file_path = os.path.join(output_dir, "partner_k_values.json")
-        download_from_ipfs(partner_cid_k, partner_k_file_path)
+        # Make sure the step 1 state is available
+        if not state.exists():
+            print(f"ERROR: PSI state not found in {state.path}. Cannot proceed with step 3.")
+            return result
         
-        # Find intersection and extract matching records
-        match_file_path = run_psi_step3(
-            h_to_c_map, h_to_k_map, h_to_record_map, partner_k_file_path, data_columns, output_dir
-        )
+        # Our k values from step 2
+        k_file_path = state.k_file_path
+        if not os.path.exists(k_file_path):
+            print("ERROR: k_values file not found. Cannot proceed with step 3.")
+            return result
         
+        if incremental:
+            # Add the partner's k values of our new records to those of the previous runs
+            if not os.path.exists(state.partner_k_file_path):
+                raise ValueError(f"No full k exchange kept in {state.path} to extend, run a full PSI first")
+            partner_delta_file_path = os.path.join(state.delta_path, "partner_k_values.bin")
+            download_from_ipfs(partner_cid_k, partner_delta_file_path)
+            append_values(partner_delta_file_path, state.partner_k_file_path)
+            match_file_path = run_psi_step3(
+                state, k_file_path, state.partner_k_file_path, data_columns, output_dir, result_format,
+                intersection_memory, incremental=True
+            )
+        else:
+            if psi_output == PSI_OUTPUT_ESTIMATE:
+                # Sketch mode ends here: merge the two sketches and estimate the overlap
+                partner_sketch_file_path = os.path.join(output_dir, "partner_k_sketch.json")
+                download_from_ipfs(partner_cid_k, partner_sketch_file_path)
+                if not os.path.exists(state.sketch_file_path):
+                    save_k_sketch(load_values(k_file_path), state.sketch_file_path)
+                estimate = estimate_intersection(
+                    load_k_sketch(state.sketch_file_path), load_k_sketch(partner_sketch_file_path)
+                )
+                result["step3"] = estimate
+                print(f"Step 3 completed. Estimated intersection size: {estimate['estimate']} "
+                      f"(95% interval {estimate['lower']}-{estimate['upper']})")
+                return result
+            
+            # Download partner's k values
+            partner_k_file_path = os.path.join(output_dir, "partner_k_values.bin")
+            download_from_ipfs(partner_cid_k, partner_k_file_path)
+            
+            # Find intersection and extract matching records
+            manifest = load_bucket_manifest(partner_k_file_path)
+            if manifest is not None:
+                # The partner sent its k values in buckets, fetch them all at once
+                partner_bucket_dir = os.path.join(output_dir, "partner_k_buckets")
+                partner_bucket_paths = [bucket_file_path(partner_bucket_dir, bucket) for bucket in range(len(manifest["cids"]))]
+                download_files_from_ipfs(manifest["cids"], partner_bucket_paths)
+            else:
+                partner_bucket_paths = None
+            
+            if psi_output == PSI_OUTPUT_CARDINALITY:
+                # Cardinality mode ends here: no match data is written or shared
+                cardinality = run_psi_step3_cardinality(
+                    state, k_file_path, partner_k_file_path, output_dir, partner_bucket_paths,
+                    intersection_memory, workers
+                )
+                result["step3"] = {
+                    "cardinality": cardinality
+                }
+                print(f"Step 3 completed. Intersection size: {cardinality}")
+                return result
+            
+            if partner_bucket_paths is not None:
+                match_file_path = run_psi_step3_bucketed(
+                    state, partner_bucket_paths, data_columns, output_dir, result_format, workers
+                )
+            else:
+                match_file_path = run_psi_step3(
+                    state, k_file_path, partner_k_file_path, data_columns, output_dir, result_format,
+                    intersection_memory
+                )
+            
+            # Keep the partner's full k values in the state, an incremental run extends them
+            if partner_bucket_paths is None and \
+                    value_keys(load_values(partner_k_file_path)).dtype.itemsize == value_keys(load_values(k_file_path)).dtype.itemsize:
+                shutil.copyfile(partner_k_file_path, state.partner_k_file_path)
+            elif os.path.exists(state.partner_k_file_path):
+                os.remove(state.partner_k_file_path)
+            
         # Upload to IPFS
         cid_match = upload_to_ipfs(match_file_path)
         
@@ -713,21 +3538,26 @@ def run_psi_protocol(
             return result
     
     if step <= 4 and partner_cid_match:
+        if psi_output != PSI_OUTPUT_RECORDS:
+            raise ValueError(f"Step 4 is not part of the protocol in {psi_output} mode")
+        
         # Step 4: Final data merge
         print("Running PSI Step 4: Merging matching data...")
         
-        # Download partner's match data
-        our_match_file_path = os.path.join(output_dir, "match_data.xlsx")
-        partner_match_file_path = os.path.join(output_dir, "partner_match_data.xlsx")
+        # Download partner's match data (its format is detected when loading)
+        our_match_file_path = _find_result_file(output_dir, "match_data", result_format)
+        partner_match_file_path = os.path.join(output_dir, "partner_match_data")
         download_from_ipfs(partner_cid_match, partner_match_file_path)
         
-        # Merge data
-        final_file_path = run_psi_step4(
-            our_match_file_path, partner_match_file_path, output_dir
+        # Merge data (full match tables of both sides, an incremental run updates them)
+        final_file_path, export_file_path = run_psi_step4(
+            our_match_file_path, partner_match_file_path, output_dir, result_format, export_xlsx,
+            state if state.exists() else None, incremental
         )
         
         result["step4"] = {
-            "final_file_path": final_file_path
+            "final_file_path": final_file_path,
+            "export_file_path": export_file_path
         }
         
         print(f"Step 4 completed. Final result saved to: {final_file_path}")
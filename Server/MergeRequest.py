@@ -1,9 +1,100 @@
 import sqlite3
+import os
+import importlib.util
 import threading
+import hashlib
+import json
+import random
+import sympy
 from DataBase import DataBase
 
+# Groups the PSI protocol can blind in: modulo a prime, or on the edwards25519 curve
+PSI_MODES = ("modp", "ec")
+# What the PSI protocol reveals: the matching records, only the intersection size,
+# or an estimate of that size from sketches of the blinded values
+PSI_OUTPUTS = ("records", "cardinality", "estimate")
+# Order of the prime-order subgroup of edwards25519, used for private keys in ec mode
+EC_GROUP_ORDER = 2**252 + 27742317777372353535851937790883648493
+# Group profiles of merge requests, shared with the clients: a prime derived from the request ID
+# with full-width private keys, an RFC 3526 group used in its prime-order subgroup with short
+# private keys, or the edwards25519 curve
+_group_profiles_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Shared", "group_profiles.py")
+_spec = importlib.util.spec_from_file_location("group_profiles", _group_profiles_path)
+group_profiles = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(group_profiles)
+GROUP_PROFILES = group_profiles.GROUP_PROFILES
+DEFAULT_GROUP_PROFILE = group_profiles.DEFAULT_GROUP_PROFILE
+# Shortest private key of a subgroup profile
+MIN_EXPONENT_BITS = 160
+
+def generate_deterministic_prime(request_id):
+    """
+    Generate a deterministic prime number from a request ID.
+    
+    Args:
+        request_id (str): The request ID to use as a seed
+    
+    Returns:
+        int: A large prime number derived from the request ID
+    """
+    # Use the request_id as a seed for the random generator
+    # This ensures that the same request_id always produces the same prime
+    seed = int(hashlib.sha256(request_id.encode()).hexdigest(), 16)
+    random.seed(seed)
+    
+    # Generate a random number in the range 2^511 to 2^512 - 1
+    lower_bound = 2**511
+    upper_bound = 2**512 - 1
+    candidate = random.randint(lower_bound, upper_bound)
+    
+    # Find the next prime after the candidate
+    prime = sympy.nextprime(candidate)
+    
+    # Reset the random seed to ensure it doesn't affect other operations
+    random.seed()
+    
+    return prime
+
+def generate_group_params(request_id, psi_mode, group_profile=DEFAULT_GROUP_PROFILE, exponent_bits=0):
+    """
+    Compute the group parameters of a merge request once, when it is created:
+    - ec mode: the ec25519 profile, with the curve group order
+    - legacy-512: a prime derived from the request ID, with full-width private keys
+    - RFC 3526 profiles: the safe prime, blinding in its prime-order subgroup ("modp-qr")
+      with private keys of exponent_bits bits (the profile default when 0)
+    """
+    if psi_mode == group_profiles.PSI_MODE_EC:
+        group_profile = "ec25519"
+    # The profiles of the mode: the curve in ec mode, the prime groups otherwise
+    profiles = [name for name, profile in GROUP_PROFILES.items()
+                if (profile["psi_mode"] == group_profiles.PSI_MODE_EC) == (psi_mode == group_profiles.PSI_MODE_EC)]
+    if group_profile not in profiles:
+        raise ValueError(f"Group profile must be one of {', '.join(profiles)}")
+    profile = GROUP_PROFILES[group_profile]
+    if exponent_bits and not profile["exponent_bits"]:
+        raise ValueError(f"The {group_profile} profile uses full-width private keys, their size cannot be set")
+    if psi_mode == group_profiles.PSI_MODE_EC:
+        # Curve points need no shared prime, the key is a scalar modulo the group order
+        return {"psi_mode": psi_mode, "profile": group_profile, "prime": EC_GROUP_ORDER}
+    prime = profile["prime"]
+    if prime is None:
+        return {"psi_mode": psi_mode, "profile": group_profile, "prime": generate_deterministic_prime(request_id)}
+    exponent_bits = exponent_bits or profile["exponent_bits"]
+    if not MIN_EXPONENT_BITS <= exponent_bits <= prime.bit_length() - 2:
+        raise ValueError(f"Private key size must be between {MIN_EXPONENT_BITS} and {prime.bit_length() - 2} bits")
+    return {"psi_mode": profile["psi_mode"], "profile": group_profile, "prime": prime, "exponent_bits": exponent_bits}
+
 class MergeRequest:
     _lock = threading.Lock()
+    # Columns added after the first release, created on databases that predate them
+    _added_columns = [
+        ("PSI_MODE", 'TEXT DEFAULT "modp"'),
+        ("PSI_OUTPUT", 'TEXT DEFAULT "records"'),
+        ("GROUP_PARAMS", 'TEXT DEFAULT ""'),
+        ("RUN_STARTER", 'TEXT DEFAULT ""'),
+        ("RUN_JOINED", 'BOOLEAN DEFAULT FALSE'),
+        ("RUN_INCREMENTAL", 'BOOLEAN DEFAULT FALSE')
+    ]
     
     def __init__(self):
         self.conn = None
@@ -29,24 +120,38 @@ class MergeRequest:
                     USER1_CID_STEP2 TEXT DEFAULT "",
                     USER2_CID_STEP2 TEXT DEFAULT "",
                     USER1_CID_STEP3 TEXT DEFAULT "",
-                    USER2_CID_STEP3 TEXT DEFAULT ""
+                    USER2_CID_STEP3 TEXT DEFAULT "",
+                    PSI_MODE TEXT DEFAULT "modp",
+                    PSI_OUTPUT TEXT DEFAULT "records",
+                    GROUP_PARAMS TEXT DEFAULT "",
+                    RUN_STARTER TEXT DEFAULT "",
+                    RUN_JOINED BOOLEAN DEFAULT FALSE,
+                    RUN_INCREMENTAL BOOLEAN DEFAULT FALSE
                 )
                 """
             )
+            self.cursor.execute("PRAGMA table_info(MERGE_REQUESTS)")
+            existing_columns = {row[1] for row in self.cursor.fetchall()}
+            for column_name, column_definition in MergeRequest._added_columns:
+                if column_name not in existing_columns:
+                    self.cursor.execute(f"ALTER TABLE MERGE_REQUESTS ADD COLUMN {column_name} {column_definition}")
             self.conn.commit()
     
-    def createMergeRequest(self, username1, username2, RequestID):
+    def createMergeRequest(self, username1, username2, RequestID, psiMode="modp", groupProfile=DEFAULT_GROUP_PROFILE, exponentBits=0):
         if not (self.database.searchUser(username1) and self.database.searchUser(username2)):
             raise ValueError("user does not exists")
         if username1 == username2:
             raise ValueError("username cant be the same")
+        if psiMode not in PSI_MODES:
+            raise ValueError(f"PSI mode must be one of {', '.join(PSI_MODES)}")
+        groupParams = json.dumps(generate_group_params(RequestID, psiMode, groupProfile, exponentBits))
         with MergeRequest._lock:
             try:
                 self.cursor.execute(
                     """
-                        INSERT INTO MERGE_REQUESTS (REQUESTS_ID, USER1_ID, USER2_ID)
-                        VALUES(?,?,?)
-                    """,(RequestID, username1, username2)
+                        INSERT INTO MERGE_REQUESTS (REQUESTS_ID, USER1_ID, USER2_ID, PSI_MODE, GROUP_PARAMS)
+                        VALUES(?,?,?,?,?)
+                    """,(RequestID, username1, username2, psiMode, groupParams)
                 ) 
                 self.conn.commit()
             except sqlite3.IntegrityError:
@@ -143,6 +248,114 @@ class MergeRequest:
             raise ValueError(f"RequestID {requestID} Not Found")
         return data
     
+    def getPsiMode(self, requestID):
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                SELECT PSI_MODE FROM MERGE_REQUESTS
+                WHERE REQUESTS_ID = ?
+                """,(requestID,)
+            )
+            data = self.cursor.fetchone()
+        if not data:
+            raise ValueError(f"RequestID {requestID} Not Found")
+        return data[0] or "modp"
+    
+    def getGroupParams(self, requestID):
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                SELECT GROUP_PARAMS, PSI_MODE FROM MERGE_REQUESTS
+                WHERE REQUESTS_ID = ?
+                """,(requestID,)
+            )
+            data = self.cursor.fetchone()
+        if not data:
+            raise ValueError(f"RequestID {requestID} Not Found")
+        groupParams, psiMode = data
+        if groupParams:
+            return json.loads(groupParams)
+        
+        # Requests created before the parameters were stored get them computed once here
+        params = generate_group_params(requestID, psiMode or "modp")
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                UPDATE MERGE_REQUESTS
+                SET GROUP_PARAMS = ?
+                WHERE REQUESTS_ID = ?
+                """,(json.dumps(params), requestID)
+            )
+            self.conn.commit()
+        return params
+    
+    def getPsiOutput(self, requestID):
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                SELECT PSI_OUTPUT FROM MERGE_REQUESTS
+                WHERE REQUESTS_ID = ?
+                """,(requestID,)
+            )
+            data = self.cursor.fetchone()
+        if not data:
+            raise ValueError(f"RequestID {requestID} Not Found")
+        return data[0] or "records"
+    
+    def getPsiRun(self, requestID):
+        """
+        Return the current PSI run of a request: its output mode, whether it is incremental,
+        the party that started it (who picked the options, "" before the first run) and whether
+        the partner has joined it
+        """
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                SELECT PSI_OUTPUT, RUN_INCREMENTAL, RUN_STARTER, RUN_JOINED FROM MERGE_REQUESTS
+                WHERE REQUESTS_ID = ?
+                """,(requestID,)
+            )
+            data = self.cursor.fetchone()
+        if not data:
+            raise ValueError(f"RequestID {requestID} Not Found")
+        return {"psi_output": data[0] or "records", "incremental": bool(data[1]), "starter": data[2] or "",
+                "joined": bool(data[3])}
+    
+    def startPsiRun(self, requestID, username, psiOutput, incremental=False):
+        """
+        Start a new PSI run of a request with the options its starter picked
+        A run the partner started and this party has not joined yet cannot be replaced
+        """
+        if psiOutput not in PSI_OUTPUTS:
+            raise ValueError(f"PSI output must be one of {', '.join(PSI_OUTPUTS)}")
+        if incremental and psiOutput != "records":
+            raise ValueError("Only records runs can be incremental")
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                UPDATE MERGE_REQUESTS
+                SET PSI_OUTPUT = ?, RUN_INCREMENTAL = ?, RUN_STARTER = ?, RUN_JOINED = FALSE
+                WHERE REQUESTS_ID = ? AND (RUN_STARTER IN ('', ?) OR RUN_JOINED)
+                """,(psiOutput, bool(incremental), username, requestID, username)
+            )
+            self.conn.commit()
+            if self.cursor.rowcount == 0:
+                raise ValueError("Your partner started a PSI run of this request meanwhile, run Step 1 again to join it")
+    
+    def joinPsiRun(self, requestID, username):
+        """
+        Record that the partner of the starter ran Step 1 of the current run
+        """
+        with MergeRequest._lock:
+            self.cursor.execute(
+                """
+                UPDATE MERGE_REQUESTS
+                SET RUN_JOINED = TRUE
+                WHERE REQUESTS_ID = ? AND RUN_STARTER NOT IN ('', ?)
+                """,(requestID, username)
+            )
+            self.conn.commit()
+    
     def insertCID(self, username, requestID, CID, step):
         with MergeRequest._lock:
             try:
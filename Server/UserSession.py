@@ -1,6 +1,6 @@
 from UserInterFace import LoginUsers
 from Message import decodeMessage, createMessage
-from MergeRequest import MergeRequest
+from MergeRequest import MergeRequest, PSI_MODES, PSI_OUTPUTS, EC_GROUP_ORDER, GROUP_PROFILES, DEFAULT_GROUP_PROFILE
 import sqlite3
 import hashlib
 import subprocess
@@ -9,35 +9,6 @@ import json
 import sys
 import importlib.util
 import random
-import sympy
-
-def generate_deterministic_prime(request_id):
-    """
-    Generate a deterministic prime number from a request ID.
-    
-    Args:
-        request_id (str): The request ID to use as a seed
-    
-    Returns:
-        int: A large prime number derived from the request ID
-    """
-    # Use the request_id as a seed for the random generator
-    # This ensures that the same request_id always produces the same prime
-    seed = int(hashlib.sha256(request_id.encode()).hexdigest(), 16)
-    random.seed(seed)
-    
-    # Generate a random number in the range 2^511 to 2^512 - 1
-    lower_bound = 2**511
-    upper_bound = 2**512 - 1
-    candidate = random.randint(lower_bound, upper_bound)
-    
-    # Find the next prime after the candidate
-    prime = sympy.nextprime(candidate)
-    
-    # Reset the random seed to ensure it doesn't affect other operations
-    random.seed()
-    
-    return prime
 
 class UserSession:
     def __init__(self, client, username):
@@ -82,8 +53,23 @@ class UserSession:
         requestID = hashlib.sha256()
         requestID.update(combined)
 
+        self.client.sendall(createMessage("info", f"PSI mode ({'/'.join(PSI_MODES)}, press Enter for modp):", True))
+        psi_mode = decodeMessage(self.client.recv(1024))["data"].strip().lower() or "modp"
+
+        # modp requests blind in a group profile, optionally with a custom private key size
+        group_profile = DEFAULT_GROUP_PROFILE
+        exponent_bits = ""
+        if psi_mode == "modp":
+            modp_profiles = [name for name, profile in GROUP_PROFILES.items() if profile["psi_mode"] != "ec"]
+            self.client.sendall(createMessage("info", f"Group profile ({'/'.join(modp_profiles)}, optionally followed by ':<private key bits>', press Enter for {DEFAULT_GROUP_PROFILE}):", True))
+            profile_input = decodeMessage(self.client.recv(1024))["data"].strip().lower()
+            group_profile, _, exponent_bits = profile_input.partition(":")
+            group_profile = group_profile or DEFAULT_GROUP_PROFILE
+
         try:
-            self.mergeDB.createMergeRequest(RequestID=requestID.hexdigest(), username1=usernames[0], username2=usernames[1])
+            exponent_bits = int(exponent_bits or 0)
+            self.mergeDB.createMergeRequest(RequestID=requestID.hexdigest(), username1=usernames[0], username2=usernames[1], psiMode=psi_mode,
+                                            groupProfile=group_profile, exponentBits=exponent_bits)
         except ValueError as e:
             self.client.sendall(createMessage("info", f"{e}", False))
         except sqlite3.IntegrityError as ie:
@@ -327,8 +313,8 @@ class UserSession:
             self.client.sendall(createMessage("info", f"Error: {e}", False))
             return
         
-        # Ask for Excel file path
-        self.client.sendall(createMessage("info", "Enter Excel file path:", True))
+        # Ask for the dataset path (any format the client's psi_dh loaders read)
+        self.client.sendall(createMessage("info", "Enter dataset path (.xlsx, .csv, .parquet, .arrow/.feather, SQLite file.db#table, or dataset:<fingerprint> of a registered dataset):", True))
         excel_path = decodeMessage(self.client.recv(1024))["data"]
         
         # Ask for identifier columns
@@ -336,16 +322,53 @@ class UserSession:
         id_columns_str = decodeMessage(self.client.recv(1024))["data"]
         id_columns = [col.strip() for col in id_columns_str.split(',')]
         
-        # Ask for data columns
-        self.client.sendall(createMessage("info", "Enter data columns to share (comma-separated, e.g. 'county,region'):", True))
-        data_columns_str = decodeMessage(self.client.recv(1024))["data"]
-        data_columns = [col.strip() for col in data_columns_str.split(',')]
+        # The party that starts a run picks whether to exchange records or only learn the
+        # intersection size, and whether a records run extends the previous run of this request;
+        # the partner's Step 1 joins the run with the same choices
+        psi_run = self.mergeDB.getPsiRun(requestID)
+        joining = psi_run["starter"] not in ("", self.username) and not psi_run["joined"]
+        if joining:
+            psi_output, incremental = psi_run["psi_output"], psi_run["incremental"]
+            self.client.sendall(createMessage("info", f"Joining the PSI run {psi_run['starter']} started (PSI output: {psi_output}{', incremental' if incremental else ''})", False))
+        else:
+            current_output = psi_run["psi_output"]
+            self.client.sendall(createMessage("info", f"PSI output ({'/'.join(PSI_OUTPUTS)}, press Enter for {current_output}):", True))
+            psi_output = decodeMessage(self.client.recv(1024))["data"].strip().lower() or current_output
+            incremental = False
+            if psi_output == "records":
+                self.client.sendall(createMessage("info", "Only blind and exchange rows added since the last run of this request? (y/N):", True))
+                incremental = decodeMessage(self.client.recv(1024))["data"].strip().lower() in ("y", "yes")
+            try:
+                self.mergeDB.startPsiRun(requestID, self.username, psi_output, incremental)
+            except ValueError as e:
+                self.client.sendall(createMessage("info", f"Error: {e}", False))
+                return
+        
+        # Ask for data columns (nothing is shared when only the intersection size is computed)
+        if psi_output != "records":
+            data_columns = []
+        else:
+            self.client.sendall(createMessage("info", "Enter data columns to share (comma-separated, e.g. 'county,region'):", True))
+            data_columns_str = decodeMessage(self.client.recv(1024))["data"]
+            data_columns = [col.strip() for col in data_columns_str.split(',')]
         
-        # Generate deterministic prime from requestID
-        prime = generate_deterministic_prime(requestID)
+        psi_mode = self.mergeDB.getPsiMode(requestID)
+        # Group parameters were computed when the request was created
+        group_params = self.mergeDB.getGroupParams(requestID)
+        prime = group_params["prime"]
+        if psi_mode == "ec":
+            # Curve points need no shared prime, the key is a scalar modulo the group order
+            private_key = random.randint(1, EC_GROUP_ORDER - 1)
+        elif group_params.get("exponent_bits"):
+            # Short private key in the prime-order subgroup of the group profile
+            private_key = random.randint(2, 2 ** group_params["exponent_bits"] - 1)
+        else:
+            # Generate private key from the prime
+            private_key = random.randint(2, prime-2)
         
-        # Generate private key from the prime
-        private_key = random.randint(2, prime-2)
+        # Clients know the primes of the RFC 3526 profiles, only a derived prime is sent
+        # (the payload has to fit in one message)
+        fixed_prime = GROUP_PROFILES.get(group_params.get("profile"), {}).get("prime")
         
         # Create PSI parameters
         psi_params = {
@@ -353,7 +376,11 @@ class UserSession:
             "id_columns": id_columns,
             "data_columns": data_columns,
             "private_key": private_key,
-            "prime": prime,
+            "prime": None if fixed_prime else prime,
+            "group_params": {key: value for key, value in group_params.items() if key != "prime"},
+            "psi_mode": group_params.get("psi_mode", psi_mode),
+            "psi_output": psi_output,
+            "incremental": incremental,
             "request_id": requestID
         }
         
@@ -367,6 +394,8 @@ class UserSession:
             cid = response["data"].split("CID: ")[1].strip()
             # Handle CID exchange
             if self.handle_psi_cid_exchange(requestID, cid, 1):
+                if joining:
+                    self.mergeDB.joinPsiRun(requestID, self.username)
                 self.client.sendall(createMessage("info", f"PSI Step 1 completed. CID: {cid}\nWaiting for partner's CID to proceed to Step 2.", False))
                 # Increment step for next operation
                 self.last_psi_step = 2
@@ -409,6 +438,12 @@ class UserSession:
             self.client.sendall(createMessage("info", f"Error: {e}", False))
             return
         
+        psi_output = self.mergeDB.getPsiOutput(requestID)
+        if psi_output != "records" and step == 4:
+            self.client.sendall(createMessage("info", f"This request computes only the intersection size ({psi_output}), the protocol ends at Step 3.", False))
+            self.last_psi_step = 1
+            return
+        
         # Check if partner has uploaded CID for previous step
         try:
             partner_cid = self.mergeDB.getPartnerCID(self.username, requestID, step-1)
@@ -436,7 +471,12 @@ class UserSession:
         # Wait for client's response
         response = decodeMessage(self.client.recv(1024))
         
-        if response["type"] == "info" and "CID:" in response["data"]:
+        if psi_output != "records" and step == 3 and response["type"] == "info" and "Intersection size:" in response["data"]:
+            # Nothing is uploaded in step 3 of cardinality and estimate mode, the count ends the protocol
+            size = response["data"].split("Intersection size: ")[1].strip()
+            self.client.sendall(createMessage("info", f"PSI Step 3 completed. Intersection size: {size}", False))
+            self.last_psi_step = 1
+        elif response["type"] == "info" and "CID:" in response["data"]:
             cid = response["data"].split("CID: ")[1].strip()
             # Handle CID exchange
             if self.handle_psi_cid_exchange(requestID, cid, step):
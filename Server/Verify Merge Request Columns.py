@@ -37,7 +37,10 @@ def ensure_required_columns(db_path):
         ("USER1_CID_STEP2", "TEXT", '""'),
         ("USER2_CID_STEP2", "TEXT", '""'),
         ("USER1_CID_STEP3", "TEXT", '""'),
-        ("USER2_CID_STEP3", "TEXT", '""')
+        ("USER2_CID_STEP3", "TEXT", '""'),
+        ("PSI_MODE", "TEXT", '"modp"'),
+        ("PSI_OUTPUT", "TEXT", '"records"'),
+        ("GROUP_PARAMS", "TEXT", '""')
     ]
     
     # Backup the database
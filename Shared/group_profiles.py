@@ -0,0 +1,75 @@
+"""
+Group profiles shared by the server, which picks one per merge request, and the clients,
+which blind in it (loaded by file path from both sides, it only uses the standard library)
+"""
+
+# Blinding modes of the group profiles: exponentiation modulo a prime, in the prime-order
+# subgroup of a safe-prime group, or scalar multiplication on edwards25519
+PSI_MODE_MODP = "modp"
+PSI_MODE_MODP_QR = "modp-qr"
+PSI_MODE_EC = "ec"
+
+# RFC 3526 MODP groups: safe primes p = 2q + 1 with q prime
+RFC3526_MODP_1536 = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+    "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+    "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+    "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+    "9ED529077096966D670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF",
+    16
+)
+RFC3526_MODP_2048 = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+    "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+    "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+    "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+    "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+    "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF",
+    16
+)
+RFC3526_MODP_3072 = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+    "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+    "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+    "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+    "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+    "3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33"
+    "A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7"
+    "ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864"
+    "D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2"
+    "08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF",
+    16
+)
+
+# Group profiles a merge request can be created with (the server picks one per request):
+# - psi_mode: how values are blinded
+# - prime: the modulus, None when it is derived from the request ID
+# - modulus_bits: the modulus size
+# - exponent_bits: default private key size, 0 for a full-width key (which cannot be shortened)
+# - security_bits: estimated strength of the group (NIST SP 800-57), before the exponent size
+GROUP_PROFILES = {
+    "legacy-512": {
+        "psi_mode": PSI_MODE_MODP, "prime": None, "modulus_bits": 512, "exponent_bits": 0, "security_bits": 56
+    },
+    "modp-1536": {
+        "psi_mode": PSI_MODE_MODP_QR, "prime": RFC3526_MODP_1536, "modulus_bits": 1536, "exponent_bits": 256,
+        "security_bits": 96
+    },
+    "modp-2048": {
+        "psi_mode": PSI_MODE_MODP_QR, "prime": RFC3526_MODP_2048, "modulus_bits": 2048, "exponent_bits": 256,
+        "security_bits": 112
+    },
+    "modp-3072": {
+        "psi_mode": PSI_MODE_MODP_QR, "prime": RFC3526_MODP_3072, "modulus_bits": 3072, "exponent_bits": 256,
+        "security_bits": 128
+    },
+    "ec25519": {
+        "psi_mode": PSI_MODE_EC, "prime": None, "modulus_bits": 255, "exponent_bits": 0, "security_bits": 128
+    },
+}
+DEFAULT_GROUP_PROFILE = "legacy-512"
@@ -0,0 +1,65 @@
+import itertools
+import os
+import shutil
+import sys
+
+import pytest
+
+# The client scripts import their helpers as top-level modules, ClientB is a mirror of ClientA
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ClientA"))
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Server")
+
+
+@pytest.fixture
+def ipfs(tmp_path, monkeypatch):
+    """
+    Serve uploads and downloads from a local directory instead of IPFS, the store returned
+    holds every upload under its cid
+    """
+    import psi_dh
+
+    store = tmp_path / "ipfs"
+    store.mkdir()
+    # Bucket files are uploaded from several threads at once
+    cids = itertools.count()
+
+    def upload(file_path):
+        cid = f"cid{next(cids)}"
+        shutil.copyfile(file_path, store / cid)
+        return cid
+
+    def download(cid, output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        shutil.copyfile(store / cid, output_path)
+        return output_path
+
+    monkeypatch.setattr(psi_dh, "upload_to_ipfs", upload)
+    monkeypatch.setattr(psi_dh, "download_from_ipfs", download)
+    return store
+
+
+@pytest.fixture
+def merge_request(monkeypatch):
+    """
+    The server's MergeRequest module
+    """
+    pytest.importorskip("sympy")
+    monkeypatch.syspath_prepend(SERVER_DIR)
+    import MergeRequest
+
+    return MergeRequest
+
+
+@pytest.fixture
+def merge_db(merge_request, tmp_path, monkeypatch):
+    """
+    A server merge request database in a temporary directory, with a request between alice and bob
+    """
+    monkeypatch.chdir(tmp_path)
+    for name in ("UserDataBase", "MergeRequestDataBase"):
+        os.makedirs(name)
+    merge_db = merge_request.MergeRequest()
+    for username in ("alice", "bob"):
+        merge_db.database.addUser(username, "password")
+    merge_db.createMergeRequest("alice", "bob", "request")
+    return merge_db
@@ -0,0 +1,96 @@
+"""
+Runs of the whole PSI protocol between two local parties, for the end-to-end tests
+"""
+import random
+
+import psi_dh
+
+PRIME = 2 ** 127 - 1
+
+
+def psi_steps(tmp_path, name, frame_a, frame_b, psi_mode=psi_dh.PSI_MODE_MODP, output_dirs=None,
+              request_id="request", chunk_rows=0, party_options=({}, {}), **options):
+    """
+    Run the steps of both parties one at a time, pausing after each (a generator, so runs
+    can interleave) and return the step results of both parties
+    options go to run_psi_protocol for both parties, party_options to one party each
+    The dataset is passed at every step, so no step reads the config another run left behind
+    """
+    path_a, path_b = str(tmp_path / f"{name}_a.csv"), str(tmp_path / f"{name}_b.csv")
+    frame_a.to_csv(path_a, index=False)
+    frame_b.to_csv(path_b, index=False)
+    output_dirs = output_dirs or (f"{name}_a_out", f"{name}_b_out")
+    rng = random.Random(name)
+    parties = [
+        (path_a, ["x"], str(tmp_path / output_dirs[0]), rng.randrange(2, PRIME - 1)),
+        (path_b, ["y"], str(tmp_path / output_dirs[1]), rng.randrange(2, PRIME - 1)),
+    ]
+    if psi_mode == psi_dh.PSI_MODE_EC:
+        parties = [party[:3] + (party[3] % psi_dh.ED25519_ORDER,) for party in parties]
+    options = {"result_format": "csv", **options, "request_id": request_id, "psi_mode": psi_mode,
+               "stream_chunk_rows": chunk_rows}
+    results = [{}, {}]
+
+    def step(party, step_number, **cids):
+        path, data_columns, output_dir, key = parties[party]
+        results[party][step_number] = psi_dh.run_psi_protocol(
+            path, ["id"], data_columns, key, PRIME, output_dir, step=step_number, **cids,
+            **{**options, **party_options[party]}
+        )
+
+    step(0, 1)
+    yield
+    step(1, 1)
+    yield
+    for party in (0, 1):
+        step(party, 2, partner_cid_c=results[1 - party][1]["step1"]["cid_c"])
+        yield
+    for party in (0, 1):
+        step(party, 3, partner_cid_k=results[1 - party][2]["step2"]["cid_k"])
+        yield
+    if options.get("psi_output", psi_dh.PSI_OUTPUT_RECORDS) == psi_dh.PSI_OUTPUT_RECORDS:
+        for party in (0, 1):
+            step(party, 4, partner_cid_match=results[1 - party][3]["step3"]["cid_match"])
+            # Runs from the same output directory write the same result file
+            results[party]["table"] = psi_dh.load_table(results[party][4]["step4"]["final_file_path"])
+            yield
+    return results
+
+
+def run_psi(*args, **kwargs):
+    """
+    Run the whole protocol and return the step results of both parties
+    """
+    steps = psi_steps(*args, **kwargs)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def interleave(*runs):
+    """
+    Advance several runs one step at a time in turn, and return their step results
+    """
+    runs = [psi_steps(*args, **kwargs) for args, kwargs in runs]
+    results = [None] * len(runs)
+    while any(result is None for result in results):
+        for position, steps in enumerate(runs):
+            if results[position] is None:
+                try:
+                    next(steps)
+                except StopIteration as stop:
+                    results[position] = stop.value
+    return results
+
+
+def final_tables(results):
+    """
+    Load the final result table of both parties
+    """
+    return [party["table"] for party in results]
+
+
+def sorted_rows(df):
+    return sorted(map(tuple, df.astype(str)[sorted(df.columns)].values.tolist()))
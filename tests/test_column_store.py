@@ -0,0 +1,70 @@
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+
+import psi_dh
+
+FRAME = pd.DataFrame({
+    "count": np.array([1, 2, 3, 4], dtype=np.int64),
+    "amount": [1.5, np.nan, -0.0, 1e300],
+    "flag": [True, False, True, False],
+    "when": pd.to_datetime(["2020-01-01 00:00:00", "2020-01-02 03:04:05.123456", None, "1999-12-31 00:00:00"],
+                           format="ISO8601"),
+    "nullable": pd.array([1, None, 3, 4], dtype="Int64"),
+    "name": pd.array(["a", None, "ü", ""], dtype="str"),
+    "kind": pd.Categorical(["x", "y", None, "x"]),
+    "cells": [1, "1", None, True],
+    "more": [datetime.date(2020, 1, 2), decimal.Decimal("1.10"), b"\x00\xff", float("nan")],
+    "times": [datetime.time(1, 2, 3), datetime.timedelta(days=1, seconds=2), pd.NaT, pd.NA],
+})
+
+
+def assert_same_cells(expected, actual):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual)
+    for col in expected.columns:
+        assert [repr(value) for value in expected[col]] == [repr(value) for value in actual[col]]
+
+
+def test_round_trip(tmp_path):
+    store = psi_dh.ColumnStore(str(tmp_path / "records"))
+    store.create()
+    store.append(FRAME.iloc[:3])
+    store.append(FRAME.iloc[3:])
+
+    reopened = psi_dh.ColumnStore(str(tmp_path / "records"))
+    assert len(reopened) == len(FRAME)
+    assert_same_cells(FRAME, reopened.take())
+
+
+def test_take_reads_only_the_given_rows_and_columns(tmp_path):
+    store = psi_dh.ColumnStore(str(tmp_path / "records"))
+    store.create()
+    store.append(FRAME)
+
+    rows = [3, 0, 3]
+    assert_same_cells(FRAME.iloc[rows][["cells", "count"]], store.take(rows, ["cells", "count", "missing"]))
+    assert store.take([], ["name"]).shape == (0, 1)
+
+
+def test_changed_dtype_keeps_the_values(tmp_path):
+    store = psi_dh.ColumnStore(str(tmp_path / "records"))
+    store.create()
+    store.append(pd.DataFrame({"value": [1, 2]}))
+    store.append(pd.DataFrame({"value": pd.Series(["x", None], dtype=object)}))
+
+    values = store.take()["value"].tolist()
+    assert [repr(value) for value in values] == ["1", "2", "'x'", "None"]
+
+
+def test_state_reads_back_matched_rows(tmp_path):
+    state = psi_dh.PSIStateStore(str(tmp_path), "request")
+    state.create()
+    state.append_records(FRAME.iloc[:2])
+    state.append_records(FRAME.iloc[2:])
+    assert_same_cells(FRAME.iloc[[1, 2]][["name", "when"]], state.records([1, 2], ["name", "when"]))
+
+    # A new run drops the records of the previous one
+    state.create()
+    assert state.records().empty
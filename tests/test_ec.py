@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+import psi_dh
+
+sodium = pytest.importorskip("nacl.bindings")
+
+# Points of order 4 have y = 0, so x is a square root of -1
+TORSION_POINT = (psi_dh.ED25519_SQRT_M1, 0, 1, 0)
+
+
+def uniform_inputs(count):
+    rng = random.Random(0)
+    return [bytes(32), bytes([0xff] * 32)] + [rng.randbytes(32) for _ in range(count)]
+
+
+def test_from_uniform_matches_libsodium():
+    for uniform in uniform_inputs(50):
+        assert psi_dh._ed_encode(psi_dh._ed_from_uniform(uniform)) == sodium.crypto_core_ed25519_from_uniform(uniform)
+
+
+def test_scalarmult_matches_libsodium():
+    rng = random.Random(1)
+    # Zero bytes map to the identity, which has no multiples to compare
+    for uniform in uniform_inputs(20)[1:]:
+        point = sodium.crypto_core_ed25519_from_uniform(uniform)
+        scalar = rng.randrange(1, psi_dh.ED25519_ORDER)
+        expected = sodium.crypto_scalarmult_ed25519_noclamp(scalar.to_bytes(32, "little"), point)
+        assert psi_dh._ed_encode(psi_dh._ed_scalarmult(scalar, psi_dh._ed_decode(point))) == expected
+
+
+def test_fallback_blinds_like_libsodium(monkeypatch):
+    rng = random.Random(2)
+    hashes = [rng.randrange(2 ** 256) for _ in range(10)]
+    key_a, key_b = rng.randrange(1, psi_dh.ED25519_ORDER), rng.randrange(1, psi_dh.ED25519_ORDER)
+
+    def k_values():
+        c_values = psi_dh.blind_record_hashes(hashes, key_a, 0, psi_dh.PSI_MODE_EC)
+        return c_values, psi_dh.compute_second_blinded_values(c_values, key_b, 0, psi_mode=psi_dh.PSI_MODE_EC)
+
+    expected = k_values()
+    monkeypatch.setattr(psi_dh, "sodium", None)
+    assert k_values() == expected
+
+
+def test_fallback_rejects_what_libsodium_rejects():
+    point = psi_dh._ed_from_uniform(bytes(range(32)))
+    invalid = [
+        # Identity and a small-order point
+        psi_dh._ed_encode(psi_dh.ED25519_IDENTITY),
+        psi_dh._ed_encode(TORSION_POINT),
+        # A point with a small-order component
+        psi_dh._ed_encode(psi_dh._ed_add(point, TORSION_POINT)),
+        # y = p is not a canonical encoding
+        psi_dh.ED25519_P.to_bytes(32, "little"),
+    ]
+    scalar = (12345).to_bytes(32, "little")
+    for encoded in invalid:
+        with pytest.raises(Exception):
+            sodium.crypto_scalarmult_ed25519_noclamp(scalar, encoded)
+        with pytest.raises(ValueError):
+            psi_dh._ed_decode(encoded)
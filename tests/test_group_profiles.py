@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+import psi_dh
+
+PRIME = psi_dh.RFC3526_MODP_1536
+
+
+def test_server_and_clients_share_the_profiles(merge_request):
+    assert merge_request.GROUP_PROFILES == psi_dh.GROUP_PROFILES
+    assert merge_request.DEFAULT_GROUP_PROFILE == psi_dh.DEFAULT_GROUP_PROFILE
+
+    params = merge_request.generate_group_params("request", "ec")
+    assert params["profile"] == "ec25519" and params["prime"] == psi_dh.ED25519_ORDER
+    params = merge_request.generate_group_params("request", "modp", "modp-2048", 320)
+    assert params == {"psi_mode": psi_dh.PSI_MODE_MODP_QR, "profile": "modp-2048",
+                      "prime": psi_dh.RFC3526_MODP_2048, "exponent_bits": 320}
+
+
+def test_server_rejects_invalid_profiles(merge_request):
+    # Full-width profiles have no key size to set
+    with pytest.raises(ValueError, match="full-width"):
+        merge_request.generate_group_params("request", "modp", "legacy-512", 256)
+    with pytest.raises(ValueError, match="full-width"):
+        merge_request.generate_group_params("request", "ec", exponent_bits=256)
+    with pytest.raises(ValueError, match="must be one of"):
+        merge_request.generate_group_params("request", "modp", "ec25519")
+    with pytest.raises(ValueError, match="between"):
+        merge_request.generate_group_params("request", "modp", "modp-1536", 64)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_qr_mode_rejects_values_outside_the_subgroup(workers):
+    rng = random.Random(0)
+    key_a, key_b = rng.randrange(2, 2 ** 256), rng.randrange(2, 2 ** 256)
+    hashes = [rng.randrange(2, PRIME - 1) for _ in range(8)]
+    c_values = psi_dh.blind_record_hashes(hashes, key_a, PRIME, psi_dh.PSI_MODE_MODP_QR)
+    k_values = psi_dh.compute_second_blinded_values(c_values, key_b, PRIME, workers, 3, psi_dh.PSI_MODE_MODP_QR)
+    assert k_values == [pow(h, 2 * key_a * key_b, PRIME) for h in hashes]
+
+    # -1 is no square modulo a safe prime (p = 3 mod 4), so neither is -c
+    for value in (0, 1, PRIME - 1, PRIME - c_values[0], PRIME, PRIME + 4):
+        with pytest.raises(ValueError, match="outside the prime-order subgroup"):
+            psi_dh.compute_second_blinded_values(c_values + [value], key_b, PRIME, workers, 3,
+                                                 psi_dh.PSI_MODE_MODP_QR)
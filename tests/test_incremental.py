@@ -0,0 +1,59 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import psi_dh
+from psi_runs import final_tables, run_psi, sorted_rows
+
+BEFORE_A = pd.DataFrame({"id": [1, 2, 3, 4, 5, 5], "x": ["a1", "a2", "a3", "a4", "a5", "a5b"]})
+BEFORE_B = pd.DataFrame({"id": [3, 4, 5, 6, 7], "y": ["b3", "b4", "b5", "b6", "b7"]})
+# Rows added to matched and unmatched ids, new ids on both sides, a duplicate row
+ADDED_A = pd.concat([BEFORE_A, pd.DataFrame({"id": [3, 7, 8, 3, 1], "x": ["a3b", "a7", "a8", "a3", "a1b"]})],
+                    ignore_index=True)
+ADDED_B = pd.concat([BEFORE_B, pd.DataFrame({"id": [8, 4, 9], "y": ["b8", "b4b", "b9"]})], ignore_index=True)
+# Then a removed row of a matched id, a changed value, and an id removed from one side
+CHANGED_A = ADDED_A.drop(index=[5, 6]).replace({"x": {"a4": "a4 changed"}})
+CHANGED_B = ADDED_B[ADDED_B["id"] != 8]
+
+
+@pytest.mark.parametrize("psi_mode", [psi_dh.PSI_MODE_MODP, psi_dh.PSI_MODE_EC])
+@pytest.mark.parametrize("chunk_rows", [0, 2])
+def test_incremental_run_matches_full_run(tmp_path, ipfs, psi_mode, chunk_rows):
+    run_psi(tmp_path, "first", BEFORE_A, BEFORE_B, psi_mode, chunk_rows=chunk_rows)
+    # The first run left its state in the directories the incremental runs extend
+    for party in ("a", "b"):
+        shutil.copytree(tmp_path / f"first_{party}_out", tmp_path / party)
+
+    for name, frame_a, frame_b, rows in [("added", ADDED_A, ADDED_B, 9), ("changed", CHANGED_A, CHANGED_B, 6)]:
+        incremental = final_tables(run_psi(tmp_path, name, frame_a, frame_b, psi_mode, output_dirs=("a", "b"),
+                                           incremental=True, chunk_rows=chunk_rows))
+        full = final_tables(run_psi(tmp_path, f"{name}_full", frame_a, frame_b, psi_mode, chunk_rows=chunk_rows))
+        for incremental_df, full_df in zip(incremental, full):
+            assert len(full_df) == rows
+            assert sorted_rows(incremental_df) == sorted_rows(full_df)
+
+
+def test_changes_apply_to_match_table():
+    match_df = pd.DataFrame({"hash_id": ["1", "1", "2"], "row_id": ["r1", "r2", "r3"], "x": [1, 2, 3]})
+    changes_df = pd.DataFrame({"hash_id": ["1", "2"], "row_id": ["r1", "r4"], "x": [1, 4],
+                               "row_removed": [True, False]})
+    updated = psi_dh.apply_match_changes(match_df, changes_df)
+    assert updated.to_dict("list") == {"hash_id": ["1", "2", "2"], "row_id": ["r2", "r3", "r4"], "x": [2, 3, 4]}
+
+    # Identical records get their own ids, so removing one keeps the other
+    twins = pd.DataFrame({"hash_id": ["1", "1"], "x": [1, 1]})
+    assert len(set(psi_dh.match_row_ids(twins))) == 2
+
+
+def test_row_ids_follow_typed_content():
+    df = pd.DataFrame({"hash_id": ["1", "1", "2", "2", "2"], "x": pd.Series([1, "1", None, np.nan, 1], dtype=object),
+                       "y": [0.5, 0.5, 0.5, 0.5, 0.5]})
+    row_ids = psi_dh.match_row_ids(df)
+    # The cell types tell 1 from "1" and None from NaN in object columns
+    assert len(set(row_ids)) == 5
+    # Ids do not depend on the position of a row
+    assert psi_dh.match_row_ids(df.iloc[::-1]) == row_ids[::-1]
+    assert psi_dh.match_row_ids(df.iloc[[4]]) == [row_ids[4]]
+    assert psi_dh.match_row_ids(df.assign(y=0.25))[0] != row_ids[0]
@@ -0,0 +1,36 @@
+import pytest
+
+
+def test_run_options_are_picked_by_the_starter(merge_db):
+    assert merge_db.getPsiRun("request") == {"psi_output": "records", "incremental": False, "starter": "",
+                                             "joined": False}
+
+    merge_db.startPsiRun("request", "alice", "cardinality")
+    # The starter may change its choice until the partner joins
+    merge_db.startPsiRun("request", "alice", "estimate")
+    # The partner cannot replace a run it has not joined
+    with pytest.raises(ValueError, match="started a PSI run"):
+        merge_db.startPsiRun("request", "bob", "records")
+    assert merge_db.getPsiRun("request") == {"psi_output": "estimate", "incremental": False, "starter": "alice",
+                                             "joined": False}
+
+    merge_db.joinPsiRun("request", "bob")
+    assert merge_db.getPsiRun("request")["joined"]
+    # A joined run ends at the next Step 1, whoever runs it
+    merge_db.startPsiRun("request", "bob", "records")
+    assert merge_db.getPsiRun("request") == {"psi_output": "records", "incremental": False, "starter": "bob",
+                                             "joined": False}
+    with pytest.raises(ValueError, match="must be one of"):
+        merge_db.startPsiRun("request", "bob", "everything")
+
+
+def test_incremental_choice_is_stored_with_the_run(merge_db):
+    merge_db.startPsiRun("request", "alice", "records", incremental=True)
+    run = merge_db.getPsiRun("request")
+    assert run["incremental"] and run["starter"] == "alice"
+    with pytest.raises(ValueError, match="Only records runs"):
+        merge_db.startPsiRun("request", "alice", "cardinality", incremental=True)
+
+    merge_db.joinPsiRun("request", "bob")
+    merge_db.startPsiRun("request", "bob", "records")
+    assert not merge_db.getPsiRun("request")["incremental"]
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+import psi_dh
+
+MODULI = [2 ** 127 - 1, psi_dh.RFC3526_MODP_1536, 2 ** 64 + 1, 97]
+
+
+@pytest.fixture
+def backend():
+    """
+    Restore the active backend after a test switches it
+    """
+    active = psi_dh.get_modexp_backend()
+    yield
+    psi_dh.set_modexp_backend(active)
+
+
+@pytest.mark.parametrize("name", list(psi_dh.MODEXP_BACKENDS))
+@pytest.mark.parametrize("modulus", MODULI)
+def test_backend_matches_pow(name, modulus):
+    rng = random.Random(modulus)
+    bases = [0, 1, 2, modulus - 1, modulus, modulus + 3] + [rng.randrange(modulus) for _ in range(20)]
+    for exponent in (0, 1, 2, 65537, rng.randrange(2 ** 256), rng.randrange(modulus)):
+        expected = [pow(base, exponent, modulus) for base in bases]
+        assert psi_dh.MODEXP_BACKENDS[name].powmod_batch(bases, exponent, modulus) == expected
+
+
+@pytest.mark.parametrize("name", list(psi_dh.MODEXP_BACKENDS))
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_keeps_the_order(backend, name, workers):
+    psi_dh.set_modexp_backend(name)
+    modulus = psi_dh.RFC3526_MODP_1536
+    rng = random.Random(workers)
+    bases = [rng.randrange(modulus) for _ in range(50)]
+    exponent = rng.randrange(2 ** 256)
+    assert psi_dh.batch_modexp(bases, exponent, modulus, workers, 7) == [pow(b, exponent, modulus) for b in bases]
+
+
+def test_unknown_backend_is_refused(backend):
+    with pytest.raises(ValueError, match="not available"):
+        psi_dh.set_modexp_backend("missing")
+
+
+@pytest.mark.parametrize("psi_mode", [psi_dh.PSI_MODE_MODP, psi_dh.PSI_MODE_MODP_QR])
+def test_blinding_commutes(psi_mode):
+    prime = psi_dh.RFC3526_MODP_1536
+    rng = random.Random(psi_mode)
+    hashes = [rng.randrange(2, prime - 1) for _ in range(10)]
+    key_a, key_b = rng.randrange(2, 2 ** 256), rng.randrange(2, 2 ** 256)
+
+    def k_values(first, second):
+        c_values = psi_dh.blind_record_hashes(hashes, first, prime, psi_mode)
+        return psi_dh.compute_second_blinded_values(c_values, second, prime, psi_mode=psi_mode)
+
+    assert k_values(key_a, key_b) == k_values(key_b, key_a)
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import psi_dh
+from psi_runs import final_tables, interleave, run_psi, sorted_rows
+
+
+def frames(ids_a, ids_b):
+    """
+    Datasets of two parties with the given ids, one row per id plus a second row of every tenth id
+    """
+    def frame(ids, column, prefix):
+        ids = list(ids) + [i for i in ids if i % 10 == 0]
+        return pd.DataFrame({"id": ids, column: [f"{prefix}{i}-{n}" for n, i in enumerate(ids)]})
+
+    return frame(ids_a, "x", "a"), frame(ids_b, "y", "b")
+
+
+FIRST = frames(range(0, 100), range(50, 150))
+SECOND = frames(range(1000, 1100), range(1070, 1200))
+
+
+def random_keys(count, seed, width=16):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(count, width), dtype=np.uint8).view(f"S{width}").ravel()
+
+
+@pytest.mark.parametrize("memory_budget", [24, 240, 2400, 1 << 20])
+def test_external_intersection_matches_in_memory(tmp_path, memory_budget):
+    ours, partner = random_keys(300, 2), random_keys(200, 3)
+    # Shared values, repeated values on both sides
+    partner[::4] = ours[:50]
+    partner[1::8] = partner[0]
+    ours[-5:] = ours[0]
+    expected = psi_dh.intersect_positions(ours, partner)
+    assert len(expected) == 75
+
+    positions = psi_dh.external_intersect_positions(ours, partner, memory_budget, str(tmp_path))
+    np.testing.assert_array_equal(positions, expected)
+    # The runs are spilled to a temp directory that is removed afterwards
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_external_intersection_run(tmp_path, ipfs):
+    expected = final_tables(run_psi(tmp_path, "plain", *FIRST))
+    external = final_tables(run_psi(tmp_path, "external", *FIRST, intersection_memory=512))
+    for external_df, expected_df in zip(external, expected):
+        assert sorted_rows(external_df) == sorted_rows(expected_df)
+
+
+def test_bucket_intersection_matches_in_memory(tmp_path):
+    ours, partner = random_keys(500, 0), random_keys(400, 1)
+    partner[::3] = ours[:134]
+    expected = psi_dh.intersect_positions(ours, partner)
+    assert len(expected) == 134
+
+    our_paths = psi_dh.write_k_buckets(ours, 7, str(tmp_path / "ours"))
+    partner_paths = psi_dh.write_k_buckets(partner, 7, str(tmp_path / "partner"))
+    for workers in (1, 2):
+        np.testing.assert_array_equal(psi_dh.intersect_bucket_positions(our_paths, partner_paths, workers), expected)
+
+
+@pytest.mark.parametrize("party_options", [({"buckets": 4}, {"buckets": 4}), ({}, {"buckets": 3}),
+                                           ({"buckets": 5}, {"buckets": 2})])
+def test_bucketed_run_matches_plain_run(tmp_path, ipfs, party_options):
+    expected = final_tables(run_psi(tmp_path, "plain", *FIRST))
+    bucketed = final_tables(run_psi(tmp_path, "bucketed", *FIRST, party_options=party_options))
+    for bucketed_df, expected_df in zip(bucketed, expected):
+        assert len(expected_df) == 65
+        assert sorted_rows(bucketed_df) == sorted_rows(expected_df)
+
+
+def test_interleaved_bucketed_requests(tmp_path, ipfs):
+    expected = [final_tables(run_psi(tmp_path, name, *data)) for name, data in [("one", FIRST), ("two", SECOND)]]
+    # Both requests run from the same output directories, one step of each in turn
+    runs = [((tmp_path, f"{name}_bucketed", *data), dict(output_dirs=("a", "b"), request_id=name, buckets=4))
+            for name, data in [("one", FIRST), ("two", SECOND)]]
+    for results, expected_tables in zip(interleave(*runs), expected):
+        for df, expected_df in zip(final_tables(results), expected_tables):
+            assert len(df) > 0
+            assert sorted_rows(df) == sorted_rows(expected_df)
+
+
+@pytest.mark.parametrize("psi_mode", [psi_dh.PSI_MODE_MODP, psi_dh.PSI_MODE_EC])
+@pytest.mark.parametrize("options", [{}, {"buckets": 3}, {"intersection_memory": 256}])
+def test_cardinality_is_the_true_overlap(tmp_path, ipfs, psi_mode, options):
+    results = run_psi(tmp_path, "cardinality", *FIRST, psi_mode, psi_output=psi_dh.PSI_OUTPUT_CARDINALITY, **options)
+    # Ids with a second row count once
+    assert [party[3]["step3"]["cardinality"] for party in results] == [50, 50]
+    assert all(4 not in party for party in results)
+
+
+def test_sealed_records_open_only_for_true_matches():
+    # The partner's full k values of our 4 records, and our full k values of its 3 records
+    partner_raw = np.random.default_rng(5).integers(0, 256, size=(4, 16), dtype=np.uint8)
+    our_raw = np.stack([partner_raw[0], partner_raw[2], partner_raw[3]])
+    # Record 1 shares the fingerprint of record 3, our second value that of record 2
+    partner_raw[1, -4:] = partner_raw[3, -4:]
+    our_raw[1, 0] ^= 1
+    partner_keys, our_keys = partner_raw.view("S16").ravel(), our_raw.view("S16").ravel()
+
+    fingerprints = psi_dh.truncate_keys(partner_keys, 4)
+    positions = psi_dh.intersect_positions(psi_dh.truncate_keys(our_keys, 4), fingerprints)
+    np.testing.assert_array_equal(positions, [0, 1, 2, 3])
+    match_df = pd.DataFrame({"hash_id": [f"h{p}" for p in positions], "x": [f"a{p}" for p in positions]})
+    sealed_df = psi_dh.seal_match_table(match_df, positions, fingerprints, our_keys)
+    assert list(sealed_df.columns) == ["position", "sealed"]
+
+    opened = psi_dh.open_match_table(sealed_df, partner_keys)
+    assert sorted_rows(opened) == [("h0", "a0"), ("h3", "a3")]
+    assert len(psi_dh.open_match_table(sealed_df.iloc[[1, 2]], partner_keys)) == 0
+
+
+@pytest.mark.parametrize("options", [{}, {"buckets": 3}])
+def test_fingerprint_run_matches_plain_run(tmp_path, ipfs, options):
+    expected = final_tables(run_psi(tmp_path, "plain", *FIRST))
+    results = run_psi(tmp_path, "fingerprints", *FIRST, k_fp_rate=0.01, **options)
+    if not options:
+        assert [len(psi_dh.load_values(str(ipfs / party[2]["step2"]["cid_k"])).raw()) for party in results] == \
+            [4 * 100, 4 * 100]
+    for party, expected_df in zip(results, expected):
+        # Only sealed records were shared
+        shared_df = psi_dh.load_table(str(ipfs / party[3]["step3"]["cid_match"]))
+        assert list(shared_df.columns) == ["position", "sealed"] and len(shared_df) == 55
+        assert len(party["table"]) == 65
+        assert sorted_rows(party["table"]) == sorted_rows(expected_df)
+
+
+@pytest.mark.parametrize("psi_mode", [psi_dh.PSI_MODE_MODP, psi_dh.PSI_MODE_EC])
+def test_fingerprint_cardinality_is_the_true_overlap(tmp_path, ipfs, psi_mode):
+    results = run_psi(tmp_path, "fingerprints", *FIRST, psi_mode, psi_output=psi_dh.PSI_OUTPUT_CARDINALITY,
+                      k_fp_rate=1e-6)
+    assert [party[3]["step3"]["cardinality"] for party in results] == [50, 50]
+
+
+@pytest.mark.parametrize("psi_mode", [psi_dh.PSI_MODE_MODP, psi_dh.PSI_MODE_EC])
+def test_estimate_interval_holds_the_true_overlap(tmp_path, ipfs, psi_mode):
+    results = run_psi(tmp_path, "estimate", *FIRST, psi_mode, psi_output=psi_dh.PSI_OUTPUT_ESTIMATE)
+    for party in results:
+        estimate = party[3]["step3"]
+        assert estimate["lower"] <= 50 <= estimate["upper"]
+    assert all(4 not in party for party in results)
+
+
+def test_interleaved_estimate_requests(tmp_path, ipfs):
+    # Both requests run from the same output directories, one step of each in turn
+    runs = [((tmp_path, name, *data), dict(output_dirs=("a", "b"), request_id=name,
+                                           psi_output=psi_dh.PSI_OUTPUT_ESTIMATE))
+            for name, data in [("one", FIRST), ("two", frames(range(1000, 1400), range(1390, 1800)))]]
+    for results, overlap in zip(interleave(*runs), [50, 10]):
+        for party in results:
+            estimate = party[3]["step3"]
+            assert estimate["lower"] <= overlap <= estimate["upper"]
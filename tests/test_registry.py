@@ -0,0 +1,72 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import psi_dh
+
+FRAME = pd.DataFrame({
+    "id": [1, 2, 3, 2],
+    "amount": pd.array([10, None, 30, 40], dtype="Int64"),
+    "when": pd.to_datetime(["2020-01-01", "2020-01-02", None, "2020-01-04"]),
+    "note": ["a", None, "c", "d"],
+})
+
+
+def write_dataset(tmp_path, name="data.parquet", frame=FRAME):
+    path = str(tmp_path / name)
+    frame.to_parquet(path, index=False)
+    return path
+
+
+def read_blocks(registry, source, chunk_rows=0):
+    fingerprint = registry.resolve(source, ["id"], ["amount", "when", "note"], chunk_rows)
+    blocks = list(registry.iter_blocks(fingerprint, ["amount", "when", "note"]))
+    hashes = [h for block_hashes, _ in blocks for h in block_hashes]
+    return fingerprint, hashes, pd.concat([records for _, records in blocks], ignore_index=True)
+
+
+@pytest.mark.skipif(psi_dh.pyarrow is None, reason="pyarrow is not installed")
+@pytest.mark.parametrize("chunk_rows", [0, 3])
+def test_cached_blocks_keep_types(tmp_path, monkeypatch, chunk_rows):
+    source = write_dataset(tmp_path)
+    registry = psi_dh.DatasetRegistry(str(tmp_path / "registry"))
+    fingerprint, hashes, records = read_blocks(registry, source, chunk_rows)
+
+    assert hashes == psi_dh.hash_id_columns(FRAME, ["id"])
+    pd.testing.assert_frame_equal(records, FRAME[["amount", "when", "note"]])
+
+    # A hit reads the cache without parsing the dataset again
+    monkeypatch.setattr(psi_dh, "load_dataset", None)
+    monkeypatch.setattr(psi_dh, "iter_dataset_chunks", None)
+    assert read_blocks(registry, source)[0] == fingerprint
+    assert read_blocks(registry, psi_dh.DATASET_REF_PREFIX + fingerprint)[1] == hashes
+
+
+@pytest.mark.skipif(psi_dh.pyarrow is None, reason="pyarrow is not installed")
+def test_evicts_old_and_least_recently_used_entries(tmp_path):
+    path = str(tmp_path / "registry")
+    sources = [write_dataset(tmp_path, f"data{i}.parquet", FRAME.assign(id=FRAME["id"] + i)) for i in range(3)]
+    registry = psi_dh.DatasetRegistry(path)
+    first, second, third = (read_blocks(registry, source)[0] for source in sources)
+
+    # Use the first entry again, so the second is the least recently used
+    now = time.time()
+    for age, fingerprint in [(30, first), (20, second), (10, third)]:
+        entry_file_path = os.path.join(path, fingerprint, "entry.json")
+        os.utime(entry_file_path, (now - age, now - age))
+    read_blocks(registry, sources[0])
+
+    sizes = [sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(os.path.join(path, fp))
+                 for name in names) for fp in (first, third)]
+    psi_dh.DatasetRegistry(path, max_bytes=sum(sizes)).evict()
+    assert registry.entry(second) is None
+    assert registry.entry(first) is not None and registry.entry(third) is not None
+
+    # An entry unused for longer than max_age is dropped, the one in use is kept
+    psi_dh.DatasetRegistry(path, max_age=0).evict(keep=first)
+    assert registry.entry(third) is None
+    assert registry.entry(first) is not None
+    with pytest.raises(ValueError, match="not registered"):
+        registry.resolve(psi_dh.DATASET_REF_PREFIX + third, ["id"], ["note"])
@@ -0,0 +1,162 @@
+import csv
+import datetime
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import psi_dh
+
+# Columns whose kinds of value vary along the rows, so small chunks see only some of them
+COLUMNS = {
+    "id": [1, 2, 3, None, 5, 6, 7, 8],
+    "code": ["a1", "7", "B2", None, "9", "c3", "d4", "e5"],
+    "amount": [1, 2, 2.5, 4, None, 6, 7.25, 8],
+    "flag": [True, False, None, True, True, False, None, True],
+    "text_flag": ["True", "False", "True", "x", "False", "True", "False", "True"],
+    "when": [datetime.datetime(2020, 1, day) for day in (1, 2, 3)] + [None] + [
+        datetime.datetime(2020, 2, day) for day in (1, 2, 3, 4)],
+}
+CHUNK_SIZES = (1, 2, 3, 5)
+
+
+def assert_same_frames(whole, chunks):
+    stream = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(whole, stream)
+    for col in whole.columns:
+        # assert_frame_equal takes True and 1.0 as equal
+        assert [repr(value) for value in whole[col]] == [repr(value) for value in stream[col]]
+        assert psi_dh.hash_id_columns(whole, [col]) == psi_dh.hash_id_columns(stream, [col])
+
+
+def write_excel(path, columns, blank_rows=()):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(list(columns))
+    for row in range(len(next(iter(columns.values())))):
+        if row in blank_rows:
+            sheet.append([])
+        sheet.append([columns[col][row] for col in columns])
+    workbook.save(path)
+
+
+def test_excel_ids_hash_like_whole_file(tmp_path):
+    # A chunk of whole numbers parses as int while the sheet is float because of the blank
+    path = str(tmp_path / "ids.xlsx")
+    write_excel(path, {"id": [1, 2, 3, None, 5, 6]})
+    whole = pd.read_excel(path)
+    chunks = list(psi_dh.iter_dataset_chunks(path, 3))
+    assert [chunk["id"].dtype for chunk in chunks] == [whole["id"].dtype] * 2
+    assert psi_dh.hash_id_columns(pd.concat(chunks), ["id"]) == psi_dh.hash_id_columns(whole, ["id"])
+
+
+@pytest.mark.parametrize("chunk_rows", CHUNK_SIZES)
+def test_excel_chunks_match_whole_file(tmp_path, chunk_rows):
+    path = str(tmp_path / "data.xlsx")
+    write_excel(path, COLUMNS, blank_rows=(2, 5))
+    whole = psi_dh.load_dataset(path)
+    assert len(whole) == len(COLUMNS["id"]) + 2
+    assert_same_frames(whole, list(psi_dh.iter_dataset_chunks(path, chunk_rows)))
+    projected = ["code", "id"]
+    assert_same_frames(psi_dh.load_dataset(path, projected)[["id", "code"]],
+                       list(psi_dh.iter_dataset_chunks(path, chunk_rows, projected)))
+
+
+@pytest.mark.parametrize("chunk_rows", CHUNK_SIZES)
+def test_csv_chunks_match_whole_file(tmp_path, chunk_rows):
+    path = str(tmp_path / "data.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "code", "amount", "flag"])
+        writer.writerows([
+            ["1", "a1", "1", "True"], ["2", "7", "2", "False"], ["3", "B2", "2.50", ""],
+            ["", "", "4", "True"], ["5", "9", "", "false"], ["6", "c3", "6", "TRUE"],
+        ])
+    assert_same_frames(psi_dh.load_dataset(path), list(psi_dh.iter_dataset_chunks(path, chunk_rows)))
+
+
+@pytest.mark.parametrize("chunk_rows", CHUNK_SIZES)
+def test_sqlite_chunks_match_whole_file(tmp_path, chunk_rows):
+    path = str(tmp_path / "data.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE records (id, code, amount)")
+        conn.executemany("INSERT INTO records VALUES (?, ?, ?)", [
+            (1, "a", 1), (2, 7, 2), (3, "b", None), (None, "c", 4.5), (5, None, 5), (6, 8, 6),
+        ])
+    source = path + "#records"
+    assert_same_frames(psi_dh.load_dataset(source), list(psi_dh.iter_dataset_chunks(source, chunk_rows)))
+
+
+@pytest.mark.parametrize("extension", [".parquet", ".arrow"])
+@pytest.mark.parametrize("chunk_rows", CHUNK_SIZES)
+def test_arrow_chunks_match_whole_file(tmp_path, extension, chunk_rows):
+    pyarrow = pytest.importorskip("pyarrow")
+    table = pyarrow.table({
+        "id": pyarrow.array([1, 2, 3, None, 5, 6], pyarrow.int64()),
+        "flag": pyarrow.array([True, False, True, True, None, False], pyarrow.bool_()),
+        "name": pyarrow.array(["a", "b", None, "d", "e", "f"], pyarrow.string()),
+    })
+    path = str(tmp_path / f"data{extension}")
+    if extension == ".parquet":
+        import pyarrow.parquet
+
+        pyarrow.parquet.write_table(table, path, row_group_size=2)
+    else:
+        import pyarrow.feather
+
+        pyarrow.feather.write_feather(table, path)
+    assert_same_frames(psi_dh.load_dataset(path), list(psi_dh.iter_dataset_chunks(path, chunk_rows)))
+
+
+@pytest.mark.parametrize("extension", [".parquet", ".arrow"])
+@pytest.mark.parametrize("chunk_rows", CHUNK_SIZES)
+def test_pandas_written_chunks_keep_values(tmp_path, extension, chunk_rows):
+    pytest.importorskip("pyarrow")
+    frame = pd.DataFrame({
+        "id": pd.array([1, None, 3, 4, 5, 6], dtype="Int64"),
+        "flag": pd.array([True, None, False, True, True, False], dtype="boolean"),
+        "kind": pd.Categorical(["x", "y", None, "z", "x", "y"]),
+    })
+    path = str(tmp_path / f"data{extension}")
+    if extension == ".parquet":
+        frame.to_parquet(path, index=False, row_group_size=2)
+    else:
+        frame.to_feather(path)
+
+    whole = psi_dh.load_dataset(path)
+    chunks = list(psi_dh.iter_dataset_chunks(path, chunk_rows))
+    # Categories come from each chunk's dictionary, the values are those of the whole file
+    for chunk in chunks:
+        assert chunk.dtypes[["id", "flag"]].tolist() == whole.dtypes[["id", "flag"]].tolist()
+    stream = pd.concat(chunks, ignore_index=True)
+    for col in whole.columns:
+        assert [repr(value) for value in whole[col]] == [repr(value) for value in stream[col]]
+    assert psi_dh.hash_id_columns(whole, list(whole.columns)) == [
+        h for chunk in chunks for h in psi_dh.hash_id_columns(chunk, list(chunk.columns))
+    ]
+
+
+def test_detects_formats_by_content(tmp_path):
+    csv_path = tmp_path / "table.csv"
+    pd.DataFrame(COLUMNS).to_csv(csv_path, index=False)
+    assert psi_dh.detect_dataset_format(str(csv_path)) == "csv"
+
+    # A workbook is read as Excel whatever its extension
+    xlsx_path = tmp_path / "table.dat"
+    write_excel(str(xlsx_path), COLUMNS)
+    assert psi_dh.detect_dataset_format(str(xlsx_path)) == "excel"
+
+    ole_path = tmp_path / "legacy.bin"
+    ole_path.write_bytes(psi_dh.XlsLoader.magic + bytes(504))
+    if psi_dh.xlrd is None:
+        with pytest.raises(ValueError, match="needs xlrd"):
+            psi_dh.detect_dataset_format(str(ole_path))
+    else:
+        assert psi_dh.detect_dataset_format(str(ole_path)) == "xls"
+
+    unknown_path = tmp_path / "table.json"
+    unknown_path.write_text("{}")
+    with pytest.raises(ValueError, match="Unknown dataset format"):
+        psi_dh.detect_dataset_format(str(unknown_path))
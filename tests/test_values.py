@@ -0,0 +1,74 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import psi_dh
+
+VALUES = [0, 1, 255, 2 ** 64 + 7, 2 ** 255 - 19]
+WIDTH = 32
+
+
+def test_binary_round_trip(tmp_path):
+    path = str(tmp_path / "values.bin")
+    psi_dh.save_values_to_binary(VALUES, path, WIDTH)
+
+    values = psi_dh.load_values(path)
+    assert len(values) == len(VALUES)
+    assert list(values) == VALUES
+    assert values[-1] == VALUES[-1]
+    assert values[1:3] == VALUES[1:3]
+    assert psi_dh.keys_to_ints(psi_dh.value_keys(values)) == VALUES
+    values.close()
+
+
+def test_append(tmp_path):
+    first, second, output = (str(tmp_path / name) for name in ("first.bin", "second.bin", "all.bin"))
+    psi_dh.save_values_to_binary(VALUES[:2], first, WIDTH)
+    psi_dh.save_values_to_binary(VALUES[2:], second, WIDTH)
+
+    assert psi_dh.append_values(first, output) == 2
+    assert psi_dh.append_values(second, output) == len(VALUES)
+    assert list(psi_dh.load_values(output)) == VALUES
+
+    psi_dh.save_values_to_binary([1], second, WIDTH // 2)
+    with pytest.raises(ValueError):
+        psi_dh.append_values(second, output)
+
+
+def test_positions(tmp_path):
+    path = str(tmp_path / "positioned.bin")
+    records = np.zeros(3, dtype=psi_dh.positioned_dtype(WIDTH))
+    records["key"] = psi_dh.value_keys(VALUES[:3], WIDTH)
+    records["pos"] = [5, 0, 9]
+    with psi_dh.ValuesWriter(path, WIDTH, psi_dh.VALUES_FLAG_POSITIONS) as writer:
+        writer.write_records(records)
+
+    loaded = psi_dh.load_positioned_values(path)
+    assert psi_dh.keys_to_ints(loaded["key"]) == VALUES[:3]
+    assert loaded["pos"].tolist() == [5, 0, 9]
+    # A container with positions is not a plain value list
+    with pytest.raises(ValueError):
+        psi_dh.load_values(path)
+
+
+def test_refuses_another_version(tmp_path):
+    path = tmp_path / "old.bin"
+    psi_dh.save_values_to_binary(VALUES, str(path), WIDTH)
+    data = bytearray(path.read_bytes())
+    struct.pack_into(">B", data, len(psi_dh.VALUES_MAGIC), psi_dh.VALUES_FORMAT_VERSION - 1)
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="same client version"):
+        psi_dh.load_values(str(path))
+    with pytest.raises(ValueError, match="same client version"):
+        psi_dh.append_values(str(path), str(tmp_path / "all.bin"))
+
+
+def test_refuses_json_lists(tmp_path):
+    path = tmp_path / "values.json"
+    path.write_text(json.dumps(VALUES))
+
+    with pytest.raises(ValueError, match="older client"):
+        psi_dh.load_values(str(path))